@@ -3,12 +3,69 @@ import cv2
 import uuid
 import torch
 import tempfile
+import threading
 import subprocess
 import numpy as np
 import gradio as gr
 
-from PIL import Image
-from simple_lama_inpainting import SimpleLama
+from watermark_engine import (
+    CLASSICAL_ENGINES,
+    CONTEXT_AUTO,
+    ENGINE_AUTO,
+    ENGINES,
+    FLOW_INTERVAL,
+    JOB_CANCELLED,
+    JOB_FAILED,
+    JOB_POLL_SECONDS,
+    JOB_QUEUED,
+    JOB_WORKERS,
+    LAMA_BATCH_SIZE,
+    OUTPUT_MODES,
+    OUTPUT_RESUMABLE,
+    OUTPUT_STREAM,
+    PIPELINE_QUEUE_DEPTH,
+    REUSE_THRESHOLD,
+    SHARD_WORKERS,
+    TILE_SIZE,
+    WORKSPACE_QUOTA_MB,
+    FFmpegFrameWriter,
+    FlowPropagator,
+    FrameRangeReader,
+    InpaintReuseCache,
+    Job,
+    JobCancelled,
+    JobQueue,
+    LamaRunner,
+    RangesUnsupported,
+    ResourceMonitor,
+    ResumableJob,
+    StageTimer,
+    TimedCapture,
+    Workspace,
+    build_job_report,
+    describe_context,
+    describe_regions,
+    detect_active_ranges,
+    detect_static_mask,
+    format_job_report,
+    format_preview,
+    job_fingerprint,
+    make_batch_processor,
+    make_classical_inpaint,
+    make_tiled_inpaint,
+    parse_time_ranges,
+    plan_context_regions,
+    plan_regions,
+    preview_image,
+    recommend_engine,
+    remove_watermark_ranges,
+    remove_watermark_sharded,
+    render_preview,
+    resolve_engine,
+    reuse_summary,
+    run_frame_pipeline,
+    write_job_report
+)
 
 
 # ============================================================
@@ -63,6 +120,9 @@ print()
 
 # ============================================================
 # WORK DIRECTORY
+#
+# Capped at WORK_DIR_QUOTA_MB; the least recently used files
+# are evicted first.
 # ============================================================
 
 WORK_DIR = os.path.join(
@@ -70,21 +130,40 @@ WORK_DIR = os.path.join(
     "smart_watermark_remover"
 )
 
-os.makedirs(
+WORKSPACE = Workspace(
     WORK_DIR,
-    exist_ok=True
+    WORKSPACE_QUOTA_MB * 1024 * 1024
 )
 
+# Bump when the analysis changes, so saved records of older
+# versions are not reused.
+ANALYSIS_VERSION = 1
+
 
 # ============================================================
 # GLOBAL LAMA MODEL
 # ============================================================
 
+# Shared by every job.
 LAMA = None
 
+# Two jobs that start together load the model only once.
+LAMA_LOCK = threading.Lock()
+
 
 def get_lama():
 
+    if LAMA is None:
+
+        with LAMA_LOCK:
+
+            _load_lama()
+
+    return LAMA
+
+
+def _load_lama():
+
     global LAMA
 
     if LAMA is None:
@@ -94,15 +173,14 @@ def get_lama():
         print("Device:", DEVICE_NAME)
         print("CUDA inference: ENABLED")
 
-        LAMA = SimpleLama(
-            device=DEVICE
+        # Tensor-native wrapper around SimpleLama's model.
+        LAMA = LamaRunner.load(
+            DEVICE
         )
 
         print("LaMa ready.")
         print()
 
-    return LAMA
-
 
 # ============================================================
 # VIDEO PATH
@@ -257,8 +335,172 @@ def show_mask(editor):
 # 6. Keeps the mask conservative.
 #
 # This is NOT blind dilation.
+#
+# GrabCut is multi-scale: the crop is reduced with pyrDown
+# until its longer side is at most GRABCUT_MAX_SIDE, and all
+# iterations run there. The result is upsampled, and only a
+# thin band around its boundary is decided again at full
+# resolution, in one pass with the colour models of the
+# small level. Small components are removed with one lookup
+# table over the label image.
 # ============================================================
 
+# Longer side of the pyramid level GrabCut iterates on.
+GRABCUT_MAX_SIDE = 256
+
+GRABCUT_ITERATIONS = 5
+
+
+def _pyramid_levels(
+    width,
+    height
+):
+
+    levels = 0
+
+    while max(width, height) > GRABCUT_MAX_SIDE:
+
+        width = (width + 1) // 2
+        height = (height + 1) // 2
+        levels += 1
+
+    return levels
+
+
+def _grabcut_labels(
+    rough,
+    core,
+    border
+):
+
+    grab = np.full(
+        rough.shape,
+        cv2.GC_BGD,
+        dtype=np.uint8
+    )
+
+    grab[
+        rough > 0
+    ] = cv2.GC_PR_FGD
+
+    if cv2.countNonZero(core) > 20:
+
+        grab[
+            core > 0
+        ] = cv2.GC_FGD
+
+    grab[:border, :] = cv2.GC_BGD
+    grab[-border:, :] = cv2.GC_BGD
+    grab[:, :border] = cv2.GC_BGD
+    grab[:, -border:] = cv2.GC_BGD
+
+    return grab
+
+
+def _foreground(grab):
+
+    return np.where(
+        (
+            (grab == cv2.GC_FGD)
+            |
+            (grab == cv2.GC_PR_FGD)
+        ),
+        255,
+        0
+    ).astype(np.uint8)
+
+
+def _refine_boundary(
+    crop,
+    crop_rough,
+    small_mask,
+    levels,
+    bgd_model,
+    fgd_model
+):
+
+    ch, cw = crop.shape[:2]
+
+    upsampled = np.where(
+        cv2.resize(
+            small_mask,
+            (cw, ch),
+            interpolation=cv2.INTER_LINEAR
+        ) > 127,
+        255,
+        0
+    ).astype(np.uint8)
+
+    # The coarse boundary is off by up to one cell of the
+    # small level; only that band is uncertain.
+    radius = 2 ** levels
+
+    band_kernel = cv2.getStructuringElement(
+        cv2.MORPH_ELLIPSE,
+        (
+            radius * 2 + 1,
+            radius * 2 + 1
+        )
+    )
+
+    inside = cv2.erode(
+        upsampled,
+        band_kernel
+    )
+
+    outside = cv2.dilate(
+        upsampled,
+        band_kernel
+    )
+
+    # A band that leaves the painted area is background.
+    outside = cv2.bitwise_and(
+        outside,
+        cv2.dilate(
+            crop_rough,
+            band_kernel
+        )
+    )
+
+    grab = np.full(
+        (ch, cw),
+        cv2.GC_BGD,
+        dtype=np.uint8
+    )
+
+    grab[outside > 0] = cv2.GC_PR_BGD
+    grab[upsampled > 0] = cv2.GC_PR_FGD
+    grab[inside > 0] = cv2.GC_FGD
+
+    # One graph cut with the colour models of the small
+    # level (older OpenCV re-estimates them from the mask).
+    mode = getattr(
+        cv2,
+        "GC_EVAL_FREEZE_MODEL",
+        cv2.GC_EVAL
+    )
+
+    try:
+
+        cv2.grabCut(
+            crop,
+            grab,
+            None,
+            bgd_model,
+            fgd_model,
+            1,
+            mode
+        )
+
+    except cv2.error:
+
+        return upsampled
+
+    return _foreground(
+        grab
+    )
+
+
 def smart_refine_mask(
     frame_bgr,
     rough_mask,
@@ -355,24 +597,6 @@ def smart_refine_mask(
     # Rough selection = probable foreground.
     #
     # A smaller inner region = definite foreground.
-    # --------------------------------------------------------
-
-    grab = np.full(
-        (
-            ch,
-            cw
-        ),
-        cv2.GC_BGD,
-        dtype=np.uint8
-    )
-
-    # Soft/probable foreground around rough selection.
-    grab[
-        crop_rough > 0
-    ] = cv2.GC_PR_FGD
-
-    # --------------------------------------------------------
-    # Determine definite foreground core.
     #
     # We intentionally don't make the entire rough mask
     # "definite foreground" because that can make GrabCut
@@ -403,40 +627,45 @@ def smart_refine_mask(
         iterations=1
     )
 
-    if cv2.countNonZero(core) > 20:
-
-        grab[
-            core > 0
-        ] = cv2.GC_FGD
-
     # --------------------------------------------------------
-    # Protect the outer border as background.
+    # Small pyramid level.
+    #
+    # Any painted pixel keeps its cell probable foreground;
+    # a cell is definite foreground only if all of it is.
     # --------------------------------------------------------
 
-    border = max(
-        3,
-        min(cw, ch) // 50
+    levels = _pyramid_levels(
+        cw,
+        ch
     )
 
-    grab[
-        :border,
-        :
-    ] = cv2.GC_BGD
+    small = crop
 
-    grab[
-        -border:,
-        :
-    ] = cv2.GC_BGD
+    for _ in range(levels):
+        small = cv2.pyrDown(small)
 
-    grab[
-        :,
-        :border
-    ] = cv2.GC_BGD
+    sh, sw = small.shape[:2]
 
-    grab[
-        :,
-        -border:
-    ] = cv2.GC_BGD
+    small_rough = cv2.resize(
+        crop_rough,
+        (sw, sh),
+        interpolation=cv2.INTER_AREA
+    )
+
+    small_core = cv2.resize(
+        core,
+        (sw, sh),
+        interpolation=cv2.INTER_AREA
+    )
+
+    grab = _grabcut_labels(
+        np.where(small_rough > 0, 255, 0).astype(np.uint8),
+        np.where(small_core == 255, 255, 0).astype(np.uint8),
+        max(
+            3 if levels == 0 else 1,
+            min(sw, sh) // 50
+        )
+    )
 
     # --------------------------------------------------------
     # GrabCut.
@@ -455,12 +684,12 @@ def smart_refine_mask(
     try:
 
         cv2.grabCut(
-            crop,
+            small,
             grab,
             None,
             bgd_model,
             fgd_model,
-            5,
+            GRABCUT_ITERATIONS,
             cv2.GC_INIT_WITH_MASK
         )
 
@@ -472,15 +701,20 @@ def smart_refine_mask(
 
     else:
 
-        refined_crop = np.where(
-            (
-                (grab == cv2.GC_FGD)
-                |
-                (grab == cv2.GC_PR_FGD)
-            ),
-            255,
-            0
-        ).astype(np.uint8)
+        refined_crop = _foreground(
+            grab
+        )
+
+        if levels:
+
+            refined_crop = _refine_boundary(
+                crop,
+                crop_rough,
+                refined_crop,
+                levels,
+                bgd_model,
+                fgd_model
+            )
 
     # --------------------------------------------------------
     # Keep refinement conservative.
@@ -545,15 +779,11 @@ def smart_refine_mask(
     # Remove tiny connected components.
     # --------------------------------------------------------
 
-    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(
         refined_crop,
         8
     )
 
-    cleaned = np.zeros_like(
-        refined_crop
-    )
-
     min_area = max(
         10,
         int(
@@ -563,23 +793,19 @@ def smart_refine_mask(
         )
     )
 
-    for i in range(
-        1,
-        num_labels
-    ):
-
-        area = stats[
-            i,
-            cv2.CC_STAT_AREA
-        ]
-
-        if area >= min_area:
+    # One lookup over the label image: 255 for every label
+    # that is large enough, 0 for the rest and background.
+    keep = np.where(
+        stats[:, cv2.CC_STAT_AREA] >= min_area,
+        255,
+        0
+    ).astype(np.uint8)
 
-            cleaned[
-                labels == i
-            ] = 255
+    keep[0] = 0
 
-    refined_crop = cleaned
+    refined_crop = keep[
+        labels
+    ]
 
     # --------------------------------------------------------
     # Put local mask back into full frame.
@@ -630,7 +856,8 @@ def smart_refine_mask(
 def analyze_and_select(
     video,
     editor,
-    strength
+    strength,
+    auto_detect=False
 ):
 
     path = get_video_path(video)
@@ -640,10 +867,81 @@ def analyze_and_select(
             "Upload a video first."
         )
 
-    rough_mask = get_rough_mask(
-        editor
+    # --------------------------------------------------------
+    # Same video, selection and strength: the saved analysis
+    # is loaded instead of running detection and GrabCut.
+    # --------------------------------------------------------
+
+    if not auto_detect:
+
+        rough_mask = get_rough_mask(
+            editor
+        )
+
+    analysis_key = job_fingerprint(
+        path,
+        None if auto_detect else rough_mask,
+        {
+            "analysis": ANALYSIS_VERSION,
+            "auto_detect": bool(auto_detect),
+            "strength": int(strength)
+        }
+    )
+
+    cached = WORKSPACE.find_analysis(
+        analysis_key
     )
 
+    if cached is not None:
+
+        data = np.load(
+            cached
+        )
+
+        print(
+            "Analysis    : reused",
+            cached
+        )
+
+        return (
+            data["preview"],
+            data["refined"],
+            str(data["engine"]),
+            str(data["report"])
+            + "\n\n*Saved analysis of this video and "
+            "selection reused.*"
+        )
+
+    # --------------------------------------------------------
+    # Rough mask: painted, or detected from frames sampled
+    # across the video. Either way it is refined below.
+    # --------------------------------------------------------
+
+    if auto_detect:
+
+        try:
+            detection = detect_static_mask(path)
+        except (ValueError, RuntimeError) as error:
+            raise gr.Error(str(error))
+
+        # A margin around the detected strokes gives GrabCut
+        # some background to compare against.
+        margin = max(
+            3,
+            detection["mask"].shape[1] // 200
+        )
+
+        rough_mask = cv2.dilate(
+            detection["mask"],
+            cv2.getStructuringElement(
+                cv2.MORPH_ELLIPSE,
+                (
+                    margin * 2 + 1,
+                    margin * 2 + 1
+                )
+            )
+        )
+
     cap = cv2.VideoCapture(
         path
     )
@@ -779,6 +1077,18 @@ def analyze_and_select(
     else:
         kind = "Large / complex watermark"
 
+    # --------------------------------------------------------
+    # Engine tier: thin text on a smooth background does not
+    # need LaMa.
+    # --------------------------------------------------------
+
+    engine, engine_stats = recommend_engine(
+        gray,
+        refined,
+        count / float(w * h),
+        edge_density
+    )
+
     # --------------------------------------------------------
     # Generate preview.
     # --------------------------------------------------------
@@ -861,6 +1171,12 @@ def analyze_and_select(
 
 **Edge complexity:** `{edge_density:.3f}`
 
+**Recommended engine:** `{engine}`
+
+Stroke width `{engine_stats["stroke_width"]:.1f}px` · background
+edges `{engine_stats["background_edges"]:.3f}`. Change it with
+**Engine** under *Advanced*.
+
 ### Green area
 
 The **green overlay is the mask the remover will use**.
@@ -881,102 +1197,142 @@ because expanding over a person's face, hair, clothing, or
 background can make AI reconstruction worse.
 """
 
+    WORKSPACE.save_analysis(
+        analysis_key,
+        preview=preview,
+        refined=refined,
+        engine=np.array(
+            engine
+        ),
+        report=np.array(
+            report
+        )
+    )
+
     return (
         preview,
         refined,
+        engine,
         report
     )
 
 
 # ============================================================
-# LAMA
+# BATCHED LAMA
+#
+# Every crop of a job has the same shape and mask, so several
+# frames share one CUDA forward pass. Crops go straight from
+# numpy into reused CUDA tensors (under torch.inference_mode),
+# with no PIL conversion or resize.
 # ============================================================
 
-def lama_inpaint(
-    image,
+def lama_inpaint_batch(
+    images,
     mask
 ):
 
-    model = get_lama()
+    return get_lama().inpaint(
+        images,
+        mask
+    )
 
-    h, w = image.shape[:2]
 
-    rgb = cv2.cvtColor(
-        image,
-        cv2.COLOR_BGR2RGB
-    )
+# ============================================================
+# JOB SUMMARY
+#
+# Stage latencies, CPU and memory go to <output>.report.json
+# and to the result panel.
+# ============================================================
+
+def finish_job(
+    output,
+    summary,
+    timer,
+    monitor,
+    settings
+):
 
-    pil_image = Image.fromarray(
-        rgb
+    report = build_job_report(
+        summary,
+        timer,
+        monitor,
+        settings
     )
 
-    pil_mask = Image.fromarray(
-        mask,
-        mode="L"
+    report_file = write_job_report(
+        output,
+        report
     )
 
-    # Keep inference on CUDA and disable autograd to reduce GPU memory
-    # usage and inference overhead.
-    with torch.inference_mode():
-        result = model(
-            pil_image,
-            pil_mask
+    WORKSPACE.enforce(
+        keep=(
+            output,
+            report_file
         )
+    )
 
-    if isinstance(
-        result,
-        Image.Image
-    ):
-
-        result = np.asarray(
-            result
+    print()
+    print("=" * 70)
+    print("DONE")
+    print("=" * 70)
+    print(
+        "Frames      :",
+        summary["frames"]
+    )
+    print(
+        "Speed       :",
+        f"{report['fps']} fps"
+    )
+    print(
+        "Reuse       :",
+        reuse_summary(
+            summary["cache_hits"],
+            summary["cache_misses"]
         )
+    )
 
-    else:
+    if summary.get("flow_keyframes"):
 
-        result = np.asarray(
-            result
+        print(
+            "Flow        :",
+            f"{summary['flow_keyframes']} keyframes / "
+            f"{summary['flow_propagated']} warped"
         )
 
-    result = np.clip(
-        result,
-        0,
-        255
-    ).astype(
-        np.uint8
+    print(
+        "CPU         :",
+        f"{report['resources']['cpu_percent']}%"
     )
+    print(
+        "Peak RAM    :",
+        f"{report['resources']['peak_rss_mb']} MB"
+    )
+    print(output)
+    print(report_file)
+    print()
 
-    if (
-        result.shape[0] != h
-        or
-        result.shape[1] != w
-    ):
-
-        result = cv2.resize(
-            result,
-            (
-                w,
-                h
-            ),
-            interpolation=cv2.INTER_LANCZOS4
-        )
-
-    return cv2.cvtColor(
-        result,
-        cv2.COLOR_RGB2BGR
+    return (
+        output,
+        format_job_report(report)
     )
 
 
 # ============================================================
-# PROCESS VIDEO
+# PREVIEW
 # ============================================================
 
-def remove_watermark(
+def preview_removal(
     video,
     refined_mask,
-    context_padding
+    context_padding,
+    batch_size=LAMA_BATCH_SIZE,
+    engine=ENGINE_AUTO,
+    recommended_engine=None,
+    adaptive_context=False,
+    tile_size=TILE_SIZE
 ):
 
+    # A few cleaned frames plus a full-run time estimate.
     path = get_video_path(video)
 
     if not path:
@@ -989,24 +1345,147 @@ def remove_watermark(
             "Analyze the watermark first."
         )
 
-    mask = np.asarray(
-        refined_mask
+    engine = resolve_engine(
+        engine,
+        recommended_engine
     )
 
-    if mask.ndim == 3:
-        mask = mask[:, :, 0]
+    if engine in CLASSICAL_ENGINES:
+        inpaint_batch = make_classical_inpaint(engine)
+    else:
+        inpaint_batch = make_tiled_inpaint(
+            lama_inpaint_batch,
+            int(tile_size),
+            batch_size=int(batch_size)
+        )
 
-    mask = np.where(
-        mask > 10,
-        255,
-        0
-    ).astype(
-        np.uint8
-    )
+    try:
 
-    if cv2.countNonZero(mask) == 0:
-        raise gr.Error(
-            "Automatic mask is empty."
+        preview = render_preview(
+            path,
+            refined_mask,
+            inpaint_batch,
+            context_padding=(
+                CONTEXT_AUTO
+                if adaptive_context
+                else int(context_padding)
+            ),
+            batch_size=int(batch_size)
+        )
+
+    except Exception as error:
+
+        raise gr.Error(
+            "Preview failed:\n\n"
+            + str(error)
+        )
+
+    gallery = [
+        (
+            preview_image(sample, preview["box"]),
+            f"Frame {sample['frame']} · before | after"
+        )
+        for sample in preview["frames"]
+    ]
+
+    return (
+        gallery,
+        format_preview(preview)
+    )
+
+
+# ============================================================
+# TIME RANGES
+# ============================================================
+
+def get_time_ranges(
+    text,
+    path,
+    mask
+):
+
+    # Blank = whole video, "auto" = detect, else "0:10-0:25".
+    text = (text or "").strip()
+
+    if not text:
+        return None
+
+    if text.lower() == "auto":
+
+        ranges = detect_active_ranges(
+            path,
+            mask
+        )
+
+        if not ranges:
+            raise gr.Error(
+                "Watermark not visible at any time. Clear "
+                "Time Ranges to process the whole video."
+            )
+
+        return ranges
+
+    try:
+        return parse_time_ranges(text)
+    except ValueError as error:
+        raise gr.Error(str(error))
+
+
+# ============================================================
+# PROCESS VIDEO
+# ============================================================
+
+def remove_watermark(
+    video,
+    refined_mask,
+    context_padding,
+    queue_depth=PIPELINE_QUEUE_DEPTH,
+    batch_size=LAMA_BATCH_SIZE,
+    output_mode=OUTPUT_STREAM,
+    workers=SHARD_WORKERS,
+    reuse_threshold=REUSE_THRESHOLD,
+    engine=ENGINE_AUTO,
+    recommended_engine=None,
+    time_ranges="",
+    adaptive_context=False,
+    flow_interval=FLOW_INTERVAL,
+    tile_size=TILE_SIZE,
+    job=None
+):
+
+    path = get_video_path(video)
+
+    if not path:
+        raise gr.Error(
+            "Upload a video first."
+        )
+
+    # Progress and cancellation go through the queued job.
+    job = job or Job()
+
+    if refined_mask is None:
+        raise gr.Error(
+            "Analyze the watermark first."
+        )
+
+    mask = np.asarray(
+        refined_mask
+    )
+
+    if mask.ndim == 3:
+        mask = mask[:, :, 0]
+
+    mask = np.where(
+        mask > 10,
+        255,
+        0
+    ).astype(
+        np.uint8
+    )
+
+    if cv2.countNonZero(mask) == 0:
+        raise gr.Error(
+            "Automatic mask is empty."
         )
 
     cap = cv2.VideoCapture(
@@ -1066,36 +1545,53 @@ def remove_watermark(
     # Context region.
     # --------------------------------------------------------
 
-    ys, xs = np.where(
-        mask > 0
+    # One padded context crop per separate part of the mask.
+    regions = plan_regions(
+        mask,
+        int(context_padding)
     )
 
-    x1 = max(
-        0,
-        int(xs.min()) - int(context_padding)
-    )
+    if not regions:
 
-    y1 = max(
-        0,
-        int(ys.min()) - int(context_padding)
-    )
+        cap.release()
 
-    x2 = min(
-        width,
-        int(xs.max()) + int(context_padding) + 1
-    )
+        raise gr.Error(
+            "Automatic mask is empty."
+        )
 
-    y2 = min(
-        height,
-        int(ys.max()) + int(context_padding) + 1
-    )
+    padding = int(context_padding)
 
-    local_mask = mask[
-        y1:y2,
-        x1:x2
-    ]
+    # Adaptive: smallest context the background needs.
+    if adaptive_context:
+
+        fixed_regions = regions
+
+        try:
+            regions, padding = plan_context_regions(
+                path,
+                mask,
+                CONTEXT_AUTO
+            )
+        except Exception as error:
+            cap.release()
+            raise gr.Error(
+                "Adaptive context failed:\n\n"
+                + str(error)
+            )
+
+        context_note = describe_context(
+            regions,
+            padding,
+            fixed_regions,
+            int(context_padding)
+        )
 
-    crop_h, crop_w = local_mask.shape
+    else:
+
+        context_note = describe_context(
+            regions,
+            padding
+        )
 
     print()
     print("=" * 70)
@@ -1105,172 +1601,596 @@ def remove_watermark(
     print("FPS         :", f"{fps:.2f}")
     print("Frames      :", total)
     print(
-        "AI region   :",
-        f"{crop_w}x{crop_h}"
+        "AI regions  :",
+        describe_regions(regions)
     )
     print(
         "Context     :",
-        f"{context_padding}px"
+        context_note
+    )
+    print(
+        "Queue       :",
+        f"{int(queue_depth)} frames"
+    )
+    print(
+        "Batch       :",
+        f"{int(batch_size)} frames"
+    )
+    print(
+        "Workers     :",
+        int(workers)
     )
+    engine = resolve_engine(
+        engine,
+        recommended_engine
+    )
+
+    print("Engine      :", engine)
     print("Device      :", DEVICE_NAME)
     print("=" * 70)
     print()
 
     # --------------------------------------------------------
-    # Files.
+    # Job report instrumentation.
     # --------------------------------------------------------
 
-    job = uuid.uuid4().hex
+    timer = StageTimer()
+
+    monitor = ResourceMonitor()
+
+    settings = {
+        "video": f"{width}x{height}",
+        "fps": fps,
+        "context": padding,
+        "adaptive_context": bool(adaptive_context),
+        "crop": context_note,
+        "queue_depth": int(queue_depth),
+        "batch_size": int(batch_size),
+        "workers": int(workers),
+        "output_mode": output_mode,
+        "reuse_threshold": float(reuse_threshold),
+        "flow_interval": int(flow_interval),
+        "tile_size": int(tile_size),
+        "engine": engine,
+        "device": DEVICE_NAME
+    }
+
+    # --------------------------------------------------------
+    # Files. Older results are evicted first so the silent
+    # and final videos of this job fit the quota.
+    # --------------------------------------------------------
+
+    evicted = WORKSPACE.enforce(
+        reserve_bytes=2 * os.path.getsize(path)
+    )
+
+    if evicted:
+
+        print(
+            "Workspace   :",
+            f"evicted {len(evicted)} old file(s)"
+        )
+
+    run_id = uuid.uuid4().hex
 
     silent = os.path.join(
         WORK_DIR,
-        f"{job}_silent.mp4"
+        f"{run_id}_silent.mp4"
     )
 
     output = os.path.join(
         WORK_DIR,
-        f"{job}_removed.mp4"
+        f"{run_id}_removed.mp4"
     )
 
     # --------------------------------------------------------
-    # Writer.
+    # Frame processing (AI stage of the pipeline).
     # --------------------------------------------------------
 
-    fourcc = cv2.VideoWriter_fourcc(
-        *"mp4v"
+    reuse_cache = InpaintReuseCache(
+        reuse_threshold
     )
 
-    writer = cv2.VideoWriter(
-        silent,
-        fourcc,
-        fps,
-        (
-            width,
-            height
+    flow = FlowPropagator(
+        int(flow_interval)
+    )
+
+    if engine in CLASSICAL_ENGINES:
+        inpaint_batch = make_classical_inpaint(engine)
+    else:
+        inpaint_batch = make_tiled_inpaint(
+            lama_inpaint_batch,
+            int(tile_size),
+            batch_size=int(batch_size)
         )
+
+    process_batch = make_batch_processor(
+        inpaint_batch,
+        regions,
+        cache=reuse_cache,
+        timer=timer,
+        flow=flow
     )
 
-    if not writer.isOpened():
+    # ========================================================
+    # TIME-RANGE MODE
+    #
+    # Only the keyframe-aligned spans are processed, the rest
+    # of the video is stream-copied. Sources that cannot be
+    # stream-copied are rejected with the reason: frames
+    # outside the ranges are never inpainted.
+    # ========================================================
+
+    ranges = get_time_ranges(
+        time_ranges,
+        path,
+        mask
+    )
+
+    if ranges:
+
+        settings["time_ranges"] = ranges
+
+        def show_range_progress(processed):
+
+            job.report(
+                message=f"Ranges: {processed} frames"
+            )
+
+            if processed % 5 == 0:
+                print(
+                    f"\rRanges: {processed} frames",
+                    end="",
+                    flush=True
+                )
+
+        try:
+
+            summary = remove_watermark_ranges(
+                path,
+                output,
+                ranges,
+                process_batch,
+                width,
+                height,
+                queue_depth=queue_depth,
+                batch_size=batch_size,
+                on_progress=show_range_progress,
+                timer=timer
+            )
+
+        except RangesUnsupported as error:
+
+            cap.release()
+
+            raise gr.Error(
+                "Time ranges cannot be used with this video:\n\n"
+                + str(error)
+                + "\n\nClear Time Ranges to process the whole "
+                "video."
+            )
+
+        except FileNotFoundError:
+
+            cap.release()
+
+            raise gr.Error(
+                "FFmpeg is not installed.\n\n"
+                "Fedora:\n"
+                "sudo dnf install ffmpeg"
+            )
+
+        except JobCancelled:
+
+            cap.release()
+
+            raise
+
+        except Exception as error:
+
+            cap.release()
+
+            raise gr.Error(
+                "Watermark removal failed:\n\n"
+                + str(error)
+            )
 
         cap.release()
 
-        raise gr.Error(
-            "Could not create output video."
+        print()
+        print(
+            "Copied      :",
+            f"{summary['copied_seconds']:.1f} s"
+        )
+        print(
+            "Processed   :",
+            f"{summary['processed_seconds']:.1f} s"
         )
 
-    processed = 0
+        summary.update(
+            reuse_cache.stats()
+        )
 
-    try:
+        summary.update(
+            flow.stats()
+        )
+
+        return finish_job(
+            output,
+            summary,
+            timer,
+            monitor,
+            settings
+        )
 
-        while True:
+    # ========================================================
+    # TIME-SHARDED PARALLEL MODE
+    #
+    # One worker process per time range, each with its own
+    # LaMa instance. Segments are joined without re-encoding.
+    # ========================================================
 
-            ok, frame = cap.read()
+    if int(workers) > 1:
 
-            if not ok:
-                break
+        cap.release()
 
-            original = frame.copy()
+        def show_shards(finished, count):
 
-            crop = original[
-                y1:y2,
-                x1:x2
-            ].copy()
+            print(
+                f"Segment {finished}/{count} finished",
+                flush=True
+            )
 
-            if (
-                crop.shape[:2]
-                != local_mask.shape[:2]
-            ):
+            job.report(
+                finished / count,
+                f"Segment {finished}/{count} finished"
+            )
 
-                raise RuntimeError(
-                    "Video crop and mask dimensions differ."
-                )
+        try:
 
-            # ------------------------------------------------
-            # AI CONTENT-AWARE RECONSTRUCTION
-            # ------------------------------------------------
+            summary = remove_watermark_sharded(
+                path,
+                output,
+                regions,
+                width,
+                height,
+                fps,
+                total,
+                int(workers),
+                DEVICE,
+                queue_depth=queue_depth,
+                batch_size=batch_size,
+                reuse_threshold=reuse_threshold,
+                flow_interval=int(flow_interval),
+                tile_size=int(tile_size),
+                on_progress=show_shards,
+                timer=timer,
+                engine=engine,
+                cancel_event=job.cancel_event
+            )
 
-            reconstructed = lama_inpaint(
-                crop,
-                local_mask
+        except FileNotFoundError:
+            raise gr.Error(
+                "FFmpeg is not installed.\n\n"
+                "Fedora:\n"
+                "sudo dnf install ffmpeg"
             )
 
-            # ------------------------------------------------
-            # ONLY REPLACE AUTO-DETECTED MASK
-            # ------------------------------------------------
+        except JobCancelled:
+            raise
 
-            selected = (
-                local_mask > 0
+        except Exception as error:
+            raise gr.Error(
+                "Removal failed:\n\n"
+                + str(error)
             )
 
-            clean_crop = crop.copy()
+        if summary["frames"] == 0:
+            raise gr.Error(
+                "No frames were processed."
+            )
+
+        return finish_job(
+            output,
+            summary,
+            timer,
+            monitor,
+            settings
+        )
+
+    # --------------------------------------------------------
+    # Writer.
+    #
+    # Stream mode: raw frames → one ffmpeg process that
+    # encodes x264 and muxes the original audio.
+    #
+    # Resumable mode: checkpoint segments + manifest, so an
+    # interrupted job continues where it stopped.
+    #
+    # Legacy mode: mp4v file, then a second ffmpeg encode.
+    # --------------------------------------------------------
+
+    stream_output = (
+        output_mode == OUTPUT_STREAM
+    )
+
+    resumable = (
+        output_mode == OUTPUT_RESUMABLE
+    )
+
+    reader = cap
+
+    resumed_from = 0
 
-            clean_crop[
-                selected
-            ] = reconstructed[
-                selected
-            ]
+    if resumable:
 
-            result = original.copy()
+        writer = ResumableJob(
+            WORK_DIR,
+            # Everything that changes the output pixels, so a
+            # run with other settings never resumes this one.
+            job_fingerprint(
+                path,
+                mask,
+                {
+                    "context": padding,
+                    "adaptive_context": bool(adaptive_context),
+                    "regions": [
+                        list(region["box"])
+                        for region in regions
+                    ],
+                    "reuse": float(reuse_threshold),
+                    "flow": int(flow_interval),
+                    "tile": int(tile_size),
+                    "engine": engine
+                }
+            ),
+            width,
+            height,
+            fps
+        )
 
-            result[
-                y1:y2,
-                x1:x2
-            ] = clean_crop
+        resumed_from = writer.start_frame
 
-            writer.write(
-                result
+        reader = FrameRangeReader(
+            cap,
+            resumed_from
+        )
+
+        if resumed_from:
+            print(
+                "Resuming    :",
+                f"frame {resumed_from}"
             )
 
-            processed += 1
+    elif stream_output:
 
-            if processed % 5 == 0:
+        try:
 
-                percent = (
-                    processed
-                    /
-                    max(
-                        total,
-                        1
-                    )
-                ) * 100
+            writer = FFmpegFrameWriter(
+                output,
+                width,
+                height,
+                fps,
+                audio_source=path
+            )
 
-                print(
-                    f"\rProcessing "
-                    f"{processed}/{total} "
-                    f"({percent:.1f}%)",
-                    end="",
-                    flush=True
+        except FileNotFoundError:
+
+            cap.release()
+
+            raise gr.Error(
+                "FFmpeg is not installed.\n\n"
+                "Fedora:\n"
+                "sudo dnf install ffmpeg"
+            )
+
+    else:
+
+        fourcc = cv2.VideoWriter_fourcc(
+            *"mp4v"
+        )
+
+        writer = cv2.VideoWriter(
+            silent,
+            fourcc,
+            fps,
+            (
+                width,
+                height
+            )
+        )
+
+    if not writer.isOpened():
+
+        cap.release()
+
+        raise gr.Error(
+            "Could not create output video."
+        )
+
+    def show_progress(processed):
+
+        # A resumed run counts the frames already in finished
+        # segments, so the bar continues where it stopped.
+        processed += resumed_from
+
+        # Raises JobCancelled, which stops the frame loop.
+        job.report(
+            processed
+            /
+            max(
+                total,
+                1
+            )
+        )
+
+        if processed % 5 == 0:
+
+            percent = (
+                processed
+                /
+                max(
+                    total,
+                    1
                 )
+            ) * 100
+
+            p50, p95 = timer.percentiles(
+                "inference"
+            )
+
+            latency = ""
+
+            if p50 is not None:
+                latency = (
+                    f" | AI p50 {p50:.0f} ms"
+                    f" p95 {p95:.0f} ms"
+                )
+
+            print(
+                f"\rProcessing "
+                f"{processed}/{total} "
+                f"({percent:.1f}%)"
+                f"{latency}",
+                end="",
+                flush=True
+            )
+
+            job.report(
+                message=f"Frame {processed}/{total}{latency}"
+            )
+
+    # --------------------------------------------------------
+    # decode → AI → encode pipeline.
+    # --------------------------------------------------------
+
+    try:
+
+        processed = run_frame_pipeline(
+            TimedCapture(reader, timer),
+            process_batch,
+            timer.wrap("encode", writer.write),
+            queue_depth=queue_depth,
+            batch_size=batch_size,
+            on_progress=show_progress
+        )
+
+        if resumable:
+            writer.finish()
 
     except Exception as error:
 
         cap.release()
         writer.release()
 
-        if os.path.exists(silent):
-            os.remove(silent)
+        for leftover in (silent, output):
+            if os.path.exists(leftover):
+                os.remove(leftover)
 
-        raise gr.Error(
+        if isinstance(error, JobCancelled):
+            raise
+
+        message = (
             "Removal failed:\n\n"
             + str(error)
         )
 
+        if resumable:
+            message += (
+                "\n\nFinished segments were kept. "
+                "Run the same job again to resume."
+            )
+
+        raise gr.Error(
+            message
+        )
+
     cap.release()
-    writer.release()
+
+    # Too late to cancel: the encoder is flushed either way.
+    job.message = "Finishing the video"
+
+    # Flushes the encoder (stream mode: the whole mux).
+    timer.wrap(
+        "mux",
+        writer.release
+    )()
 
     print()
 
-    if processed == 0:
+    if processed == 0 and not resumed_from:
 
-        if os.path.exists(silent):
-            os.remove(silent)
+        for leftover in (silent, output):
+            if os.path.exists(leftover):
+                os.remove(leftover)
 
         raise gr.Error(
             "No frames were processed."
         )
 
+    summary = reuse_cache.stats()
+
+    summary.update(
+        flow.stats()
+    )
+
+    summary["frames"] = processed
+
+    if resumable:
+
+        try:
+            timer.wrap(
+                "mux",
+                writer.complete
+            )(
+                output,
+                audio_source=path
+            )
+
+        except FileNotFoundError:
+            raise gr.Error(
+                "FFmpeg is not installed.\n\n"
+                "Fedora:\n"
+                "sudo dnf install ffmpeg"
+            )
+
+        except RuntimeError as error:
+            raise gr.Error(
+                "FFmpeg error:\n\n"
+                + str(error)
+            )
+
+        return finish_job(
+            output,
+            summary,
+            timer,
+            monitor,
+            settings
+        )
+
+    if stream_output:
+
+        if writer.returncode != 0:
+            raise gr.Error(
+                "FFmpeg error:\n\n"
+                + writer.error_output()
+            )
+
+        if not os.path.exists(output):
+            raise gr.Error(
+                "Output video was not created."
+            )
+
+        return finish_job(
+            output,
+            summary,
+            timer,
+            monitor,
+            settings
+        )
+
     # ========================================================
-    # RESTORE AUDIO
+    # RESTORE AUDIO (legacy output mode)
     # ========================================================
 
     command = [
@@ -1315,7 +2235,10 @@ def remove_watermark(
 
     try:
 
-        ff = subprocess.run(
+        ff = timer.wrap(
+            "mux",
+            subprocess.run
+        )(
             command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -1357,14 +2280,113 @@ def remove_watermark(
     except OSError:
         pass
 
-    print()
-    print("=" * 70)
-    print("DONE")
-    print("=" * 70)
-    print(output)
-    print()
+    return finish_job(
+        output,
+        summary,
+        timer,
+        monitor,
+        settings
+    )
+
+
+# ============================================================
+# JOB QUEUE
+#
+# At most JOB_WORKERS removals run at once, all on the same
+# GPU model; the rest wait in line. Each request streams its
+# place in line, then the progress, then the result. Cancel
+# (or closing the page) stops the job.
+# ============================================================
+
+JOB_QUEUE = JobQueue(
+    JOB_WORKERS
+)
 
-    return output
+
+def describe_job(job):
+
+    if job.state == JOB_QUEUED:
+
+        running, waiting = JOB_QUEUE.counts()
+
+        return (
+            f"⏳ **Waiting in line:** "
+            f"{JOB_QUEUE.position(job)} of {waiting} "
+            f"({running} job(s) running)"
+        )
+
+    status = (
+        f"⚙️ **Removing:** {job.progress * 100:.0f}%"
+    )
+
+    if job.message:
+        status += f" · {job.message}"
+
+    return status
+
+
+def queue_removal(*settings):
+
+    job = JOB_QUEUE.submit(
+        remove_watermark,
+        *settings
+    )
+
+    try:
+
+        while not job.wait(JOB_POLL_SECONDS):
+
+            yield (
+                job.id,
+                None,
+                describe_job(job)
+            )
+
+    finally:
+
+        # The page was closed: the work stops as well.
+        if not job.finished:
+
+            JOB_QUEUE.cancel(
+                job.id
+            )
+
+    if job.state == JOB_CANCELLED:
+
+        yield (
+            None,
+            None,
+            "🛑 **Cancelled.**"
+        )
+
+        return
+
+    if job.state == JOB_FAILED:
+
+        if isinstance(job.error, gr.Error):
+            raise job.error
+
+        raise gr.Error(
+            "Removal failed:\n\n"
+            + str(job.error)
+        )
+
+    final_file, report = job.result
+
+    yield (
+        None,
+        final_file,
+        report
+    )
+
+
+def cancel_removal(job_id):
+
+    if job_id:
+
+        JOB_QUEUE.cancel(
+            job_id
+        )
 
 
 # ============================================================
@@ -1519,6 +2541,11 @@ It does **not** simply make your mask bigger.
                 label="Selection Strength"
             )
 
+            auto_detect = gr.Checkbox(
+                value=False,
+                label="Auto-detect (no painting)"
+            )
+
     auto_preview = gr.Image(
         label="🟢 Automatically Detected Watermark",
         type="numpy",
@@ -1533,16 +2560,22 @@ It does **not** simply make your mask bigger.
         None
     )
 
+    recommended_engine = gr.State(
+        None
+    )
+
     analyze_button.click(
         fn=analyze_and_select,
         inputs=[
             video,
             editor,
-            strength
+            strength,
+            auto_detect
         ],
         outputs=[
             auto_preview,
             refined_mask,
+            recommended_engine,
             analysis_text
         ]
     )
@@ -1567,6 +2600,118 @@ It does **not** simply make your mask bigger.
             )
         )
 
+        adaptive_context = gr.Checkbox(
+            value=False,
+            label="Adaptive Context",
+            info=(
+                "Use the smallest context the background needs "
+                "instead of the slider."
+            )
+        )
+
+        queue_depth = gr.Slider(
+            minimum=1,
+            maximum=64,
+            value=PIPELINE_QUEUE_DEPTH,
+            step=1,
+            label="Pipeline Queue Depth",
+            info=(
+                "Frames buffered between decoding, AI and encoding."
+            )
+        )
+
+        batch_size = gr.Slider(
+            minimum=1,
+            maximum=16,
+            value=LAMA_BATCH_SIZE,
+            step=1,
+            label="AI Batch Size",
+            info=(
+                "Consecutive frames reconstructed in one LaMa pass."
+            )
+        )
+
+        tile_size = gr.Slider(
+            minimum=0,
+            maximum=2048,
+            value=TILE_SIZE,
+            step=64,
+            label="AI Tile Size",
+            info=(
+                "Crops larger than this are inpainted as blended "
+                "overlapping tiles (bounded GPU memory). 0 = off."
+            )
+        )
+
+        output_mode = gr.Radio(
+            choices=OUTPUT_MODES,
+            value=OUTPUT_STREAM,
+            label="Output Mode",
+            info=(
+                "Streaming encodes once and copies the original "
+                "audio when possible. Resumable mode saves "
+                "checkpoints and continues interrupted jobs."
+            )
+        )
+
+        workers = gr.Slider(
+            minimum=1,
+            maximum=8,
+            value=SHARD_WORKERS,
+            step=1,
+            label="Parallel Workers",
+            info=(
+                "Worker processes sharing the GPU, one time range "
+                "and one LaMa copy each. 1 = single process."
+            )
+        )
+
+        reuse_threshold = gr.Slider(
+            minimum=0,
+            maximum=10,
+            value=REUSE_THRESHOLD,
+            step=0.5,
+            label="Static Background Reuse",
+            info=(
+                "Skip LaMa when the region barely changed since a "
+                "recent frame. 0 = always run the AI."
+            )
+        )
+
+        flow_interval = gr.Slider(
+            minimum=0,
+            maximum=60,
+            value=FLOW_INTERVAL,
+            step=1,
+            label="Flow Keyframe Interval",
+            info=(
+                "Run LaMa every N frames and warp its result into "
+                "the frames in between (optical flow). Re-runs on "
+                "scene cuts. 0 = off."
+            )
+        )
+
+        engine = gr.Dropdown(
+            choices=ENGINES,
+            value=ENGINE_AUTO,
+            label="Engine",
+            info=(
+                "Auto = engine recommended by the analysis. "
+                "Classical engines run on the CPU in "
+                "milliseconds and suit thin text."
+            )
+        )
+
+        time_ranges = gr.Textbox(
+            label="Time Ranges",
+            placeholder="0:10-0:25, 19:50-",
+            info=(
+                "Process only these parts and copy the rest "
+                "untouched (H.264). Blank = whole video, "
+                "auto = detect when the watermark is visible."
+            )
+        )
+
     # ========================================================
     # REMOVE
     # ========================================================
@@ -1575,14 +2720,41 @@ It does **not** simply make your mask bigger.
         """
 ## 4️⃣ Remove
 
-After the green mask looks correct, click Remove.
+After the green mask looks correct, click Remove. Preview
+cleans a few frames first and estimates the full run time.
 """
     )
 
-    remove_button = gr.Button(
-        "✨ REMOVE WATERMARK",
-        variant="primary",
-        size="lg"
+    preview_button = gr.Button(
+        "👁️ PREVIEW A FEW FRAMES"
+    )
+
+    preview_gallery = gr.Gallery(
+        label="Preview (before | after)",
+        columns=2,
+        height="auto"
+    )
+
+    preview_report = gr.Markdown()
+
+    with gr.Row():
+
+        remove_button = gr.Button(
+            "✨ REMOVE WATERMARK",
+            variant="primary",
+            size="lg",
+            scale=3
+        )
+
+        cancel_button = gr.Button(
+            "🛑 CANCEL",
+            size="lg",
+            scale=1
+        )
+
+    # Id of this session's queued job.
+    job_id = gr.State(
+        None
     )
 
     output = gr.Video(
@@ -1590,14 +2762,58 @@ After the green mask looks correct, click Remove.
         format="mp4"
     )
 
+    job_report = gr.Markdown()
+
+    preview_button.click(
+        fn=preview_removal,
+        inputs=[
+            video,
+            refined_mask,
+            context,
+            batch_size,
+            engine,
+            recommended_engine,
+            adaptive_context,
+            tile_size
+        ],
+        outputs=[
+            preview_gallery,
+            preview_report
+        ]
+    )
+
+    # Every request may wait in the job queue, which shows
+    # the position in line; it limits the work instead.
     remove_button.click(
-        fn=remove_watermark,
+        fn=queue_removal,
         inputs=[
             video,
             refined_mask,
-            context
+            context,
+            queue_depth,
+            batch_size,
+            output_mode,
+            workers,
+            reuse_threshold,
+            engine,
+            recommended_engine,
+            time_ranges,
+            adaptive_context,
+            flow_interval,
+            tile_size
+        ],
+        outputs=[
+            job_id,
+            output,
+            job_report
         ],
-        outputs=output
+        concurrency_limit=None
+    )
+
+    cancel_button.click(
+        fn=cancel_removal,
+        inputs=job_id,
+        concurrency_limit=None
     )
 
     # ========================================================
@@ -4,12 +4,75 @@ import uuid
 import torch
 import argparse
 import tempfile
+import functools
+import threading
 import subprocess
 import numpy as np
 import gradio as gr
 
-from PIL import Image
-from simple_lama_inpainting import SimpleLama
+from watermark_engine import (
+    CLASSICAL_ENGINES,
+    CONTEXT_AUTO,
+    ENGINE_AUTO,
+    ENGINE_LAMA,
+    ENGINES,
+    FLOW_INTERVAL,
+    JOB_CANCELLED,
+    JOB_FAILED,
+    JOB_POLL_SECONDS,
+    JOB_QUEUED,
+    JOB_WORKERS,
+    LAMA_BATCH_SIZE,
+    LAMA_EXPORT_PATH,
+    OUTPUT_MODES,
+    OUTPUT_RESUMABLE,
+    OUTPUT_STREAM,
+    PIPELINE_QUEUE_DEPTH,
+    PRECISION_FP32,
+    PRECISIONS,
+    REUSE_THRESHOLD,
+    SHARD_WORKERS,
+    TILE_SIZE,
+    WORKSPACE_QUOTA_MB,
+    FFmpegFrameWriter,
+    FlowPropagator,
+    FrameRangeReader,
+    InpaintReuseCache,
+    Job,
+    JobCancelled,
+    JobQueue,
+    LamaRunner,
+    RangesUnsupported,
+    ResourceMonitor,
+    ResumableJob,
+    StageTimer,
+    TimedCapture,
+    Workspace,
+    build_job_report,
+    configure_threads,
+    describe_context,
+    describe_regions,
+    detect_active_ranges,
+    detect_static_mask,
+    format_job_report,
+    format_preview,
+    job_fingerprint,
+    make_batch_processor,
+    make_classical_inpaint,
+    make_tiled_inpaint,
+    parse_time_ranges,
+    plan_context_regions,
+    plan_regions,
+    preview_image,
+    recommend_engine,
+    remove_watermark_ranges,
+    remove_watermark_sharded,
+    render_preview,
+    resolve_engine,
+    reuse_summary,
+    run_frame_pipeline,
+    write_job_report
+)
 
 
 # ============================================================
@@ -18,6 +81,11 @@ from simple_lama_inpainting import SimpleLama
 # python app.py
 # python app.py -cpu
 # python app.py -gpu
+#
+# python app.py -cpu --threads 16 --interop-threads 2
+# python app.py -cpu --lama-model /models/lama-cpu.pt
+# python app.py --work-quota-mb 20000
+# python app.py --job-workers 2
 # ============================================================
 
 parser = argparse.ArgumentParser(
@@ -38,6 +106,46 @@ device_group.add_argument(
     help="Force NVIDIA CUDA GPU"
 )
 
+parser.add_argument(
+    "--threads",
+    type=int,
+    help="PyTorch intra-op threads (default: all cores)"
+)
+
+parser.add_argument(
+    "--interop-threads",
+    type=int,
+    help="PyTorch inter-op threads"
+)
+
+parser.add_argument(
+    "--lama-model",
+    help=(
+        "Exported CPU LaMa graph from export-lama.py "
+        "(default: the exported file, when it exists)"
+    )
+)
+
+parser.add_argument(
+    "--work-quota-mb",
+    type=int,
+    default=WORKSPACE_QUOTA_MB,
+    help=(
+        "Size limit of the work folder in MB; least recently "
+        "used files are deleted beyond it (0 = unlimited)"
+    )
+)
+
+parser.add_argument(
+    "--job-workers",
+    type=int,
+    default=JOB_WORKERS,
+    help=(
+        "Removal jobs that run at the same time; later jobs "
+        "wait in line (default: JOB_WORKERS or 1)"
+    )
+)
+
 args = parser.parse_args()
 
 
@@ -78,12 +186,35 @@ else:
         MODE = "AUTO → CPU"
 
 
+THREADS = configure_threads(
+    args.threads,
+    args.interop_threads
+)
+
+# The exported graph is CPU-only.
+LAMA_MODEL_PATH = None
+
+if DEVICE.type == "cpu":
+
+    if args.lama_model:
+        LAMA_MODEL_PATH = args.lama_model
+
+    elif os.path.exists(LAMA_EXPORT_PATH):
+        LAMA_MODEL_PATH = LAMA_EXPORT_PATH
+
+
 print()
 print("=" * 70)
 print("          AUTOMATIC AI VIDEO WATERMARK REMOVER")
 print("=" * 70)
 print("Mode   :", MODE)
 print("Device :", DEVICE_LABEL)
+print(
+    "Threads:",
+    f"{THREADS['intra_op']} intra-op,",
+    f"{THREADS['inter_op']} inter-op"
+)
+print("Model  :", LAMA_MODEL_PATH or "SimpleLama (not exported)")
 print("=" * 70)
 print()
 
@@ -97,9 +228,14 @@ WORK_DIR = os.path.join(
     "automatic_watermark_remover"
 )
 
-os.makedirs(
+# Bump when the analysis changes, so saved records of older
+# versions are not reused.
+ANALYSIS_VERSION = 1
+
+# Size-capped, with least recently used files evicted.
+WORKSPACE = Workspace(
     WORK_DIR,
-    exist_ok=True
+    args.work_quota_mb * 1024 * 1024
 )
 
 
@@ -107,27 +243,70 @@ os.makedirs(
 # MODEL
 # ============================================================
 
-LAMA_MODEL = None
+# One loaded model per CPU precision, shared by every job.
+LAMA_MODELS = {}
+
+# Two jobs that start together load the model only once.
+LAMA_LOCK = threading.Lock()
+
+
+def get_lama(
+    precision=PRECISION_FP32
+):
+
+    model = LAMA_MODELS.get(
+        precision
+    )
+
+    if model is None:
+
+        with LAMA_LOCK:
 
+            model = _load_lama(
+                precision
+            )
+
+    return model
 
-def get_lama():
 
-    global LAMA_MODEL
+def _load_lama(
+    precision
+):
 
-    if LAMA_MODEL is None:
+    if precision not in LAMA_MODELS:
 
         print()
         print("Loading LaMa...")
         print("Device:", DEVICE_LABEL)
+        print("Precision:", precision)
 
-        LAMA_MODEL = SimpleLama(
-            device=DEVICE
-        )
+        # Tensor-native wrapper around SimpleLama's model,
+        # or the exported graph when there is one.
+        try:
+
+            LAMA_MODELS[precision] = LamaRunner.load(
+                DEVICE,
+                precision,
+                LAMA_MODEL_PATH
+            )
+
+        except Exception as error:
+
+            if not LAMA_MODEL_PATH:
+                raise
+
+            print("Exported model failed:", error)
+            print("Falling back to SimpleLama.")
+
+            LAMA_MODELS[precision] = LamaRunner.load(
+                DEVICE,
+                precision
+            )
 
         print("LaMa loaded.")
         print()
 
-    return LAMA_MODEL
+    return LAMA_MODELS[precision]
 
 
 # ============================================================
@@ -283,7 +462,8 @@ def preview_mask(editor):
 
 def analyze_watermark(
     video,
-    editor
+    editor,
+    auto_detect=False
 ):
 
     path = get_video_path(video)
@@ -294,10 +474,84 @@ def analyze_watermark(
             "Upload a video first."
         )
 
-    user_mask = extract_mask(
-        editor
+    # --------------------------------------------------------
+    # Same video + same selection: the saved analysis is
+    # loaded instead of decoding the video again.
+    # --------------------------------------------------------
+
+    if auto_detect:
+
+        analysis_key = job_fingerprint(
+            path,
+            None,
+            {
+                "analysis": ANALYSIS_VERSION,
+                "auto_detect": True
+            }
+        )
+
+    else:
+
+        user_mask = extract_mask(
+            editor
+        )
+
+        analysis_key = job_fingerprint(
+            path,
+            user_mask,
+            {
+                "analysis": ANALYSIS_VERSION
+            }
+        )
+
+    cached = WORKSPACE.find_analysis(
+        analysis_key
     )
 
+    if cached is not None:
+
+        print(
+            "Analysis   : reused",
+            cached
+        )
+
+        return (
+            str(np.load(cached)["report"])
+            + "\n\n*Saved analysis of this video and "
+            "selection reused.*",
+            cached
+        )
+
+    # --------------------------------------------------------
+    # Painted selection, or a mask found from frames sampled
+    # across the whole video.
+    # --------------------------------------------------------
+
+    if auto_detect:
+
+        try:
+
+            detection = detect_static_mask(
+                path
+            )
+
+        except (ValueError, RuntimeError) as error:
+
+            raise gr.Error(
+                str(error)
+            )
+
+        user_mask = detection["mask"]
+
+        mask_source = (
+            f"Auto-detected from {detection['samples']} "
+            f"sampled frames ({detection['parts']} parts)"
+        )
+
+    else:
+
+        mask_source = "Painted on Frame 1"
+
     cap = cv2.VideoCapture(
         path
     )
@@ -448,39 +702,37 @@ def analyze_watermark(
                 "Complex logo / graphic"
             )
 
-            recommendation = (
-                "AI Content-Aware"
-            )
-
         else:
 
             watermark_type = (
                 "Text / simple logo"
             )
 
-            recommendation = (
-                "AI Content-Aware"
-            )
-
     elif mask_ratio < 0.12:
 
         watermark_type = (
             "Medium overlay / logo"
         )
 
-        recommendation = (
-            "AI Content-Aware"
-        )
-
     else:
 
         watermark_type = (
             "Large or complex overlay"
         )
 
-        recommendation = (
-            "AI Content-Aware"
-        )
+    # --------------------------------------------------------
+    # Engine tier.
+    #
+    # Small, thin text on a smooth background goes to the
+    # fast classical engine. Everything else uses LaMa.
+    # --------------------------------------------------------
+
+    recommendation, engine_stats = recommend_engine(
+        gray,
+        mask,
+        mask_ratio,
+        edge_density
+    )
 
     # --------------------------------------------------------
     # Confidence.
@@ -514,22 +766,6 @@ def analyze_watermark(
         "confidence": confidence
     }
 
-    # Store temporarily by process.
-    analysis_id = uuid.uuid4().hex
-
-    analysis_path = os.path.join(
-        WORK_DIR,
-        f"{analysis_id}.npz"
-    )
-
-    np.savez_compressed(
-        analysis_path,
-        mask=mask,
-        bbox=np.array(
-            [x1, y1, x2, y2]
-        )
-    )
-
     report = f"""
 ## 🔍 Watermark Analysis Complete
 
@@ -537,10 +773,20 @@ def analyze_watermark(
 
 **Recommended engine:** `{recommendation}`
 
+Stroke width `{engine_stats["stroke_width"]:.1f}px` · watermark edges
+`{edge_density:.3f}` · background edges
+`{engine_stats["background_edges"]:.3f}`
+
+**Engine** under *Advanced* can override this choice.
+
 **Analysis confidence:** `{confidence}`
 
 ### Selection
 
+Mask source:
+
+`{mask_source}`
+
 Video resolution:
 
 `{width} × {height}`
@@ -569,6 +815,21 @@ the watermark, but it cannot recover pixels that are completely
 absent from the source video.
 """
 
+    # Keyed by content, so the same input maps to this file.
+    analysis_path = WORKSPACE.save_analysis(
+        analysis_key,
+        mask=mask,
+        bbox=np.array(
+            [x1, y1, x2, y2]
+        ),
+        engine=np.array(
+            recommendation
+        ),
+        report=np.array(
+            report
+        )
+    )
+
     return report, analysis_path
 
 
@@ -595,6 +856,11 @@ def load_analysis(
             "Please analyze the watermark again."
         )
 
+    # Recently used records are the last to be evicted.
+    WORKSPACE.touch(
+        analysis_path
+    )
+
     data = np.load(
         analysis_path
     )
@@ -608,94 +874,261 @@ def load_analysis(
         for v in bbox
     ]
 
+    # Analyses saved before engine tiers used LaMa.
+    if "engine" in data:
+        engine = str(data["engine"])
+    else:
+        engine = ENGINE_LAMA
+
     return (
         mask,
         x1,
         y1,
         x2,
-        y2
+        y2,
+        engine
     )
 
 
 # ============================================================
-# LAMA RECONSTRUCTION
+# BATCHED LAMA RECONSTRUCTION
+#
+# All context crops of a job share one shape and one mask,
+# so several frames go through LaMa in one forward pass.
 # ============================================================
 
-def lama_inpaint(
-    image_bgr,
-    mask
+def lama_inpaint_batch(
+    images_bgr,
+    mask,
+    precision=PRECISION_FP32
 ):
 
-    model = get_lama()
+    return get_lama(precision).inpaint(
+        images_bgr,
+        mask
+    )
+
+
+# ============================================================
+# JOB SUMMARY
+#
+# The job report (stage latencies, CPU, memory) is saved as
+# JSON next to the output video and shown under the result.
+# ============================================================
 
-    h, w = image_bgr.shape[:2]
+def finish_job(
+    final_file,
+    summary,
+    timer,
+    monitor,
+    settings
+):
 
-    rgb = cv2.cvtColor(
-        image_bgr,
-        cv2.COLOR_BGR2RGB
+    report = build_job_report(
+        summary,
+        timer,
+        monitor,
+        settings
     )
 
-    image = Image.fromarray(
-        rgb
+    report_file = write_job_report(
+        final_file,
+        report
     )
 
-    mask_image = Image.fromarray(
-        mask,
-        mode="L"
+    resources = report["resources"]
+
+    WORKSPACE.enforce(
+        keep=(
+            final_file,
+            report_file
+        )
     )
 
-    result = model(
-        image,
-        mask_image
+    print()
+    print("=" * 65)
+    print("WATERMARK REMOVAL COMPLETE")
+    print("=" * 65)
+    print(
+        "Frames     :",
+        summary["frames"]
+    )
+    print(
+        "Speed      :",
+        f"{report['fps']} fps"
+    )
+    print(
+        "Reuse      :",
+        reuse_summary(
+            summary["cache_hits"],
+            summary["cache_misses"]
+        )
     )
 
-    if isinstance(
-        result,
-        Image.Image
-    ):
+    if summary.get("flow_keyframes"):
+
+        print(
+            "Flow       :",
+            f"{summary['flow_keyframes']} keyframes / "
+            f"{summary['flow_propagated']} warped"
+        )
+
+    print(
+        "CPU        :",
+        f"{resources['cpu_percent']}%"
+    )
+    print(
+        "Peak RAM   :",
+        f"{resources['peak_rss_mb']} MB"
+    )
+    print(final_file)
+    print(report_file)
+    print()
+
+    return (
+        final_file,
+        format_job_report(report)
+    )
+
+
+# ============================================================
+# PREVIEW
+#
+# Cleans a few frames spread over the video with the current
+# settings and estimates the time of the full run.
+# ============================================================
+
+def preview_removal(
+    video,
+    analysis_path,
+    context_padding,
+    batch_size=LAMA_BATCH_SIZE,
+    engine=ENGINE_AUTO,
+    precision=PRECISION_FP32,
+    adaptive_context=False,
+    tile_size=TILE_SIZE
+):
+
+    path = get_video_path(video)
+
+    if not path:
+
+        raise gr.Error(
+            "Upload the video."
+        )
+
+    mask, x1, y1, x2, y2, recommended = load_analysis(
+        analysis_path
+    )
+
+    engine = resolve_engine(
+        engine,
+        recommended
+    )
 
-        result = np.asarray(
-            result
+    if engine in CLASSICAL_ENGINES:
+
+        inpaint_batch = make_classical_inpaint(
+            engine
         )
 
     else:
 
-        result = np.asarray(
-            result
+        inpaint_batch = make_tiled_inpaint(
+            functools.partial(
+                lama_inpaint_batch,
+                precision=precision
+            ),
+            int(tile_size),
+            batch_size=int(batch_size)
         )
 
-    result = np.clip(
-        result,
-        0,
-        255
-    ).astype(np.uint8)
+    try:
 
-    # --------------------------------------------------------
-    # SimpleLama can pad the image.
-    # Always restore exact dimensions.
-    # --------------------------------------------------------
+        preview = render_preview(
+            path,
+            mask,
+            inpaint_batch,
+            context_padding=(
+                CONTEXT_AUTO
+                if adaptive_context
+                else int(context_padding)
+            ),
+            batch_size=int(batch_size)
+        )
 
-    if (
-        result.shape[0] != h
-        or
-        result.shape[1] != w
-    ):
+    except Exception as error:
 
-        result = cv2.resize(
-            result,
-            (
-                w,
-                h
+        raise gr.Error(
+            "Preview failed:\n\n"
+            + str(error)
+        )
+
+    gallery = [
+        (
+            preview_image(
+                sample,
+                preview["box"]
             ),
-            interpolation=cv2.INTER_LANCZOS4
+            f"Frame {sample['frame']} · before | after"
         )
+        for sample in preview["frames"]
+    ]
 
-    return cv2.cvtColor(
-        result,
-        cv2.COLOR_RGB2BGR
+    return (
+        gallery,
+        format_preview(preview)
     )
 
 
+# ============================================================
+# TIME RANGES
+#
+# Blank = whole video. "auto" finds the times at which the
+# watermark is visible. Otherwise "0:10-0:25, 19:50-".
+# ============================================================
+
+def resolve_time_ranges(
+    text,
+    path,
+    mask
+):
+
+    text = (text or "").strip()
+
+    if not text:
+        return None
+
+    if text.lower() == "auto":
+
+        ranges = detect_active_ranges(
+            path,
+            mask
+        )
+
+        if not ranges:
+
+            raise gr.Error(
+                "The watermark was not found at any time in "
+                "the video. Clear Time Ranges to process the "
+                "whole video."
+            )
+
+        return ranges
+
+    try:
+
+        return parse_time_ranges(
+            text
+        )
+
+    except ValueError as error:
+
+        raise gr.Error(
+            str(error)
+        )
+
+
 # ============================================================
 # REMOVE
 # ============================================================
@@ -703,7 +1136,19 @@ def lama_inpaint(
 def remove_watermark(
     video,
     analysis_path,
-    context_padding
+    context_padding,
+    queue_depth=PIPELINE_QUEUE_DEPTH,
+    batch_size=LAMA_BATCH_SIZE,
+    output_mode=OUTPUT_STREAM,
+    workers=SHARD_WORKERS,
+    reuse_threshold=REUSE_THRESHOLD,
+    engine=ENGINE_AUTO,
+    precision=PRECISION_FP32,
+    time_ranges="",
+    adaptive_context=False,
+    flow_interval=FLOW_INTERVAL,
+    tile_size=TILE_SIZE,
+    job=None
 ):
 
     path = get_video_path(video)
@@ -714,10 +1159,19 @@ def remove_watermark(
             "Upload the video."
         )
 
-    mask, x1, y1, x2, y2 = load_analysis(
+    # Progress and cancellation go through the queued job;
+    # a detached Job when called directly.
+    job = job or Job()
+
+    mask, x1, y1, x2, y2, recommended = load_analysis(
         analysis_path
     )
 
+    engine = resolve_engine(
+        engine,
+        recommended
+    )
+
     cap = cv2.VideoCapture(
         path
     )
@@ -780,11 +1234,14 @@ def remove_watermark(
         context_padding
     )
 
-    ys, xs = np.where(
-        mask > 0
+    # Every separate part of the mask (for example two
+    # corner logos) gets its own padded context crop.
+    regions = plan_regions(
+        mask,
+        padding
     )
 
-    if len(xs) == 0:
+    if not regions:
 
         cap.release()
 
@@ -792,34 +1249,42 @@ def remove_watermark(
             "Watermark mask is empty."
         )
 
-    cx1 = max(
-        0,
-        int(xs.min()) - padding
-    )
+    # Adaptive context: the smallest padding the background
+    # needs, compared with the slider value.
+    if adaptive_context:
 
-    cy1 = max(
-        0,
-        int(ys.min()) - padding
-    )
+        fixed_regions = regions
 
-    cx2 = min(
-        width,
-        int(xs.max()) + padding + 1
-    )
+        try:
 
-    cy2 = min(
-        height,
-        int(ys.max()) + padding + 1
-    )
+            regions, padding = plan_context_regions(
+                path,
+                mask,
+                CONTEXT_AUTO
+            )
 
-    context_mask = mask[
-        cy1:cy2,
-        cx1:cx2
-    ]
+        except Exception as error:
 
-    crop_height, crop_width = (
-        context_mask.shape
-    )
+            cap.release()
+
+            raise gr.Error(
+                "Adaptive context failed:\n\n"
+                + str(error)
+            )
+
+        context_note = describe_context(
+            regions,
+            padding,
+            fixed_regions,
+            int(context_padding)
+        )
+
+    else:
+
+        context_note = describe_context(
+            regions,
+            padding
+        )
 
     print()
     print("=" * 65)
@@ -829,191 +1294,661 @@ def remove_watermark(
     print("FPS        :", fps)
     print("Frames     :", total_frames)
     print(
-        "AI region  :",
-        f"{crop_width}x{crop_height}"
+        "AI regions :",
+        describe_regions(regions)
     )
     print(
         "Context    :",
-        f"{padding}px"
+        context_note
+    )
+    print(
+        "Queue      :",
+        f"{int(queue_depth)} frames"
+    )
+    print(
+        "Batch      :",
+        f"{int(batch_size)} frames"
     )
+    print(
+        "Workers    :",
+        int(workers)
+    )
+    print(
+        "Engine     :",
+        engine
+    )
+
+    if DEVICE.type == "cpu" and engine not in CLASSICAL_ENGINES:
+        print(
+            "Precision  :",
+            precision
+        )
+
     print("=" * 65)
     print()
 
     # --------------------------------------------------------
-    # Output files.
+    # Instrumentation for the job report.
     # --------------------------------------------------------
 
-    job = uuid.uuid4().hex
+    timer = StageTimer()
+
+    monitor = ResourceMonitor()
+
+    settings = {
+        "video": f"{width}x{height}",
+        "fps": fps,
+        "context": padding,
+        "adaptive_context": bool(adaptive_context),
+        "crop": context_note,
+        "queue_depth": int(queue_depth),
+        "batch_size": int(batch_size),
+        "workers": int(workers),
+        "output_mode": output_mode,
+        "reuse_threshold": float(reuse_threshold),
+        "flow_interval": int(flow_interval),
+        "tile_size": int(tile_size),
+        "engine": engine,
+        "precision": precision,
+        "device": DEVICE_LABEL
+    }
+
+    # --------------------------------------------------------
+    # Output files. Older results are evicted first so the
+    # silent and final videos of this job fit the quota.
+    # --------------------------------------------------------
+
+    evicted = WORKSPACE.enforce(
+        reserve_bytes=2 * os.path.getsize(path)
+    )
+
+    if evicted:
+
+        print(
+            "Workspace  :",
+            f"evicted {len(evicted)} old file(s)"
+        )
+
+    run_id = uuid.uuid4().hex
 
     silent_file = os.path.join(
         WORK_DIR,
-        f"{job}_silent.mp4"
+        f"{run_id}_silent.mp4"
     )
 
     final_file = os.path.join(
         WORK_DIR,
-        f"{job}_final.mp4"
+        f"{run_id}_final.mp4"
     )
 
     # --------------------------------------------------------
-    # Video writer.
+    # FRAME PROCESSING
+    #
+    # Runs on the AI stage of the pipeline. Decoding and
+    # writing happen on their own threads.
     # --------------------------------------------------------
 
-    fourcc = cv2.VideoWriter_fourcc(
-        *"mp4v"
+    reuse_cache = InpaintReuseCache(
+        reuse_threshold
     )
 
-    writer = cv2.VideoWriter(
-        silent_file,
-        fourcc,
-        fps,
-        (
-            width,
-            height
+    flow = FlowPropagator(
+        int(flow_interval)
+    )
+
+    if engine in CLASSICAL_ENGINES:
+
+        inpaint_batch = make_classical_inpaint(
+            engine
         )
+
+    else:
+
+        inpaint_batch = make_tiled_inpaint(
+            functools.partial(
+                lama_inpaint_batch,
+                precision=precision
+            ),
+            int(tile_size),
+            batch_size=int(batch_size)
+        )
+
+    process_batch = make_batch_processor(
+        inpaint_batch,
+        regions,
+        cache=reuse_cache,
+        timer=timer,
+        flow=flow
     )
 
-    if not writer.isOpened():
+    # ========================================================
+    # TIME-RANGE MODE
+    #
+    # Only the GOP-aligned spans around the given ranges are
+    # decoded and processed; the rest is stream-copied.
+    # Sources that cannot be stream-copied are rejected with
+    # the reason: frames outside the ranges are never
+    # inpainted.
+    # ========================================================
+
+    ranges = resolve_time_ranges(
+        time_ranges,
+        path,
+        mask
+    )
+
+    if ranges:
+
+        settings["time_ranges"] = ranges
+
+        def show_range_progress(processed):
+
+            job.report(
+                message=f"Processing time ranges: {processed} frames"
+            )
+
+            if processed % 5 == 0:
+
+                print(
+                    f"\rProcessing ranges: {processed} frames",
+                    end="",
+                    flush=True
+                )
+
+        try:
+
+            summary = remove_watermark_ranges(
+                path,
+                final_file,
+                ranges,
+                process_batch,
+                width,
+                height,
+                queue_depth=queue_depth,
+                batch_size=batch_size,
+                on_progress=show_range_progress,
+                timer=timer
+            )
+
+        except RangesUnsupported as error:
+
+            cap.release()
+
+            raise gr.Error(
+                "Time ranges cannot be used with this video:\n\n"
+                + str(error)
+                + "\n\nClear Time Ranges to process the whole "
+                "video."
+            )
+
+        except FileNotFoundError:
+
+            cap.release()
+
+            raise gr.Error(
+                "FFmpeg is not installed.\n\n"
+                "Fedora:\n"
+                "sudo dnf install ffmpeg"
+            )
+
+        except JobCancelled:
+
+            cap.release()
+
+            raise
+
+        except Exception as error:
+
+            cap.release()
+
+            raise gr.Error(
+                "Watermark removal failed:\n\n"
+                + str(error)
+            )
 
         cap.release()
 
-        raise gr.Error(
-            "Could not create output video."
+        print()
+        print(
+            "Copied     :",
+            f"{summary['copied_seconds']:.1f} s"
+        )
+        print(
+            "Processed  :",
+            f"{summary['processed_seconds']:.1f} s"
+        )
+
+        summary.update(
+            reuse_cache.stats()
+        )
+
+        summary.update(
+            flow.stats()
         )
 
-    processed = 0
+        return finish_job(
+            final_file,
+            summary,
+            timer,
+            monitor,
+            settings
+        )
+
+    # ========================================================
+    # TIME-SHARDED PARALLEL MODE
+    #
+    # Each worker process gets its own LaMa instance and a
+    # slice of the video. Segments are always streamed to
+    # ffmpeg and joined without re-encoding.
+    # ========================================================
+
+    if int(workers) > 1:
+
+        cap.release()
+
+        def show_shards(finished, count):
+
+            print(
+                f"Segment {finished}/{count} finished",
+                flush=True
+            )
+
+            job.report(
+                finished / count,
+                f"Segment {finished}/{count} finished"
+            )
+
+        try:
+
+            summary = remove_watermark_sharded(
+                path,
+                final_file,
+                regions,
+                width,
+                height,
+                fps,
+                total_frames,
+                int(workers),
+                DEVICE,
+                queue_depth=queue_depth,
+                batch_size=batch_size,
+                reuse_threshold=reuse_threshold,
+                flow_interval=int(flow_interval),
+                tile_size=int(tile_size),
+                on_progress=show_shards,
+                timer=timer,
+                engine=engine,
+                precision=precision,
+                model_path=LAMA_MODEL_PATH,
+                cancel_event=job.cancel_event
+            )
+
+        except FileNotFoundError:
+
+            raise gr.Error(
+                "FFmpeg is not installed.\n\n"
+                "Fedora:\n"
+                "sudo dnf install ffmpeg"
+            )
+
+        except JobCancelled:
+
+            raise
+
+        except Exception as error:
+
+            raise gr.Error(
+                "Watermark removal failed:\n\n"
+                + str(error)
+            )
+
+        if summary["frames"] == 0:
+
+            raise gr.Error(
+                "No frames were processed."
+            )
+
+        return finish_job(
+            final_file,
+            summary,
+            timer,
+            monitor,
+            settings
+        )
 
     # --------------------------------------------------------
-    # FRAME LOOP
+    # Video writer.
+    #
+    # Stream mode pipes raw frames into one ffmpeg process
+    # that encodes x264 and muxes the original audio in a
+    # single pass.
+    #
+    # Resumable mode writes checkpoint segments plus a
+    # manifest, and continues an interrupted run of the same
+    # video + mask + settings.
+    #
+    # Legacy mode writes an mp4v file first and re-encodes
+    # it afterwards.
     # --------------------------------------------------------
 
-    try:
+    stream_output = (
+        output_mode == OUTPUT_STREAM
+    )
 
-        while True:
+    resumable = (
+        output_mode == OUTPUT_RESUMABLE
+    )
 
-            ok, frame = cap.read()
+    reader = cap
+
+    resumed_from = 0
+
+    if resumable:
+
+        writer = ResumableJob(
+            WORK_DIR,
+            # Everything that changes the output pixels, so a
+            # run with other settings never resumes this one.
+            job_fingerprint(
+                path,
+                mask,
+                {
+                    "context": padding,
+                    "adaptive_context": bool(adaptive_context),
+                    "regions": [
+                        list(region["box"])
+                        for region in regions
+                    ],
+                    "reuse": float(reuse_threshold),
+                    "flow": int(flow_interval),
+                    "tile": int(tile_size),
+                    "engine": engine,
+                    "precision": precision,
+                    "device": DEVICE.type,
+                    "model": LAMA_MODEL_PATH
+                }
+            ),
+            width,
+            height,
+            fps
+        )
 
-            if not ok:
-                break
+        resumed_from = writer.start_frame
 
-            original = frame.copy()
+        reader = FrameRangeReader(
+            cap,
+            resumed_from
+        )
 
-            crop = original[
-                cy1:cy2,
-                cx1:cx2
-            ].copy()
+        if resumed_from:
 
-            # Safety.
-            if (
-                crop.shape[:2]
-                != context_mask.shape[:2]
-            ):
+            print(
+                "Resuming   :",
+                f"frame {resumed_from} "
+                f"({len(writer.segment_paths)} segments done)"
+            )
 
-                raise RuntimeError(
-                    "Context crop and mask dimensions differ."
-                )
+    elif stream_output:
 
-            # ------------------------------------------------
-            # AI RECONSTRUCTION
-            # ------------------------------------------------
+        try:
 
-            reconstructed = lama_inpaint(
-                crop,
-                context_mask
+            writer = FFmpegFrameWriter(
+                final_file,
+                width,
+                height,
+                fps,
+                audio_source=path
             )
 
-            # ------------------------------------------------
-            # CRITICAL:
-            #
-            # Only selected watermark pixels are replaced.
-            # The context pixels remain ORIGINAL.
-            # ------------------------------------------------
+        except FileNotFoundError:
 
-            local_mask = (
-                context_mask > 0
+            cap.release()
+
+            raise gr.Error(
+                "FFmpeg is not installed.\n\n"
+                "Fedora:\n"
+                "sudo dnf install ffmpeg"
             )
 
-            clean_crop = crop.copy()
+    else:
+
+        fourcc = cv2.VideoWriter_fourcc(
+            *"mp4v"
+        )
+
+        writer = cv2.VideoWriter(
+            silent_file,
+            fourcc,
+            fps,
+            (
+                width,
+                height
+            )
+        )
+
+    if not writer.isOpened():
+
+        cap.release()
 
-            clean_crop[
-                local_mask
-            ] = reconstructed[
-                local_mask
-            ]
+        raise gr.Error(
+            "Could not create output video."
+        )
 
-            # ------------------------------------------------
-            # Put processed context back.
-            # ------------------------------------------------
+    def show_progress(processed):
 
-            result_frame = original.copy()
+        # A resumed run counts the frames already in finished
+        # segments, so the bar continues where it stopped.
+        processed += resumed_from
 
-            result_frame[
-                cy1:cy2,
-                cx1:cx2
-            ] = clean_crop
+        # Raises JobCancelled, which stops the frame loop.
+        job.report(
+            processed
+            /
+            max(
+                total_frames,
+                1
+            )
+        )
+
+        if processed % 5 == 0:
 
-            writer.write(
-                result_frame
+            percent = (
+                processed
+                /
+                max(
+                    total_frames,
+                    1
+                )
+            ) * 100
+
+            p50, p95 = timer.percentiles(
+                "inference"
             )
 
-            processed += 1
+            latency = ""
 
-            if processed % 5 == 0:
+            if p50 is not None:
 
-                percent = (
-                    processed
-                    /
-                    max(
-                        total_frames,
-                        1
-                    )
-                ) * 100
+                latency = (
+                    f" | AI p50 {p50:.0f} ms"
+                    f" p95 {p95:.0f} ms"
+                )
 
-                print(
-                    f"\rProcessing "
-                    f"{processed}/{total_frames} "
-                    f"({percent:.1f}%)",
-                    end="",
-                    flush=True
+            print(
+                f"\rProcessing "
+                f"{processed}/{total_frames} "
+                f"({percent:.1f}%)"
+                f"{latency}",
+                end="",
+                flush=True
+            )
+
+            job.report(
+                message=(
+                    f"Frame {processed}/{total_frames}"
+                    f"{latency}"
                 )
+            )
+
+    # --------------------------------------------------------
+    # FRAME PIPELINE
+    #
+    # decode → AI → encode run as overlapping stages.
+    # --------------------------------------------------------
+
+    try:
+
+        processed = run_frame_pipeline(
+            TimedCapture(reader, timer),
+            process_batch,
+            timer.wrap("encode", writer.write),
+            queue_depth=queue_depth,
+            batch_size=batch_size,
+            on_progress=show_progress
+        )
+
+        if resumable:
+
+            # Record the last, shorter segment.
+            writer.finish()
 
     except Exception as error:
 
         cap.release()
         writer.release()
 
-        if os.path.exists(
-            silent_file
+        for leftover in (
+            silent_file,
+            final_file
         ):
-            os.remove(
-                silent_file
-            )
 
-        raise gr.Error(
+            if os.path.exists(
+                leftover
+            ):
+                os.remove(
+                    leftover
+                )
+
+        if isinstance(error, JobCancelled):
+            raise
+
+        message = (
             "Watermark removal failed:\n\n"
             + str(error)
         )
 
+        if resumable:
+
+            message += (
+                "\n\nFinished segments were kept. Run the "
+                "same job again to resume."
+            )
+
+        raise gr.Error(
+            message
+        )
+
     cap.release()
-    writer.release()
+
+    # Too late to cancel: the encoder is flushed either way.
+    job.message = "Finishing the video"
+
+    # Flushes the encoder (stream mode: the whole mux).
+    timer.wrap(
+        "mux",
+        writer.release
+    )()
 
     print()
 
-    if processed == 0:
+    if processed == 0 and not resumed_from:
 
-        if os.path.exists(
-            silent_file
+        for leftover in (
+            silent_file,
+            final_file
         ):
-            os.remove(
-                silent_file
-            )
+
+            if os.path.exists(
+                leftover
+            ):
+                os.remove(
+                    leftover
+                )
 
         raise gr.Error(
             "No frames were processed."
         )
 
+    summary = reuse_cache.stats()
+
+    summary.update(
+        flow.stats()
+    )
+
+    summary["frames"] = processed
+
+    if resumable:
+
+        try:
+
+            timer.wrap(
+                "mux",
+                writer.complete
+            )(
+                final_file,
+                audio_source=path
+            )
+
+        except FileNotFoundError:
+
+            raise gr.Error(
+                "FFmpeg is not installed.\n\n"
+                "Fedora:\n"
+                "sudo dnf install ffmpeg"
+            )
+
+        except RuntimeError as error:
+
+            raise gr.Error(
+                "FFmpeg failed:\n\n"
+                + str(error)
+            )
+
+        return finish_job(
+            final_file,
+            summary,
+            timer,
+            monitor,
+            settings
+        )
+
+    if stream_output:
+
+        if writer.returncode != 0:
+
+            raise gr.Error(
+                "FFmpeg failed:\n\n"
+                + writer.error_output()
+            )
+
+        if not os.path.exists(
+            final_file
+        ):
+
+            raise gr.Error(
+                "Final video was not created."
+            )
+
+        return finish_job(
+            final_file,
+            summary,
+            timer,
+            monitor,
+            settings
+        )
+
     # ========================================================
-    # RESTORE ORIGINAL AUDIO
+    # RESTORE ORIGINAL AUDIO (legacy output mode)
     # ========================================================
 
     ffmpeg = [
@@ -1058,7 +1993,10 @@ def remove_watermark(
 
     try:
 
-        result = subprocess.run(
+        result = timer.wrap(
+            "mux",
+            subprocess.run
+        )(
             ffmpeg,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -1113,14 +2051,116 @@ def remove_watermark(
     except OSError:
         pass
 
-    print()
-    print("=" * 65)
-    print("WATERMARK REMOVAL COMPLETE")
-    print("=" * 65)
-    print(final_file)
-    print()
+    return finish_job(
+        final_file,
+        summary,
+        timer,
+        monitor,
+        settings
+    )
+
+
+# ============================================================
+# JOB QUEUE
+#
+# Removals do not run inside the request handler. They go to
+# a shared queue that runs at most --job-workers jobs at once,
+# all with the same loaded model. Each request streams its
+# place in line, then the progress, and finally the result.
+#
+# Cancel drops a waiting job, or stops the frame loop of a
+# running one. Closing the page cancels the job as well.
+# ============================================================
+
+JOB_QUEUE = JobQueue(
+    args.job_workers
+)
+
+
+def describe_job(job):
 
-    return final_file
+    if job.state == JOB_QUEUED:
+
+        running, waiting = JOB_QUEUE.counts()
+
+        return (
+            f"⏳ **Waiting in line:** "
+            f"{JOB_QUEUE.position(job)} of {waiting} "
+            f"({running} job(s) running)"
+        )
+
+    status = (
+        f"⚙️ **Removing:** {job.progress * 100:.0f}%"
+    )
+
+    if job.message:
+        status += f" · {job.message}"
+
+    return status
+
+
+def queue_removal(*settings):
+
+    job = JOB_QUEUE.submit(
+        remove_watermark,
+        *settings
+    )
+
+    try:
+
+        while not job.wait(JOB_POLL_SECONDS):
+
+            yield (
+                job.id,
+                None,
+                describe_job(job)
+            )
+
+    finally:
+
+        # The page was closed: the work stops as well.
+        if not job.finished:
+
+            JOB_QUEUE.cancel(
+                job.id
+            )
+
+    if job.state == JOB_CANCELLED:
+
+        yield (
+            None,
+            None,
+            "🛑 **Cancelled.**"
+        )
+
+        return
+
+    if job.state == JOB_FAILED:
+
+        if isinstance(job.error, gr.Error):
+            raise job.error
+
+        raise gr.Error(
+            "Watermark removal failed:\n\n"
+            + str(job.error)
+        )
+
+    final_file, report = job.result
+
+    yield (
+        None,
+        final_file,
+        report
+    )
+
+
+def cancel_removal(job_id):
+
+    if job_id:
+
+        JOB_QUEUE.cancel(
+            job_id
+        )
 
 
 # ============================================================
@@ -1137,7 +2177,7 @@ with gr.Blocks(
 
 ### Frame 1 → Analyze → Remove
 
-**Engine:** AI Content-Aware / LaMa  
+**Engine:** AI Content-Aware / LaMa, or fast classical for thin text  
 **Device:** `{DEVICE_LABEL}`
 
 The watermark is selected **once on Frame 1**.
@@ -1274,6 +2314,16 @@ the recommended content-aware reconstruction strategy.
         size="lg"
     )
 
+    auto_detect = gr.Checkbox(
+        value=False,
+        label="Auto-detect the watermark (no painting)",
+        info=(
+            "Finds static logos and text by sampling frames "
+            "across the whole video. Works when the video "
+            "behind the watermark moves."
+        )
+    )
+
     analysis_result = gr.Markdown(
         value="Waiting for watermark selection..."
     )
@@ -1286,7 +2336,8 @@ the recommended content-aware reconstruction strategy.
         fn=analyze_watermark,
         inputs=[
             video,
-            editor
+            editor,
+            auto_detect
         ],
         outputs=[
             analysis_result,
@@ -1315,6 +2366,16 @@ the recommended content-aware reconstruction strategy.
             )
         )
 
+        adaptive_context = gr.Checkbox(
+            value=False,
+            label="Adaptive Context",
+            info=(
+                "Measure the background around the watermark "
+                "and use the smallest context it needs instead "
+                "of the slider. Often several times faster."
+            )
+        )
+
         gr.Markdown(
             """
 **Recommended:** 150–250.
@@ -1325,6 +2386,143 @@ increases processing time.
 """
         )
 
+        queue_depth = gr.Slider(
+            minimum=1,
+            maximum=64,
+            value=PIPELINE_QUEUE_DEPTH,
+            step=1,
+            label="Pipeline Queue Depth",
+            info=(
+                "Frames buffered between decoding, AI and "
+                "encoding. Higher values smooth out slow "
+                "frames but use more RAM."
+            )
+        )
+
+        batch_size = gr.Slider(
+            minimum=1,
+            maximum=16,
+            value=LAMA_BATCH_SIZE,
+            step=1,
+            label="AI Batch Size",
+            info=(
+                "Consecutive frames reconstructed in one "
+                "LaMa pass. Larger batches use the CPU/GPU "
+                "more efficiently but need more memory."
+            )
+        )
+
+        tile_size = gr.Slider(
+            minimum=0,
+            maximum=2048,
+            value=TILE_SIZE,
+            step=64,
+            label="AI Tile Size",
+            info=(
+                "Split context crops larger than this into "
+                "overlapping tiles blended together, so huge "
+                "overlays and 4K videos cannot run out of "
+                "memory. 512 suits LaMa. 0 = never tile."
+            )
+        )
+
+        output_mode = gr.Radio(
+            choices=OUTPUT_MODES,
+            value=OUTPUT_STREAM,
+            label="Output Mode",
+            info=(
+                "Streaming encodes once and copies the "
+                "original audio when possible. Resumable "
+                "mode saves one-minute checkpoints and "
+                "continues an interrupted job. Legacy mode "
+                "writes a temporary mp4v file first."
+            )
+        )
+
+        workers = gr.Slider(
+            minimum=1,
+            maximum=max(
+                1,
+                os.cpu_count() or 1
+            ),
+            value=SHARD_WORKERS,
+            step=1,
+            label="Parallel Workers",
+            info=(
+                "Split the video into time ranges processed "
+                "by separate worker processes, each with its "
+                "own LaMa model. Every worker needs its own "
+                "RAM. 1 = single process."
+            )
+        )
+
+        reuse_threshold = gr.Slider(
+            minimum=0,
+            maximum=10,
+            value=REUSE_THRESHOLD,
+            step=0.5,
+            label="Static Background Reuse",
+            info=(
+                "Reuse a recent reconstruction when the area "
+                "around the watermark has barely changed "
+                "(mean grey difference). Great for talking "
+                "heads, screencasts and slides. 0 = always "
+                "run the AI."
+            )
+        )
+
+        flow_interval = gr.Slider(
+            minimum=0,
+            maximum=60,
+            value=FLOW_INTERVAL,
+            step=1,
+            label="Flow Keyframe Interval",
+            info=(
+                "Moving camera: run LaMa only every N frames (or "
+                "sooner on scene cuts and uncertain motion) and "
+                "warp the last reconstruction into the frames in "
+                "between with optical flow. Also reduces "
+                "flicker. 0 = run the AI on every frame."
+            )
+        )
+
+        engine = gr.Dropdown(
+            choices=ENGINES,
+            value=ENGINE_AUTO,
+            label="Engine",
+            info=(
+                "Auto uses the engine recommended by the "
+                "analysis. Fast classical engines suit thin "
+                "text on smooth backgrounds; LaMa handles "
+                "everything else."
+            )
+        )
+
+        precision = gr.Dropdown(
+            choices=PRECISIONS,
+            value=PRECISION_FP32,
+            label="CPU Precision",
+            interactive=(
+                DEVICE.type == "cpu"
+            ),
+            info=(
+                "bfloat16 trades a little quality for speed on "
+                "CPUs with bf16 units (recent Xeon, Core). GPU "
+                "runs always use float32."
+            )
+        )
+
+        time_ranges = gr.Textbox(
+            label="Time Ranges",
+            placeholder="0:10-0:25, 19:50-",
+            info=(
+                "Only process these parts of the video and "
+                "copy the rest untouched (H.264 sources). "
+                "Blank = whole video, auto = detect when the "
+                "watermark is visible."
+            )
+        )
+
     # ========================================================
     # STEP 4
     # ========================================================
@@ -1334,13 +2532,43 @@ increases processing time.
 ## 4️⃣ Remove Watermark
 
 After analysis, press the button below.
+
+**Preview** cleans a few frames spread over the video in seconds
+and estimates the time of the full run. Use it to check the
+mask and the context before a long job.
 """
     )
 
-    remove_button = gr.Button(
-        "✨ REMOVE WATERMARK",
-        variant="primary",
-        size="lg"
+    preview_button = gr.Button(
+        "👁️ PREVIEW A FEW FRAMES"
+    )
+
+    preview_gallery = gr.Gallery(
+        label="Preview (before | after)",
+        columns=2,
+        height="auto"
+    )
+
+    preview_report = gr.Markdown()
+
+    with gr.Row():
+
+        remove_button = gr.Button(
+            "✨ REMOVE WATERMARK",
+            variant="primary",
+            size="lg",
+            scale=3
+        )
+
+        cancel_button = gr.Button(
+            "🛑 CANCEL",
+            size="lg",
+            scale=1
+        )
+
+    # Id of this session's queued job.
+    job_id = gr.State(
+        None
     )
 
     # ========================================================
@@ -1352,18 +2580,62 @@ After analysis, press the button below.
         format="mp4"
     )
 
+    job_report = gr.Markdown()
+
     # ========================================================
-    # REMOVE EVENT
+    # PREVIEW / REMOVE EVENTS
     # ========================================================
 
+    preview_button.click(
+        fn=preview_removal,
+        inputs=[
+            video,
+            analysis_file,
+            context_padding,
+            batch_size,
+            engine,
+            precision,
+            adaptive_context,
+            tile_size
+        ],
+        outputs=[
+            preview_gallery,
+            preview_report
+        ]
+    )
+
+    # Every request may wait in the job queue, which shows
+    # the position in line; it limits the work instead.
     remove_button.click(
-        fn=remove_watermark,
+        fn=queue_removal,
         inputs=[
             video,
             analysis_file,
-            context_padding
+            context_padding,
+            queue_depth,
+            batch_size,
+            output_mode,
+            workers,
+            reuse_threshold,
+            engine,
+            precision,
+            time_ranges,
+            adaptive_context,
+            flow_interval,
+            tile_size
+        ],
+        outputs=[
+            job_id,
+            output,
+            job_report
         ],
-        outputs=output
+        concurrency_limit=None
+    )
+
+    cancel_button.click(
+        fn=cancel_removal,
+        inputs=job_id,
+        concurrency_limit=None
     )
 
     # ========================================================
@@ -0,0 +1,1004 @@
+import os
+import cv2
+import sys
+import json
+import math
+import time
+import torch
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+
+from watermark_engine import (
+    CONTEXT_AUTO,
+    ENGINE_NS,
+    ENGINE_TELEA,
+    FLOW_INTERVAL,
+    LAMA_BATCH_SIZE,
+    PIPELINE_QUEUE_DEPTH,
+    PRECISION_FP32,
+    PRECISIONS,
+    REUSE_THRESHOLD,
+    TILE_SIZE,
+    FFmpegFrameWriter,
+    LamaRunner,
+    ResourceMonitor,
+    StageTimer,
+    configure_threads,
+    make_classical_inpaint,
+    make_tiled_inpaint,
+    plan_context_regions,
+    process_video
+)
+
+
+# ============================================================
+# WATERMARK REMOVAL BENCHMARK
+#
+# Generates synthetic clips with a known logo overlay and
+# runs them through the same frame pipeline as the apps.
+#
+# python benchmark.py
+# python benchmark.py --engine lama --profile app
+# python benchmark.py --sizes 1280x720 --motion static,noise
+#
+# Every combination of size × length × logo × motion is one
+# case. The result is a single JSON document on stdout (and
+# in --output) with frames per second and the time spent in
+# every pipeline stage (see StageTimer in the engine).
+#
+# The git commit is recorded so runs of different commits can
+# be compared directly.
+#
+# python benchmark.py --engine lama --precision float32,bfloat16
+#
+# With several LaMa precisions, every clip is processed once
+# per precision. float32 is the reference; the others report
+# the PSNR of the watermark pixels against it. Quality is
+# measured on the raw inpaint output of a few sampled crops,
+# without x264, the reuse cache or flow in between.
+# ============================================================
+
+# app.py picks CUDA when available, CPUonlyOptimized.py only
+# runs on CUDA. Both use the frame pipeline of the engine.
+PROFILES = {
+    "app": "auto",
+    "cpu-optimized": "cuda"
+}
+
+MOTIONS = (
+    "static",
+    "pan",
+    "noise"
+)
+
+# Fixed seed, so every run sees identical clips.
+SEED = 1234
+
+# Pixels the background moves per frame in "pan" clips.
+PAN_SPEED = 3
+
+# Reported instead of infinity when two outputs are identical.
+PSNR_IDENTICAL = 100.0
+
+# Frames per clip whose crops are inpainted for the PSNR.
+QUALITY_FRAMES = 8
+
+
+# ============================================================
+# SYNTHETIC CLIPS
+# ============================================================
+
+def make_background(
+    width,
+    height,
+    rng
+):
+
+    # Larger than the frame, so "pan" clips have room to move.
+    texture = rng.integers(
+        0,
+        256,
+        size=(
+            height // 8 + 8,
+            width // 8 + 64,
+            3
+        ),
+        dtype=np.uint8
+    )
+
+    texture = cv2.resize(
+        texture,
+        (
+            texture.shape[1] * 8,
+            texture.shape[0] * 8
+        ),
+        interpolation=cv2.INTER_CUBIC
+    )
+
+    return cv2.GaussianBlur(
+        texture,
+        (0, 0),
+        3
+    )
+
+
+def make_logo(
+    width,
+    logo_size
+):
+
+    logo_width = max(
+        16,
+        int(width * logo_size)
+    )
+
+    logo_height = max(
+        8,
+        logo_width // 3
+    )
+
+    logo = np.zeros(
+        (
+            logo_height,
+            logo_width
+        ),
+        dtype=np.uint8
+    )
+
+    cv2.putText(
+        logo,
+        "LOGO",
+        (
+            logo_width // 20,
+            int(logo_height * 0.8)
+        ),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        logo_width / 150,
+        255,
+        max(1, logo_width // 60),
+        cv2.LINE_AA
+    )
+
+    return logo
+
+
+def make_synthetic_clip(
+    path,
+    width,
+    height,
+    frames,
+    logo_size,
+    motion,
+    fps=30.0,
+    seed=SEED
+):
+
+    rng = np.random.default_rng(
+        seed
+    )
+
+    background = make_background(
+        width,
+        height,
+        rng
+    )
+
+    logo = make_logo(
+        width,
+        logo_size
+    )
+
+    logo_height, logo_width = logo.shape
+
+    # Bottom-right corner, like most platform watermarks.
+    x = width - logo_width - width // 40
+    y = height - logo_height - height // 40
+
+    alpha = (
+        logo.astype(np.float32)
+        / 255.0
+        * 0.7
+    )[:, :, None]
+
+    mask = np.zeros(
+        (
+            height,
+            width
+        ),
+        dtype=np.uint8
+    )
+
+    mask[
+        y:y + logo_height,
+        x:x + logo_width
+    ] = cv2.dilate(
+        logo,
+        np.ones((5, 5), np.uint8)
+    )
+
+    writer = FFmpegFrameWriter(
+        path,
+        width,
+        height,
+        fps,
+        preset="veryfast"
+    )
+
+    max_offset = background.shape[1] - width
+
+    for index in range(frames):
+
+        offset = 0
+
+        if motion == "pan":
+
+            offset = (index * PAN_SPEED) % max_offset
+
+        frame = background[
+            :height,
+            offset:offset + width
+        ].copy()
+
+        if motion == "noise":
+
+            frame = cv2.add(
+                frame,
+                rng.integers(
+                    0,
+                    24,
+                    size=frame.shape,
+                    dtype=np.uint8
+                )
+            )
+
+        patch = frame[
+            y:y + logo_height,
+            x:x + logo_width
+        ]
+
+        patch[:] = (
+            patch * (1.0 - alpha)
+            +
+            255.0 * alpha
+        ).astype(np.uint8)
+
+        writer.write(frame)
+
+    if writer.release() != 0:
+
+        raise RuntimeError(
+            "FFmpeg failed:\n\n"
+            + writer.error_output()
+        )
+
+    return mask
+
+
+# ============================================================
+# ENGINES
+# ============================================================
+
+def make_stub_inpaint(delay_ms):
+
+    # Fills the mask with the mean colour of the crop.
+    # Isolates the cost of the pipeline from the model.
+    def inpaint(images, mask):
+
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+
+        if not isinstance(mask, (list, tuple)):
+            mask = [mask] * len(images)
+
+        results = []
+
+        for image, crop_mask in zip(images, mask):
+
+            selected = crop_mask > 10
+
+            result = image.copy()
+
+            result[selected] = image.reshape(-1, 3).mean(
+                axis=0
+            ).astype(np.uint8)
+
+            results.append(result)
+
+        return results
+
+    return inpaint
+
+
+def pick_device(profile):
+
+    policy = PROFILES[profile]
+
+    if policy == "cuda" or (
+        policy == "auto"
+        and torch.cuda.is_available()
+    ):
+
+        if not torch.cuda.is_available():
+
+            raise SystemExit(
+                f"Profile '{profile}' needs CUDA."
+            )
+
+        return torch.device("cuda")
+
+    return torch.device("cpu")
+
+
+# ============================================================
+# QUALITY
+# ============================================================
+
+def sample_crops(
+    path,
+    mask,
+    context_padding,
+    count=QUALITY_FRAMES
+):
+
+    # The context crops of `count` frames spread over the
+    # clip, as (region, crops) per region. Every precision
+    # inpaints exactly these pixels.
+    regions, _ = plan_context_regions(
+        path,
+        mask,
+        context_padding
+    )
+
+    cap = cv2.VideoCapture(
+        path
+    )
+
+    total = int(
+        cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    )
+
+    wanted = set(
+        np.linspace(
+            0,
+            max(total - 1, 0),
+            count
+        ).astype(int).tolist()
+    )
+
+    frames = []
+
+    index = 0
+
+    while len(frames) < len(wanted):
+
+        ok, frame = cap.read()
+
+        if not ok:
+            break
+
+        if index in wanted:
+            frames.append(frame)
+
+        index += 1
+
+    cap.release()
+
+    return [
+        (
+            region,
+            [
+                frame[
+                    region["box"][1]:region["box"][3],
+                    region["box"][0]:region["box"][2]
+                ].copy()
+                for frame in frames
+            ]
+        )
+        for region in regions
+    ]
+
+
+def inpaint_samples(
+    inpaint,
+    samples
+):
+
+    return [
+        inpaint(
+            crops,
+            region["mask"]
+        )
+        for region, crops in samples
+    ]
+
+
+def masked_psnr(
+    reference,
+    candidate,
+    samples
+):
+
+    # PSNR of the masked pixels of two inpaint_samples()
+    # results.
+    squared = 0.0
+    count = 0
+
+    for (region, _), patches_a, patches_b in zip(
+        samples,
+        reference,
+        candidate
+    ):
+
+        selected = region["mask"] > 0
+
+        for patch_a, patch_b in zip(patches_a, patches_b):
+
+            difference = (
+                patch_a[selected].astype(np.float64)
+                - patch_b[selected]
+            )
+
+            squared += float(
+                np.sum(difference * difference)
+            )
+
+            count += difference.size
+
+    if count == 0:
+        return None
+
+    if squared == 0:
+        return PSNR_IDENTICAL
+
+    return round(
+        10.0 * math.log10(
+            255.0 ** 2 / (squared / count)
+        ),
+        2
+    )
+
+
+# ============================================================
+# ENVIRONMENT
+# ============================================================
+
+def git_commit():
+
+    folder = os.path.dirname(
+        os.path.abspath(__file__)
+    )
+
+    try:
+
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=folder,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--", "."],
+            cwd=folder,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+    if dirty:
+        commit += "-dirty"
+
+    return commit
+
+
+def parse_size(value):
+
+    width, height = value.lower().split("x")
+
+    return int(width), int(height)
+
+
+def context_arg(value):
+
+    if value == CONTEXT_AUTO:
+        return value
+
+    return int(value)
+
+
+def parse_list(value, cast):
+
+    return [
+        cast(item)
+        for item in value.split(",")
+        if item.strip()
+    ]
+
+
+# ============================================================
+# ONE CASE
+# ============================================================
+
+def run_variant(
+    source,
+    output,
+    mask,
+    inpaint,
+    args
+):
+
+    timer = StageTimer()
+
+    monitor = ResourceMonitor()
+
+    started = time.perf_counter()
+
+    summary = process_video(
+        source,
+        output,
+        mask,
+        inpaint,
+        context_padding=args.context,
+        queue_depth=args.queue,
+        batch_size=args.batch,
+        reuse_threshold=args.reuse,
+        flow_interval=args.flow,
+        timer=timer
+    )
+
+    seconds = time.perf_counter() - started
+
+    # The case already has a "frames" key (the clip length).
+    frames_processed = summary.pop("frames")
+
+    return dict(
+        seconds=round(seconds, 4),
+        frames_processed=frames_processed,
+        fps=round(
+            frames_processed / max(seconds, 1e-9),
+            2
+        ),
+        stages=timer.report(),
+        resources=monitor.report(),
+        **summary
+    )
+
+
+def run_case(
+    work_dir,
+    engines,
+    case,
+    args
+):
+
+    name = (
+        f"{case['width']}x{case['height']}"
+        f"_{case['frames']}f"
+        f"_logo{case['logo_size']}"
+        f"_{case['motion']}"
+    )
+
+    source = os.path.join(
+        work_dir,
+        f"{name}.mp4"
+    )
+
+    mask = make_synthetic_clip(
+        source,
+        case["width"],
+        case["height"],
+        case["frames"],
+        case["logo_size"],
+        case["motion"]
+    )
+
+    results = []
+
+    # More than one engine: compare their raw outputs.
+    samples = None
+
+    if len(engines) > 1:
+
+        samples = sample_crops(
+            source,
+            mask,
+            args.context
+        )
+
+    reference = None
+
+    outputs = []
+
+    # `engines` is a list of (precision, runner or None,
+    # inpaint). The first one is the quality reference.
+    for precision, runner, inpaint in engines:
+
+        output = os.path.join(
+            work_dir,
+            f"{name}_{precision}.mp4"
+        )
+
+        outputs.append(output)
+
+        result = run_variant(
+            source,
+            output,
+            mask,
+            inpaint,
+            args
+        )
+
+        if runner is not None:
+            # bfloat16 may fall back to float32 at run time.
+            precision = runner.precision
+
+        psnr = None
+
+        if samples is not None:
+
+            patches = inpaint_samples(
+                inpaint,
+                samples
+            )
+
+            if reference is None:
+
+                reference = patches
+
+            else:
+
+                psnr = masked_psnr(
+                    reference,
+                    patches,
+                    samples
+                )
+
+        results.append(
+            dict(
+                name=name,
+                **case,
+                precision=precision,
+                psnr_db=psnr,
+                **result
+            )
+        )
+
+    os.remove(source)
+
+    for output in outputs:
+        os.remove(output)
+
+    return results
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the watermark removal pipeline on synthetic clips."
+    )
+
+    parser.add_argument(
+        "--engine",
+        choices=("stub", "lama", "telea", "ns"),
+        default="stub",
+        help="LaMa, a classical OpenCV engine, or a stub that measures the pipeline only"
+    )
+
+    parser.add_argument(
+        "--precision",
+        default=PRECISION_FP32,
+        help="Comma-separated LaMa CPU precisions: " + ", ".join(PRECISIONS)
+    )
+
+    parser.add_argument(
+        "--lama-model",
+        help="Exported CPU LaMa graph from export-lama.py"
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="PyTorch intra-op threads"
+    )
+
+    parser.add_argument(
+        "--interop-threads",
+        type=int,
+        help="PyTorch inter-op threads"
+    )
+
+    parser.add_argument(
+        "--stub-ms",
+        type=float,
+        default=0.0,
+        help="Simulated model latency per stub call in milliseconds"
+    )
+
+    parser.add_argument(
+        "--profile",
+        choices=sorted(PROFILES),
+        default="app",
+        help="Device policy of app.py or CPUonlyOptimized.py"
+    )
+
+    parser.add_argument(
+        "--sizes",
+        default="640x360,1280x720",
+        help="Comma-separated WIDTHxHEIGHT list"
+    )
+
+    parser.add_argument(
+        "--frames",
+        default="90",
+        help="Comma-separated clip lengths in frames"
+    )
+
+    parser.add_argument(
+        "--logo-sizes",
+        default="0.15",
+        help="Comma-separated logo widths as a fraction of the frame width"
+    )
+
+    parser.add_argument(
+        "--motion",
+        default=",".join(MOTIONS),
+        help="Comma-separated background motions: " + ", ".join(MOTIONS)
+    )
+
+    parser.add_argument(
+        "--context",
+        type=context_arg,
+        default=180,
+        help="Context padding in pixels, or 'auto'"
+    )
+
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=LAMA_BATCH_SIZE
+    )
+
+    parser.add_argument(
+        "--tile",
+        type=int,
+        default=TILE_SIZE,
+        help="Tile size for tiled inference (0 = off)"
+    )
+
+    parser.add_argument(
+        "--queue",
+        type=int,
+        default=PIPELINE_QUEUE_DEPTH
+    )
+
+    parser.add_argument(
+        "--reuse",
+        type=float,
+        default=REUSE_THRESHOLD
+    )
+
+    parser.add_argument(
+        "--flow",
+        type=int,
+        default=FLOW_INTERVAL,
+        help="Flow keyframe interval (0 = off)"
+    )
+
+    parser.add_argument(
+        "--output",
+        help="Also write the JSON result to this file"
+    )
+
+    args = parser.parse_args()
+
+    threads = configure_threads(
+        args.threads,
+        args.interop_threads
+    )
+
+    motions = parse_list(
+        args.motion,
+        str
+    )
+
+    for motion in motions:
+
+        if motion not in MOTIONS:
+
+            parser.error(
+                f"Unknown motion: {motion}"
+            )
+
+    cases = [
+        {
+            "width": width,
+            "height": height,
+            "frames": frames,
+            "logo_size": logo_size,
+            "motion": motion
+        }
+        for width, height in parse_list(args.sizes, parse_size)
+        for frames in parse_list(args.frames, int)
+        for logo_size in parse_list(args.logo_sizes, float)
+        for motion in motions
+    ]
+
+    precisions = parse_list(
+        args.precision,
+        str
+    )
+
+    for precision in precisions:
+
+        if precision not in PRECISIONS:
+
+            parser.error(
+                f"Unknown precision: {precision}"
+            )
+
+    if args.engine != "lama" and precisions != [PRECISION_FP32]:
+
+        parser.error(
+            "--precision only applies to --engine lama."
+        )
+
+    # float32 always runs first as the quality reference.
+    if precisions != [PRECISION_FP32]:
+
+        precisions = [PRECISION_FP32] + [
+            precision
+            for precision in precisions
+            if precision != PRECISION_FP32
+        ]
+
+    device = pick_device(
+        args.profile
+    )
+
+    engines = []
+
+    # Cold start: seconds to load each model.
+    load_seconds = {}
+
+    if args.engine == "lama":
+
+        for precision in precisions:
+
+            started = time.perf_counter()
+
+            runner = LamaRunner.load(
+                device,
+                precision,
+                args.lama_model
+            )
+
+            load_seconds[precision] = round(
+                time.perf_counter() - started,
+                3
+            )
+
+            engines.append(
+                (
+                    precision,
+                    runner,
+                    make_tiled_inpaint(
+                        runner.inpaint,
+                        args.tile,
+                        batch_size=args.batch
+                    )
+                )
+            )
+
+    elif args.engine == "telea":
+
+        engines.append(
+            (
+                PRECISION_FP32,
+                None,
+                make_classical_inpaint(ENGINE_TELEA)
+            )
+        )
+
+    elif args.engine == "ns":
+
+        engines.append(
+            (
+                PRECISION_FP32,
+                None,
+                make_classical_inpaint(ENGINE_NS)
+            )
+        )
+
+    else:
+
+        engines.append(
+            (
+                PRECISION_FP32,
+                None,
+                make_stub_inpaint(args.stub_ms)
+            )
+        )
+
+    results = []
+
+    with tempfile.TemporaryDirectory(
+        prefix="watermark_benchmark_"
+    ) as work_dir:
+
+        for case in cases:
+
+            for result in run_case(
+                work_dir,
+                engines,
+                case,
+                args
+            ):
+
+                quality = ""
+
+                if result["psnr_db"] is not None:
+                    quality = f"  PSNR {result['psnr_db']} dB"
+
+                print(
+                    f"{result['name']:<40} "
+                    f"{result['precision']:<9}"
+                    f"{result['fps']:>8.2f} fps"
+                    f"{quality}",
+                    file=sys.stderr
+                )
+
+                results.append(result)
+
+    report = {
+        "commit": git_commit(),
+        "profile": args.profile,
+        "engine": args.engine,
+        "stub_ms": args.stub_ms,
+        "device": str(device),
+        "lama_model": args.lama_model,
+        "load_seconds": load_seconds,
+        "settings": {
+            "context": args.context,
+            "batch": args.batch,
+            "queue": args.queue,
+            "reuse": args.reuse,
+            "flow": args.flow,
+            "tile": args.tile
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "opencv": cv2.__version__,
+            "cpus": os.cpu_count(),
+            "threads": threads["intra_op"],
+            "interop_threads": threads["inter_op"]
+        },
+        "cases": results
+    }
+
+    text = json.dumps(
+        report,
+        indent=2
+    )
+
+    if args.output:
+
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,649 @@
+import os
+import cv2
+import sys
+import json
+import time
+import torch
+import argparse
+import threading
+import numpy as np
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from watermark_engine import (
+    CLASSICAL_ENGINES,
+    CONTEXT_AUTO,
+    ENGINE_LAMA,
+    ENGINE_NS,
+    ENGINE_TELEA,
+    FLOW_INTERVAL,
+    LAMA_BATCH_SIZE,
+    LAMA_EXPORT_PATH,
+    PIPELINE_QUEUE_DEPTH,
+    PRECISION_FP32,
+    PRECISIONS,
+    REUSE_THRESHOLD,
+    TILE_SIZE,
+    LamaRunner,
+    ResourceMonitor,
+    StageTimer,
+    build_job_report,
+    configure_threads,
+    detect_active_ranges,
+    detect_static_mask,
+    make_classical_inpaint,
+    make_tiled_inpaint,
+    parse_time_ranges,
+    process_video,
+    write_job_report
+)
+
+
+# ============================================================
+# HEADLESS BATCH WATERMARK REMOVER
+#
+# Processes every video in a folder with ONE saved mask.
+# No Gradio UI and no manual painting per video.
+#
+# python bulk-cli.py videos/ cleaned/ --mask analysis.npz
+# python bulk-cli.py videos/ cleaned/ --mask logo.png -j 2
+#
+# The mask can be:
+#
+# - an analysis .npz written by app.py (analyze_watermark)
+# - any .npz with a "mask" array
+# - a black/white image (white = watermark)
+# - "auto": the static watermark is detected in every video
+#
+# It is rescaled to the resolution of every video.
+#
+# --engine auto uses the engine recommended by the analysis
+# (.npz from app.py), otherwise LaMa.
+#
+# --ranges "19:50-" (or "auto") processes only those time
+# ranges of every video and stream-copies the rest.
+#
+# Progress is printed to stdout as JSON lines, one object
+# per event, so other tools can follow the queue.
+# ============================================================
+
+VIDEO_EXTENSIONS = (
+    ".mp4",
+    ".mov",
+    ".mkv",
+    ".avi",
+    ".webm",
+    ".m4v"
+)
+
+ENGINE_NAMES = {
+    "lama": ENGINE_LAMA,
+    "telea": ENGINE_TELEA,
+    "ns": ENGINE_NS
+}
+
+# Minimum seconds between progress events of one file.
+PROGRESS_INTERVAL = 2.0
+
+PRINT_LOCK = threading.Lock()
+
+
+# ============================================================
+# MACHINE-READABLE OUTPUT
+# ============================================================
+
+def emit(event, **fields):
+
+    fields = dict(
+        event=event,
+        time=round(time.time(), 3),
+        **fields
+    )
+
+    with PRINT_LOCK:
+
+        sys.stdout.write(
+            json.dumps(fields) + "\n"
+        )
+
+        sys.stdout.flush()
+
+
+# ============================================================
+# MASK
+# ============================================================
+
+def load_mask(path):
+
+    engine = None
+
+    if path == "auto":
+        return None, engine
+
+    if path.lower().endswith(".npz"):
+
+        data = np.load(
+            path
+        )
+
+        if "mask" not in data:
+
+            raise SystemExit(
+                f"{path} does not contain a 'mask' array."
+            )
+
+        mask = data["mask"]
+
+        if "engine" in data:
+            engine = str(data["engine"])
+
+    else:
+
+        mask = cv2.imread(
+            path,
+            cv2.IMREAD_GRAYSCALE
+        )
+
+        if mask is None:
+
+            raise SystemExit(
+                f"Could not read mask image: {path}"
+            )
+
+    if cv2.countNonZero(
+        np.where(mask > 10, 255, 0).astype(np.uint8)
+    ) == 0:
+
+        raise SystemExit(
+            "The mask is empty."
+        )
+
+    return mask, engine
+
+
+def context_arg(value):
+
+    # A padding in pixels or "auto" (adaptive context).
+    if value == CONTEXT_AUTO:
+        return value
+
+    return int(value)
+
+
+# ============================================================
+# DEVICE
+# ============================================================
+
+def pick_device(args):
+
+    if args.gpu:
+
+        if not torch.cuda.is_available():
+
+            raise SystemExit(
+                "ERROR: CUDA is not available. Use -cpu."
+            )
+
+        return torch.device("cuda")
+
+    if args.cpu or not torch.cuda.is_available():
+        return torch.device("cpu")
+
+    return torch.device("cuda")
+
+
+# ============================================================
+# ONE FILE
+# ============================================================
+
+def run_one(
+    inpaint,
+    mask,
+    input_path,
+    output_path,
+    args
+):
+
+    name = os.path.basename(
+        input_path
+    )
+
+    started = time.time()
+
+    last = [0.0]
+
+    def progress(processed, total):
+
+        now = time.time()
+
+        if now - last[0] < PROGRESS_INTERVAL:
+            return
+
+        last[0] = now
+
+        elapsed = now - started
+
+        emit(
+            "progress",
+            file=name,
+            frame=processed,
+            total=total,
+            percent=round(
+                processed / max(total, 1) * 100,
+                1
+            ),
+            fps=round(
+                processed / max(elapsed, 1e-6),
+                2
+            )
+        )
+
+    emit(
+        "start",
+        file=name,
+        output=output_path
+    )
+
+    timer = StageTimer()
+
+    monitor = ResourceMonitor()
+
+    try:
+
+        # --mask auto: every video gets its own mask.
+        if mask is None:
+
+            detection = detect_static_mask(
+                input_path
+            )
+
+            mask = detection["mask"]
+
+            emit(
+                "detected",
+                file=name,
+                samples=detection["samples"],
+                parts=detection["parts"],
+                coverage=round(detection["coverage"], 5)
+            )
+
+        ranges = args.ranges
+
+        if ranges == "auto":
+
+            ranges = detect_active_ranges(
+                input_path,
+                mask
+            )
+
+            emit(
+                "ranges",
+                file=name,
+                ranges=[
+                    [round(start, 2), round(end, 2)]
+                    for start, end in ranges
+                ]
+            )
+
+            if not ranges:
+
+                raise ValueError(
+                    "The watermark is not visible at any time."
+                )
+
+        # A video that cannot be processed in time ranges
+        # (RangesUnsupported) fails with the reason; frames
+        # outside the ranges are never inpainted.
+        summary = process_video(
+            input_path,
+            output_path,
+            mask,
+            inpaint,
+            context_padding=args.context,
+            queue_depth=args.queue,
+            batch_size=args.batch,
+            reuse_threshold=args.reuse,
+            flow_interval=args.flow,
+            on_progress=progress,
+            timer=timer,
+            ranges=ranges
+        )
+
+        report_path = write_job_report(
+            output_path,
+            build_job_report(
+                summary,
+                timer,
+                monitor,
+                {
+                    "context": summary["context"],
+                    "adaptive_context": args.context == CONTEXT_AUTO,
+                    "queue_depth": args.queue,
+                    "batch_size": args.batch,
+                    "reuse_threshold": args.reuse,
+                    "flow_interval": args.flow,
+                    "tile_size": args.tile,
+                    "engine": args.engine,
+                    "precision": args.precision,
+                    "time_ranges": ranges
+                }
+            )
+        )
+
+    except Exception as error:
+
+        emit(
+            "error",
+            file=name,
+            error=str(error)
+        )
+
+        return False
+
+    elapsed = time.time() - started
+
+    emit(
+        "done",
+        file=name,
+        output=output_path,
+        report=report_path,
+        seconds=round(elapsed, 2),
+        fps=round(
+            summary["frames"] / max(elapsed, 1e-6),
+            2
+        ),
+        **summary
+    )
+
+    return True
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Remove the same watermark from every video in a folder."
+    )
+
+    parser.add_argument(
+        "input_dir",
+        help="Folder containing source videos"
+    )
+
+    parser.add_argument(
+        "output_dir",
+        help="Folder where cleaned videos are saved"
+    )
+
+    parser.add_argument(
+        "--mask",
+        required=True,
+        help="Saved analysis .npz, black/white mask image, or 'auto' to detect the watermark in every video"
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Videos processed at the same time (one shared model)"
+    )
+
+    parser.add_argument(
+        "--context",
+        type=context_arg,
+        default=180,
+        help="AI context padding in pixels, or 'auto' for the smallest context the background needs"
+    )
+
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=LAMA_BATCH_SIZE,
+        help="Frames per LaMa forward pass"
+    )
+
+    parser.add_argument(
+        "--tile",
+        type=int,
+        default=TILE_SIZE,
+        help="Inpaint crops larger than this as overlapping tiles, e.g. 512 for 4K (0 = off)"
+    )
+
+    parser.add_argument(
+        "--queue",
+        type=int,
+        default=PIPELINE_QUEUE_DEPTH,
+        help="Pipeline queue depth in frames"
+    )
+
+    parser.add_argument(
+        "--reuse",
+        type=float,
+        default=REUSE_THRESHOLD,
+        help="Static background reuse threshold (0 = off)"
+    )
+
+    parser.add_argument(
+        "--flow",
+        type=int,
+        default=FLOW_INTERVAL,
+        help="LaMa keyframe interval for optical-flow propagation (0 = off)"
+    )
+
+    parser.add_argument(
+        "--engine",
+        choices=("auto", *ENGINE_NAMES),
+        default="auto",
+        help="Inpainting engine (auto = recommendation saved in the analysis)"
+    )
+
+    parser.add_argument(
+        "--precision",
+        choices=PRECISIONS,
+        default=PRECISION_FP32,
+        help="LaMa precision on CPU (bfloat16 is faster, slightly lossy)"
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="PyTorch intra-op threads"
+    )
+
+    parser.add_argument(
+        "--interop-threads",
+        type=int,
+        help="PyTorch inter-op threads"
+    )
+
+    parser.add_argument(
+        "--lama-model",
+        help="Exported CPU LaMa graph (default: the exported file, when it exists)"
+    )
+
+    parser.add_argument(
+        "--ranges",
+        help="Only process these time ranges, e.g. '0:10-0:25,19:50-', or 'auto' (the rest is stream-copied)"
+    )
+
+    parser.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="Skip videos whose output file already exists"
+    )
+
+    device_group = parser.add_mutually_exclusive_group()
+
+    device_group.add_argument(
+        "-cpu",
+        action="store_true",
+        help="Force CPU"
+    )
+
+    device_group.add_argument(
+        "-gpu",
+        action="store_true",
+        help="Force NVIDIA CUDA GPU"
+    )
+
+    args = parser.parse_args()
+
+    configure_threads(
+        args.threads,
+        args.interop_threads
+    )
+
+    os.makedirs(
+        args.output_dir,
+        exist_ok=True
+    )
+
+    mask, recommended = load_mask(
+        args.mask
+    )
+
+    if args.ranges and args.ranges != "auto":
+
+        try:
+            args.ranges = parse_time_ranges(args.ranges)
+        except ValueError as error:
+            raise SystemExit(str(error))
+
+    if args.engine == "auto":
+        engine = recommended or ENGINE_LAMA
+    else:
+        engine = ENGINE_NAMES[args.engine]
+
+    # Job reports record the engine that really ran.
+    args.engine = engine
+
+    videos = sorted(
+        name
+        for name in os.listdir(args.input_dir)
+        if name.lower().endswith(VIDEO_EXTENSIONS)
+    )
+
+    queue = []
+
+    for name in videos:
+
+        output_path = os.path.join(
+            args.output_dir,
+            f"{Path(name).stem}_clean.mp4"
+        )
+
+        if args.skip_existing and os.path.exists(output_path):
+
+            emit(
+                "skipped",
+                file=name,
+                output=output_path
+            )
+
+            continue
+
+        queue.append(
+            (
+                os.path.join(args.input_dir, name),
+                output_path
+            )
+        )
+
+    if not queue:
+
+        emit(
+            "finished",
+            total=0,
+            succeeded=0,
+            failed=0
+        )
+
+        return
+
+    # --------------------------------------------------------
+    # The model is loaded once and shared by every job.
+    # --------------------------------------------------------
+
+    if engine in CLASSICAL_ENGINES:
+        device = "cpu"
+    else:
+        device = pick_device(args)
+
+    emit(
+        "loading",
+        engine=engine,
+        device=str(device),
+        videos=len(queue),
+        jobs=args.jobs
+    )
+
+    if engine in CLASSICAL_ENGINES:
+
+        inpaint = make_classical_inpaint(
+            engine
+        )
+
+    else:
+
+        model_path = None
+
+        if device.type == "cpu":
+
+            if args.lama_model:
+                model_path = args.lama_model
+
+            elif os.path.exists(LAMA_EXPORT_PATH):
+                model_path = LAMA_EXPORT_PATH
+
+        runner = LamaRunner.load(
+            device,
+            args.precision,
+            model_path
+        )
+
+        # The precision that really runs (may fall back).
+        args.precision = runner.precision
+
+        inpaint = make_tiled_inpaint(
+            runner.inpaint,
+            args.tile,
+            batch_size=args.batch
+        )
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, args.jobs)
+    ) as executor:
+
+        results = list(
+            executor.map(
+                lambda item: run_one(
+                    inpaint,
+                    mask,
+                    item[0],
+                    item[1],
+                    args
+                ),
+                queue
+            )
+        )
+
+    succeeded = sum(results)
+
+    emit(
+        "finished",
+        total=len(results),
+        succeeded=succeeded,
+        failed=len(results) - succeeded
+    )
+
+    if succeeded != len(results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
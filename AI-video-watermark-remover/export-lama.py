@@ -0,0 +1,216 @@
+import time
+import argparse
+import numpy as np
+
+from watermark_engine import (
+    LAMA_EXPORT_PATH,
+    LamaRunner,
+    configure_threads,
+    export_lama
+)
+
+
+# ============================================================
+# ONE-TIME LAMA EXPORT (CPU)
+#
+# Freezes and optimises the LaMa TorchScript model for CPU
+# inference and saves it next to a small JSON file:
+#
+# python export-lama.py
+# python export-lama.py --output /models/lama-cpu.pt
+#
+# app.py and bulk-cli.py pick the artifact up automatically
+# from the default path (or LAMA_EXPORT_PATH). Export again
+# after upgrading PyTorch.
+#
+# The script then compares the original and the exported
+# model on a test crop: load time, latency per crop and the
+# largest pixel difference.
+# ============================================================
+
+def measure(
+    label,
+    load,
+    crops,
+    mask,
+    repeats
+):
+
+    started = time.perf_counter()
+
+    runner = load()
+
+    load_seconds = time.perf_counter() - started
+
+    # The first calls include JIT profiling and warm-up.
+    first = time.perf_counter()
+
+    output = runner.inpaint(
+        crops,
+        mask
+    )[0].copy()
+
+    first_ms = (time.perf_counter() - first) * 1000.0
+
+    for _ in range(2):
+
+        runner.inpaint(
+            crops,
+            mask
+        )
+
+    started = time.perf_counter()
+
+    for _ in range(repeats):
+
+        runner.inpaint(
+            crops,
+            mask
+        )
+
+    steady_ms = (
+        (time.perf_counter() - started)
+        / repeats
+        * 1000.0
+    )
+
+    print(
+        f"{label:<10} "
+        f"load {load_seconds:6.2f} s   "
+        f"first call {first_ms:8.1f} ms   "
+        f"steady {steady_ms:8.1f} ms"
+    )
+
+    return output
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Export an optimised CPU LaMa graph."
+    )
+
+    parser.add_argument(
+        "--output",
+        default=LAMA_EXPORT_PATH,
+        help="Where to save the exported model"
+    )
+
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=512,
+        help="Side length of the test crop"
+    )
+
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="Timed calls per model"
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="Intra-op threads (default: PyTorch default)"
+    )
+
+    parser.add_argument(
+        "--interop-threads",
+        type=int,
+        help="Inter-op threads (default: PyTorch default)"
+    )
+
+    parser.add_argument(
+        "--skip-check",
+        action="store_true",
+        help="Only export, do not compare with the original model"
+    )
+
+    args = parser.parse_args()
+
+    threads = configure_threads(
+        args.threads,
+        args.interop_threads
+    )
+
+    print("Exporting LaMa...")
+
+    started = time.perf_counter()
+
+    export_lama(
+        args.output
+    )
+
+    print(
+        f"Saved {args.output} "
+        f"({time.perf_counter() - started:.1f} s)"
+    )
+
+    if args.skip_check:
+        return
+
+    print()
+    print(
+        "Threads:",
+        f"{threads['intra_op']} intra-op,",
+        f"{threads['inter_op']} inter-op"
+    )
+
+    rng = np.random.default_rng(0)
+
+    crops = [
+        rng.integers(
+            0,
+            256,
+            size=(args.size, args.size, 3),
+            dtype=np.uint8
+        )
+    ]
+
+    mask = np.zeros(
+        (args.size, args.size),
+        dtype=np.uint8
+    )
+
+    mask[
+        args.size // 3:args.size // 2,
+        args.size // 4:args.size * 3 // 4
+    ] = 255
+
+    original = measure(
+        "original",
+        lambda: LamaRunner.load("cpu"),
+        crops,
+        mask,
+        args.repeats
+    )
+
+    exported = measure(
+        "exported",
+        lambda: LamaRunner.load(
+            "cpu",
+            model_path=args.output
+        ),
+        crops,
+        mask,
+        args.repeats
+    )
+
+    difference = int(
+        np.abs(
+            original.astype(np.int16)
+            - exported
+        ).max()
+    )
+
+    print()
+    print(
+        "Largest pixel difference:",
+        difference
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import os
+import sys
+
+
+# The engine and the apps live next to this folder and are
+# imported as top-level modules.
+APP_DIR = os.path.dirname(
+    os.path.dirname(
+        os.path.abspath(__file__)
+    )
+)
+
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
@@ -0,0 +1,175 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("torch")
+
+import watermark_engine as engine
+
+
+WIDTH = 320
+HEIGHT = 200
+FRAMES = 12
+
+# Camera pan per frame, in pixels.
+PAN_X = 3
+PAN_Y = 2
+
+
+def texture():
+
+    # Smooth noise: enough structure for Farneback flow.
+    rng = np.random.default_rng(7)
+
+    noise = rng.integers(
+        0,
+        256,
+        (HEIGHT + FRAMES * PAN_Y, WIDTH + FRAMES * PAN_X, 3),
+        dtype=np.uint8
+    )
+
+    blurred = cv2.GaussianBlur(
+        noise,
+        (0, 0),
+        3
+    )
+
+    # Blurring flattens the noise; stretch it back to full range.
+    return cv2.normalize(
+        blurred,
+        None,
+        0,
+        255,
+        cv2.NORM_MINMAX
+    )
+
+
+def panning_frames():
+
+    scene = texture()
+
+    return [
+        np.ascontiguousarray(
+            scene[
+                index * PAN_Y:index * PAN_Y + HEIGHT,
+                index * PAN_X:index * PAN_X + WIDTH
+            ]
+        )
+        for index in range(FRAMES)
+    ]
+
+
+# ============================================================
+# TESTS
+# ============================================================
+
+def test_panning_clip_is_propagated_from_keyframes():
+
+    mask = np.zeros(
+        (HEIGHT, WIDTH),
+        dtype=np.uint8
+    )
+
+    mask[80:120, 130:190] = 255
+
+    frames = panning_frames()
+
+    expected = [frame.copy() for frame in frames]
+
+    calls = []
+
+    def inpaint(images, mask):
+
+        # The clip has no watermark, so the frame itself is
+        # the perfect reconstruction of every keyframe.
+        calls.append(len(images))
+
+        return [image.copy() for image in images]
+
+    flow = engine.FlowPropagator(
+        interval=FRAMES
+    )
+
+    process_batch = engine.make_batch_processor(
+        inpaint,
+        engine.plan_regions(mask, 40),
+        flow=flow
+    )
+
+    result = []
+
+    for start in range(0, FRAMES, 4):
+
+        result.extend(
+            process_batch(frames[start:start + 4])
+        )
+
+    assert flow.keyframes == sum(calls) < FRAMES / 2
+    assert flow.propagated == FRAMES - flow.keyframes
+
+    hidden = mask > 0
+
+    for index, (frame, truth) in enumerate(zip(result, expected)):
+
+        error = cv2.absdiff(
+            frame,
+            truth
+        )[hidden].mean()
+
+        # A warp that ignored the pan would be off by 20+ grey
+        # levels on this texture.
+        assert error < 4, f"frame {index}: {error:.1f}"
+
+
+def test_shift_is_scaled_back_per_axis(monkeypatch):
+
+    # 21 px tall: the small copy rounds to 10 px, so the two
+    # axes shrink by different factors (0.5 and 10 / 21).
+    mask = np.zeros(
+        (21, 512),
+        dtype=np.uint8
+    )
+
+    flow = engine.FlowPropagator(
+        interval=4
+    )
+
+    small = np.array(
+        [
+            [1.0, 0.1, 2.0],
+            [-0.1, 1.0, 3.0]
+        ]
+    )
+
+    monkeypatch.setattr(
+        flow,
+        "_estimate",
+        lambda gray, state: small
+    )
+
+    crop = np.zeros(
+        (21, 512, 3),
+        dtype=np.uint8
+    )
+
+    plan = flow.plan(
+        [crop, crop],
+        mask
+    )
+
+    assert plan[0] is None
+
+    source, matrix = plan[1]
+
+    scale_x = 256 / 512
+    scale_y = 10 / 21
+
+    assert source == 0
+
+    np.testing.assert_allclose(
+        matrix,
+        [
+            [1.0, 0.1 * scale_y / scale_x, 2.0 / scale_x],
+            [-0.1 * scale_x / scale_y, 1.0, 3.0 / scale_y]
+        ]
+    )
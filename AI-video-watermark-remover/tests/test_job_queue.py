@@ -0,0 +1,175 @@
+import os
+import sys
+import shutil
+import importlib
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+pytest.importorskip("torch")
+pytest.importorskip("gradio")
+
+if shutil.which("ffmpeg") is None:
+    pytest.skip("ffmpeg is not installed", allow_module_level=True)
+
+
+APP_DIR = os.path.dirname(
+    os.path.dirname(
+        os.path.abspath(__file__)
+    )
+)
+
+WIDTH = 160
+HEIGHT = 120
+FRAMES = 24
+
+
+# ============================================================
+# FIXTURES
+#
+# app.py parses the command line when it is imported, so it
+# is imported with a CPU-only argv. The classical engine
+# keeps the smoke test free of LaMa downloads.
+# ============================================================
+
+@pytest.fixture(scope="module")
+def app():
+
+    sys.path.insert(0, APP_DIR)
+
+    argv = sys.argv
+
+    sys.argv = ["app.py", "-cpu"]
+
+    try:
+        return importlib.import_module("app")
+    finally:
+        sys.argv = argv
+
+
+@pytest.fixture(scope="module")
+def engine(app):
+
+    return importlib.import_module("watermark_engine")
+
+
+@pytest.fixture
+def clip(tmp_path):
+
+    video_path = str(tmp_path / "clip.mp4")
+
+    writer = cv2.VideoWriter(
+        video_path,
+        cv2.VideoWriter_fourcc(*"mp4v"),
+        24.0,
+        (WIDTH, HEIGHT)
+    )
+
+    for index in range(FRAMES):
+
+        frame = np.full(
+            (HEIGHT, WIDTH, 3),
+            40 + index * 4,
+            dtype=np.uint8
+        )
+
+        cv2.putText(
+            frame,
+            "WM",
+            (100, 100),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            (255, 255, 255),
+            2
+        )
+
+        writer.write(frame)
+
+    writer.release()
+
+    mask = np.zeros(
+        (HEIGHT, WIDTH),
+        dtype=np.uint8
+    )
+
+    mask[80:110, 95:145] = 255
+
+    analysis_path = str(tmp_path / "analysis.npz")
+
+    np.savez(
+        analysis_path,
+        mask=mask,
+        bbox=np.array([95, 80, 145, 110]),
+        engine=np.array("telea")
+    )
+
+    return video_path, analysis_path
+
+
+def _removal_args(engine, clip):
+
+    video_path, analysis_path = clip
+
+    return (
+        video_path,
+        analysis_path,
+        16
+    ), {
+        "engine": engine.ENGINE_TELEA
+    }
+
+
+# ============================================================
+# TESTS
+# ============================================================
+
+def test_remove_watermark_reports_through_job(app, engine, clip):
+
+    args, kwargs = _removal_args(engine, clip)
+
+    job = app.Job()
+
+    final_file, report = app.remove_watermark(
+        *args,
+        job=job,
+        **kwargs
+    )
+
+    assert os.path.exists(final_file)
+    assert report
+    assert job.progress > 0.9
+
+
+def test_queued_removal_finishes(app, engine, clip):
+
+    args, kwargs = _removal_args(engine, clip)
+
+    job = app.JOB_QUEUE.submit(
+        app.remove_watermark,
+        *args,
+        **kwargs
+    )
+
+    assert job.wait(120)
+
+    assert job.state == engine.JOB_DONE, job.error
+    assert os.path.exists(job.result[0])
+
+
+def test_cancelled_job_stops_the_frame_loop(app, engine, clip):
+
+    args, kwargs = _removal_args(engine, clip)
+
+    job = app.Job()
+
+    job.cancel()
+
+    with pytest.raises(app.JobCancelled):
+
+        app.remove_watermark(
+            *args,
+            job=job,
+            **kwargs
+        )
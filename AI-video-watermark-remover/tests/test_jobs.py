@@ -0,0 +1,245 @@
+import time
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+pytest.importorskip("cv2")
+pytest.importorskip("torch")
+
+from watermark_engine import (
+    JOB_CANCELLED,
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    Job,
+    JobCancelled,
+    JobQueue,
+    run_frame_pipeline
+)
+
+
+# Generous upper bound for a job to finish on a slow CI box.
+TIMEOUT = 10.0
+
+
+# ============================================================
+# HELPERS
+#
+# The queue lives in the engine, so these tests run without
+# Gradio. Jobs are plain functions that receive `job=`.
+# ============================================================
+
+class FrameSource:
+
+    def __init__(self, count):
+
+        self.count = count
+
+    def read(self):
+
+        if self.count == 0:
+            return False, None
+
+        self.count -= 1
+
+        return True, np.zeros(
+            (8, 8, 3),
+            dtype=np.uint8
+        )
+
+
+def wait_for(condition):
+
+    deadline = time.time() + TIMEOUT
+
+    while time.time() < deadline:
+
+        if condition():
+            return True
+
+        time.sleep(0.01)
+
+    return False
+
+
+# ============================================================
+# TESTS
+# ============================================================
+
+def test_report_clamps_progress_and_keeps_message():
+
+    job = Job()
+
+    job.report(
+        1.5,
+        "Cleaning"
+    )
+
+    assert job.progress == 1.0
+    assert job.message == "Cleaning"
+
+    job.report(-1)
+
+    assert job.progress == 0.0
+    assert job.message == "Cleaning"
+
+
+def test_report_raises_once_cancelled():
+
+    job = Job()
+
+    job.cancel()
+
+    assert job.cancelled
+
+    with pytest.raises(JobCancelled):
+        job.report(0.5)
+
+
+def test_submitted_job_returns_its_result():
+
+    jobs = JobQueue(workers=1)
+
+    def work(value, job):
+
+        job.report(1.0, "Finished")
+
+        return value * 2
+
+    job = jobs.submit(
+        work,
+        21
+    )
+
+    assert job.wait(TIMEOUT)
+
+    assert job.state == JOB_DONE
+    assert job.result == 42
+    assert job.error is None
+    assert job.progress == 1.0
+    assert jobs.get(job.id) is None
+
+
+def test_failing_job_keeps_the_error():
+
+    jobs = JobQueue(workers=1)
+
+    def work(job):
+
+        raise ValueError("broken")
+
+    job = jobs.submit(
+        work
+    )
+
+    assert job.wait(TIMEOUT)
+
+    assert job.state == JOB_FAILED
+    assert isinstance(job.error, ValueError)
+    assert job.result is None
+
+
+def test_queued_job_is_cancelled_without_running():
+
+    jobs = JobQueue(workers=1)
+
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def block(job):
+
+        started.set()
+        release.wait(TIMEOUT)
+
+    def work(job):
+
+        ran.append(job.id)
+
+    first = jobs.submit(block)
+
+    assert started.wait(TIMEOUT)
+
+    second = jobs.submit(work)
+
+    assert first.state == JOB_RUNNING
+    assert second.state == JOB_QUEUED
+    assert jobs.position(first) == 0
+    assert jobs.position(second) == 1
+    assert jobs.counts() == (1, 1)
+
+    jobs.cancel(second.id)
+
+    # A waiting job finishes at once, before any worker frees up.
+    assert second.finished
+    assert second.state == JOB_CANCELLED
+    assert jobs.counts() == (1, 0)
+
+    release.set()
+
+    assert first.wait(TIMEOUT)
+    assert first.state == JOB_DONE
+    assert ran == []
+
+
+def test_running_job_stops_at_next_report():
+
+    jobs = JobQueue(workers=1)
+
+    started = threading.Event()
+
+    def work(job):
+
+        started.set()
+
+        while True:
+
+            job.report(0.5)
+
+            time.sleep(0.01)
+
+    job = jobs.submit(work)
+
+    assert started.wait(TIMEOUT)
+
+    jobs.cancel(job.id)
+
+    assert job.wait(TIMEOUT)
+    assert job.state == JOB_CANCELLED
+    assert isinstance(job.error, JobCancelled)
+
+    assert wait_for(
+        lambda: jobs.counts() == (0, 0)
+    )
+
+
+def test_cancel_stops_the_frame_pipeline():
+
+    job = Job()
+
+    written = []
+
+    def progress(processed):
+
+        if processed == 3:
+            job.cancel()
+
+        job.report(processed / 100)
+
+    with pytest.raises(JobCancelled):
+
+        run_frame_pipeline(
+            FrameSource(100),
+            lambda frames: frames,
+            written.append,
+            queue_depth=2,
+            batch_size=1,
+            on_progress=progress
+        )
+
+    # Frames already handed to the writer are flushed, the rest
+    # of the video is never decoded.
+    assert 3 <= len(written) < 100
@@ -0,0 +1,140 @@
+import sys
+import types
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("cv2")
+
+import watermark_engine as engine
+
+
+class DtypeProbe(torch.nn.Module):
+
+    # Fills the output with 1 when its convolution ran in
+    # bfloat16, so the precision that really ran is visible.
+    def __init__(self):
+
+        super().__init__()
+
+        self.conv = torch.nn.Conv2d(3, 3, 3, padding=1)
+
+    def forward(self, image, mask):
+
+        result = self.conv(image)
+
+        flag = 1.0 if result.dtype == torch.bfloat16 else 0.0
+
+        return torch.full_like(image, flag)
+
+
+class Conv(torch.nn.Module):
+
+    def __init__(self):
+
+        super().__init__()
+
+        self.conv = torch.nn.Conv2d(3, 3, 3, padding=1)
+
+    def forward(self, image, mask):
+
+        return self.conv(image)
+
+
+def scripted_probe():
+
+    return torch.jit.script(DtypeProbe()).eval()
+
+
+def ran_in_bfloat16(runner):
+
+    image = torch.rand(1, 3, 16, 16)
+    mask = torch.zeros(1, 1, 16, 16)
+
+    with torch.inference_mode():
+        return bool(runner._forward(image, mask).mean() == 1.0)
+
+
+@pytest.fixture
+def simple_lama(monkeypatch):
+
+    # Stands in for simple_lama_inpainting (no download).
+    model = scripted_probe()
+
+    module = types.ModuleType("simple_lama_inpainting")
+
+    class SimpleLama:
+
+        def __init__(self, device=None):
+            self.model = model
+
+    module.SimpleLama = SimpleLama
+
+    monkeypatch.setitem(
+        sys.modules,
+        "simple_lama_inpainting",
+        module
+    )
+
+    return model
+
+
+@pytest.fixture
+def export_path(tmp_path):
+
+    # Frozen only: graphs rewritten by optimize_for_inference
+    # cannot be reloaded by every PyTorch build.
+    path = str(tmp_path / "lama.pt")
+
+    torch.jit.save(
+        torch.jit.freeze(
+            torch.jit.script(Conv()).eval()
+        ),
+        path
+    )
+
+    return path
+
+
+# ============================================================
+# TESTS
+# ============================================================
+
+def test_frozen_graph_ignores_bfloat16_autocast():
+
+    frozen = torch.jit.optimize_for_inference(
+        torch.jit.freeze(scripted_probe())
+    )
+
+    runner = engine.LamaRunner(
+        frozen,
+        "cpu",
+        engine.PRECISION_BF16
+    )
+
+    assert not ran_in_bfloat16(runner)
+
+
+def test_bfloat16_skips_the_frozen_export(simple_lama, export_path):
+
+    runner = engine.LamaRunner.load(
+        "cpu",
+        engine.PRECISION_BF16,
+        export_path
+    )
+
+    assert runner.model is simple_lama
+    assert runner.precision == engine.PRECISION_BF16
+    assert ran_in_bfloat16(runner)
+
+
+def test_float32_uses_the_frozen_export(simple_lama, export_path):
+
+    runner = engine.LamaRunner.load(
+        "cpu",
+        engine.PRECISION_FP32,
+        export_path
+    )
+
+    assert runner.model is not simple_lama
+    assert runner.precision == engine.PRECISION_FP32
@@ -0,0 +1,94 @@
+import shutil
+import subprocess
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("torch")
+
+import watermark_engine as engine
+
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+    reason="ffmpeg and ffprobe are not installed"
+)
+
+WIDTH = 160
+HEIGHT = 96
+
+
+@pytest.fixture
+def clip(tmp_path):
+
+    path = str(tmp_path / "clip.mp4")
+
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+
+            "-f",
+            "lavfi",
+
+            "-i",
+            f"testsrc=size={WIDTH}x{HEIGHT}:rate=25:duration=2",
+
+            "-c:v",
+            "libx264",
+
+            "-pix_fmt",
+            "yuv420p",
+
+            path
+        ],
+        check=True
+    )
+
+    return path
+
+
+# ============================================================
+# TESTS
+# ============================================================
+
+def test_estimate_includes_decode_and_encode(clip):
+
+    mask = np.zeros(
+        (HEIGHT, WIDTH),
+        dtype=np.uint8
+    )
+
+    mask[40:56, 60:100] = 255
+
+    preview = engine.render_preview(
+        clip,
+        mask,
+        engine.make_classical_inpaint(engine.ENGINE_TELEA),
+        context_padding=24
+    )
+
+    assert len(preview["frames"]) == engine.PREVIEW_FRAMES
+    assert preview["total_frames"] == 50
+
+    assert preview["decode_seconds"] > 0
+    assert preview["inpaint_seconds"] > 0
+    assert preview["encode_seconds"] > 0
+
+    assert preview["seconds_per_frame"] == pytest.approx(
+        preview["decode_seconds"]
+        + preview["inpaint_seconds"]
+        + preview["encode_seconds"]
+    )
+
+    assert preview["estimate_seconds"] == pytest.approx(
+        preview["seconds_per_frame"] * 50
+    )
+
+    text = engine.format_preview(preview)
+
+    assert "decode" in text
+    assert "encode" in text
@@ -0,0 +1,208 @@
+import shutil
+import subprocess
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("torch")
+
+import watermark_engine as engine
+
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None,
+    reason="ffmpeg is not installed"
+)
+
+WIDTH = 160
+HEIGHT = 96
+FRAMES = 50
+
+SEGMENT_FRAMES = 10
+
+# The first run dies after this many frames.
+CRASH_AFTER = 25
+
+
+def read_frames(path):
+
+    cap = cv2.VideoCapture(
+        path
+    )
+
+    frames = []
+
+    while True:
+
+        ok, frame = cap.read()
+
+        if not ok:
+            break
+
+        frames.append(frame)
+
+    cap.release()
+
+    return frames
+
+
+@pytest.fixture
+def clip(tmp_path):
+
+    path = str(tmp_path / "clip.mp4")
+
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+
+            "-f",
+            "lavfi",
+
+            "-i",
+            f"testsrc=size={WIDTH}x{HEIGHT}:rate=25:duration=2",
+
+            "-c:v",
+            "libx264",
+
+            "-g",
+            "25",
+
+            "-bf",
+            "3",
+
+            "-pix_fmt",
+            "yuv420p",
+
+            path
+        ],
+        check=True
+    )
+
+    return path
+
+
+@pytest.fixture
+def process_batch():
+
+    mask = np.zeros(
+        (HEIGHT, WIDTH),
+        dtype=np.uint8
+    )
+
+    mask[60:80, 100:150] = 255
+
+    return engine.make_batch_processor(
+        engine.make_classical_inpaint(engine.ENGINE_TELEA),
+        engine.plan_regions(mask, 16)
+    )
+
+
+def run(
+    clip,
+    work_dir,
+    process_batch,
+    output=None
+):
+
+    # The resumable writer path of app.py, without the UI.
+    writer = engine.ResumableJob(
+        work_dir,
+        "job",
+        WIDTH,
+        HEIGHT,
+        25,
+        segment_frames=SEGMENT_FRAMES
+    )
+
+    start = writer.start_frame
+
+    cap = cv2.VideoCapture(
+        clip
+    )
+
+    try:
+
+        engine.run_frame_pipeline(
+            engine.FrameRangeReader(cap, start),
+            process_batch,
+            writer.write,
+            batch_size=1
+        )
+
+        writer.finish()
+
+    finally:
+
+        cap.release()
+        writer.release()
+
+    if output is not None:
+
+        writer.complete(
+            output
+        )
+
+    return start
+
+
+# ============================================================
+# TESTS
+# ============================================================
+
+def test_resumed_job_matches_an_uninterrupted_one(
+    clip,
+    process_batch,
+    tmp_path
+):
+
+    expected = str(tmp_path / "expected.mp4")
+    resumed = str(tmp_path / "resumed.mp4")
+
+    run(
+        clip,
+        str(tmp_path / "straight"),
+        process_batch,
+        expected
+    )
+
+    seen = [0]
+
+    def crashing(frames):
+
+        if seen[0] >= CRASH_AFTER:
+            raise RuntimeError("power cut")
+
+        seen[0] += len(frames)
+
+        return process_batch(frames)
+
+    with pytest.raises(RuntimeError, match="power cut"):
+
+        run(
+            clip,
+            str(tmp_path / "work"),
+            crashing
+        )
+
+    # Only finished segments survive; the partial one is redone.
+    start = run(
+        clip,
+        str(tmp_path / "work"),
+        process_batch,
+        resumed
+    )
+
+    assert start == CRASH_AFTER // SEGMENT_FRAMES * SEGMENT_FRAMES
+
+    straight = read_frames(expected)
+    continued = read_frames(resumed)
+
+    assert len(straight) == len(continued) == FRAMES
+
+    for index, (a, b) in enumerate(zip(straight, continued)):
+
+        assert np.array_equal(a, b), f"frame {index} differs"
@@ -0,0 +1,143 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("torch")
+
+import watermark_engine as engine
+
+
+WIDTH = 160
+HEIGHT = 96
+FRAMES = 12
+
+
+def still_frame():
+
+    rng = np.random.default_rng(3)
+
+    return cv2.GaussianBlur(
+        rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8),
+        (0, 0),
+        2
+    )
+
+
+def watermark_mask():
+
+    mask = np.zeros(
+        (HEIGHT, WIDTH),
+        dtype=np.uint8
+    )
+
+    mask[40:56, 60:100] = 255
+
+    return mask
+
+
+def counting_telea(calls):
+
+    telea = engine.make_classical_inpaint(
+        engine.ENGINE_TELEA
+    )
+
+    def inpaint(images, mask):
+
+        calls.append(len(images))
+
+        return telea(images, mask)
+
+    return inpaint
+
+
+def run(frames, cache, calls):
+
+    process_batch = engine.make_batch_processor(
+        counting_telea(calls),
+        engine.plan_regions(watermark_mask(), 24),
+        cache=cache
+    )
+
+    result = []
+
+    for start in range(0, len(frames), 4):
+
+        result.extend(
+            process_batch(
+                [frame.copy() for frame in frames[start:start + 4]]
+            )
+        )
+
+    return result
+
+
+# ============================================================
+# TESTS
+# ============================================================
+
+def test_static_background_is_inpainted_once():
+
+    frames = [still_frame()] * FRAMES
+
+    calls = []
+
+    cache = engine.InpaintReuseCache()
+
+    reused = run(
+        frames,
+        cache,
+        calls
+    )
+
+    fresh = run(
+        frames,
+        engine.InpaintReuseCache(threshold=0),
+        []
+    )
+
+    # Within a batch all misses share one call; later
+    # batches hit the cache and skip the inpainter.
+    assert calls == [4]
+    assert cache.stats() == {
+        "cache_hits": FRAMES - 4,
+        "cache_misses": 4
+    }
+
+    assert engine.reuse_summary(
+        cache.hits,
+        cache.misses
+    ) == "8 reused / 4 inferred (66.7% reuse)"
+
+    for a, b in zip(reused, fresh):
+        assert np.array_equal(a, b)
+
+
+def test_local_change_is_not_reused():
+
+    base = still_frame()
+
+    # A small bright detail appears in the context ring.
+    changed = base.copy()
+    changed[30:38, 50:58] = 255
+
+    frames = [base] * 4 + [changed] * 4
+
+    calls = []
+
+    cache = engine.InpaintReuseCache()
+
+    result = run(
+        frames,
+        cache,
+        calls
+    )
+
+    assert calls == [4, 4]
+
+    expected = run(
+        [changed],
+        engine.InpaintReuseCache(threshold=0),
+        []
+    )[0]
+
+    assert np.array_equal(result[-1], expected)
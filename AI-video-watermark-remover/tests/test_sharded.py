@@ -0,0 +1,142 @@
+import os
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("torch")
+
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+    reason="ffmpeg and ffprobe are not installed"
+)
+
+APP_DIR = os.path.dirname(
+    os.path.dirname(
+        os.path.abspath(__file__)
+    )
+)
+
+WIDTH = 160
+HEIGHT = 96
+FRAMES = 50
+
+# Stands in for app.py: a main script whose module-level
+# code must not run again in the shard workers.
+SCRIPT = """
+import sys
+
+sys.path.insert(0, {app_dir!r})
+
+if __name__ == "__mp_main__":
+    open({marker!r}, "w").close()
+
+import numpy as np
+import watermark_engine as engine
+
+if __name__ == "__main__":
+
+    mask = np.zeros(({height}, {width}), dtype=np.uint8)
+    mask[40:56, 60:100] = 255
+
+    summary = engine.remove_watermark_sharded(
+        {clip!r},
+        {output!r},
+        engine.plan_regions(mask, 24),
+        {width},
+        {height},
+        25,
+        {frames},
+        2,
+        "cpu",
+        threads=1,
+        engine=engine.ENGINE_TELEA
+    )
+
+    print(summary["frames"])
+"""
+
+
+@pytest.fixture
+def clip(tmp_path):
+
+    path = str(tmp_path / "clip.mp4")
+
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+
+            "-f",
+            "lavfi",
+
+            "-i",
+            f"testsrc=size={WIDTH}x{HEIGHT}:rate=25:duration=2",
+
+            "-c:v",
+            "libx264",
+
+            "-pix_fmt",
+            "yuv420p",
+
+            path
+        ],
+        check=True
+    )
+
+    return path
+
+
+# ============================================================
+# TESTS
+# ============================================================
+
+def test_shard_workers_do_not_rerun_the_main_script(
+    clip,
+    tmp_path
+):
+
+    marker = str(tmp_path / "main-imported")
+    output = str(tmp_path / "out.mp4")
+    script = tmp_path / "main.py"
+
+    script.write_text(
+        SCRIPT.format(
+            app_dir=APP_DIR,
+            marker=marker,
+            clip=clip,
+            output=output,
+            width=WIDTH,
+            height=HEIGHT,
+            frames=FRAMES
+        )
+    )
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            str(script)
+        ],
+        capture_output=True,
+        text=True,
+        timeout=300
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-1] == str(FRAMES)
+
+    assert not os.path.exists(marker)
+
+    cap = cv2.VideoCapture(
+        output
+    )
+
+    assert int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) == FRAMES
+
+    cap.release()
@@ -0,0 +1,137 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("cv2")
+
+import watermark_engine as engine
+
+
+TILE = 64
+CAP = 3
+
+
+class BlurFill(torch.nn.Module):
+
+    # Stand-in for LaMa: masked pixels become a local blur.
+    def forward(self, image, mask):
+
+        blur = torch.nn.functional.avg_pool2d(
+            image,
+            5,
+            1,
+            2
+        )
+
+        return image * (1 - mask) + blur * mask
+
+
+@pytest.fixture
+def runner():
+
+    return engine.LamaRunner(
+        torch.jit.script(BlurFill()),
+        "cpu"
+    )
+
+
+@pytest.fixture
+def crops():
+
+    rng = np.random.default_rng(7)
+
+    images = [
+        rng.integers(0, 256, (300, 420, 3), dtype=np.uint8)
+        for _ in range(4)
+    ]
+
+    # Covers most of the tile grid.
+    mask = np.zeros(
+        (300, 420),
+        dtype=np.uint8
+    )
+
+    mask[10:290, 10:410] = 255
+
+    return images, mask
+
+
+# ============================================================
+# TESTS
+# ============================================================
+
+def test_tile_batches_never_exceed_the_cap(runner, crops):
+
+    images, mask = crops
+
+    sizes = []
+
+    def inpaint(batch, batch_mask):
+
+        sizes.append(len(batch))
+
+        return runner.inpaint(
+            batch,
+            batch_mask
+        )
+
+    tiled = engine.make_tiled_inpaint(
+        inpaint,
+        TILE,
+        overlap=16,
+        batch_size=CAP
+    )
+
+    tiled(images, mask)
+
+    # Dozens of (tile, frame) pairs, never more than CAP at once.
+    assert sum(sizes) > 10 * CAP
+    assert max(sizes) <= CAP
+
+    assert all(
+        buffers["batch"] <= CAP
+        for buffers in runner._local.buffers.values()
+    )
+
+
+def test_chunking_does_not_change_the_output(runner, crops):
+
+    images, mask = crops
+
+    one = engine.make_tiled_inpaint(
+        runner.inpaint,
+        TILE,
+        overlap=16,
+        batch_size=1
+    )(images, mask)
+
+    many = engine.make_tiled_inpaint(
+        runner.inpaint,
+        TILE,
+        overlap=16,
+        batch_size=CAP
+    )(images, mask)
+
+    for a, b in zip(one, many):
+        assert np.array_equal(a, b)
+
+
+def test_tiles_only_change_masked_tiles(crops):
+
+    images, mask = crops
+
+    mask = np.zeros_like(mask)
+    mask[20:40, 30:50] = 255
+
+    outputs = engine.make_tiled_inpaint(
+        engine.make_classical_inpaint(engine.ENGINE_TELEA),
+        TILE,
+        overlap=16
+    )(images, mask)
+
+    for image, output in zip(images, outputs):
+
+        # Only the first tile holds watermark pixels.
+        assert np.array_equal(output[:, TILE:], image[:, TILE:])
+        assert np.array_equal(output[TILE:], image[TILE:])
+        assert not np.array_equal(output[20:40, 30:50], image[20:40, 30:50])
@@ -0,0 +1,207 @@
+import shutil
+import subprocess
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("torch")
+
+import watermark_engine as engine
+
+
+needs_ffmpeg = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+    reason="ffmpeg and ffprobe are not installed"
+)
+
+WIDTH = 160
+HEIGHT = 96
+
+
+def invert(frames):
+
+    return [
+        np.ascontiguousarray(255 - frame)
+        for frame in frames
+    ]
+
+
+def read_frames(path):
+
+    cap = cv2.VideoCapture(
+        path
+    )
+
+    frames = []
+
+    while True:
+
+        ok, frame = cap.read()
+
+        if not ok:
+            break
+
+        frames.append(frame)
+
+    cap.release()
+
+    return frames
+
+
+@pytest.fixture
+def x264_clip(tmp_path):
+
+    # 6 s at 25 fps, a keyframe every second, B-frames on.
+    path = str(tmp_path / "clip.mp4")
+
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+
+            "-f",
+            "lavfi",
+
+            "-i",
+            f"testsrc=size={WIDTH}x{HEIGHT}:rate=25:duration=6",
+
+            "-c:v",
+            "libx264",
+
+            "-g",
+            "25",
+
+            "-bf",
+            "3",
+
+            "-pix_fmt",
+            "yuv420p",
+
+            path
+        ],
+        check=True
+    )
+
+    return path
+
+
+# ============================================================
+# TESTS
+# ============================================================
+
+def test_clean_keyframes_skip_open_gop_keyframes():
+
+    # Decode order: IDR, P, B, B | open-GOP I with two
+    # leading B-frames shown before it | closed I.
+    packets = [
+        (0.00, True),
+        (0.12, False),
+        (0.04, False),
+        (0.08, False),
+        (0.24, True),
+        (0.16, False),
+        (0.20, False),
+        (0.28, False),
+        (0.32, True),
+        (0.36, False)
+    ]
+
+    assert engine.clean_keyframes(packets) == [0.00, 0.32]
+
+
+@needs_ffmpeg
+def test_frames_outside_the_ranges_are_copied_bit_exact(
+    x264_clip,
+    tmp_path
+):
+
+    output = str(tmp_path / "out.mp4")
+
+    summary = engine.remove_watermark_ranges(
+        x264_clip,
+        output,
+        [(2.2, 2.6)],
+        invert,
+        WIDTH,
+        HEIGHT
+    )
+
+    # Widened to the keyframes at 2 s and 3 s.
+    assert summary["spans"] == [(2.0, 3.0)]
+    assert summary["frames"] == 25
+
+    source = read_frames(x264_clip)
+    result = read_frames(output)
+
+    assert len(result) == len(source) == 150
+
+    changed = [
+        index
+        for index, (a, b) in enumerate(zip(source, result))
+        if not np.array_equal(a, b)
+    ]
+
+    assert changed == list(range(50, 75))
+
+
+@needs_ffmpeg
+def test_unsupported_source_is_rejected_before_inpainting(tmp_path):
+
+    path = str(tmp_path / "mpeg4.mp4")
+
+    writer = cv2.VideoWriter(
+        path,
+        cv2.VideoWriter_fourcc(*"mp4v"),
+        25.0,
+        (WIDTH, HEIGHT)
+    )
+
+    for index in range(25):
+
+        writer.write(
+            np.full((HEIGHT, WIDTH, 3), index * 8, dtype=np.uint8)
+        )
+
+    writer.release()
+
+    calls = []
+
+    def process_batch(frames):
+
+        calls.append(len(frames))
+
+        return frames
+
+    output = str(tmp_path / "out.mp4")
+
+    with pytest.raises(engine.RangesUnsupported):
+
+        engine.remove_watermark_ranges(
+            path,
+            output,
+            [(0.0, 0.5)],
+            process_batch,
+            WIDTH,
+            HEIGHT
+        )
+
+    assert not calls
+    assert not (tmp_path / "out.mp4").exists()
+
+
+@needs_ffmpeg
+def test_ranges_outside_the_video_are_rejected(x264_clip, tmp_path):
+
+    with pytest.raises(engine.RangesUnsupported):
+
+        engine.remove_watermark_ranges(
+            x264_clip,
+            str(tmp_path / "out.mp4"),
+            [(30.0, 40.0)],
+            invert,
+            WIDTH,
+            HEIGHT
+        )
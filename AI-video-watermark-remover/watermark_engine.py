@@ -0,0 +1,6585 @@
+import os
+import re
+import cv2
+import sys
+import json
+import time
+import uuid
+import queue
+import torch
+import shutil
+import hashlib
+import tempfile
+import threading
+import collections
+import subprocess
+import numpy as np
+import multiprocessing
+
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    wait
+)
+
+# simple_lama_inpainting is imported inside LamaRunner.load,
+# so processes that use an exported graph never import it.
+
+
+# ============================================================
+# SHARED PROCESSING ENGINE
+#
+# Frame-loop building blocks shared by app.py and
+# CPUonlyOptimized.py.
+#
+# Nothing in this module imports Gradio. Errors are raised
+# as normal Python exceptions and the applications turn
+# them into gr.Error messages.
+# ============================================================
+
+
+# ============================================================
+# PIPELINE SETTINGS
+# ============================================================
+
+# Frames buffered between decode → AI → encode.
+#
+# Every queued 1080p frame costs about 6 MB of RAM, so the
+# default keeps two small queues well under 100 MB.
+PIPELINE_QUEUE_DEPTH = 8
+
+# How often blocked stages re-check the stop flag.
+PIPELINE_POLL_SECONDS = 0.1
+
+# Context crops sent through LaMa in one forward pass.
+#
+# Every crop of a job has the same shape and the same mask,
+# so consecutive frames can be stacked into one tensor.
+LAMA_BATCH_SIZE = 4
+
+# Tiled inference: crops with a side above TILE_SIZE are
+# split into overlapping tiles of that size (0 = off). 512 is
+# close to the resolution LaMa was trained at.
+TILE_SIZE = 0
+
+# Overlap between neighbouring tiles, feathered when joined.
+TILE_OVERLAP = 128
+
+# CPU inference precision.
+#
+# bfloat16 runs convolutions under autocast and uses the
+# bf16 units of recent Xeons (AMX / AVX-512 BF16). Ops that
+# are unsafe in bf16 (FFT, reductions) stay in float32.
+#
+# There is no int8 mode: dynamic quantisation only covers
+# linear layers, and LaMa is convolutions and FFTs.
+#
+# bfloat16 is lossy; the benchmark reports PSNR against
+# float32.
+PRECISION_FP32 = "float32"
+PRECISION_BF16 = "bfloat16"
+
+PRECISIONS = (
+    PRECISION_FP32,
+    PRECISION_BF16
+)
+
+# LaMa needs input sides that are a multiple of 8.
+LAMA_PAD_MODULO = 8
+
+# ============================================================
+# OUTPUT SETTINGS
+# ============================================================
+
+OUTPUT_STREAM = "Stream to FFmpeg (single encode)"
+OUTPUT_RESUMABLE = "Resumable segments (checkpoint + resume)"
+OUTPUT_LEGACY = "Legacy mp4v file + FFmpeg re-encode"
+
+OUTPUT_MODES = [
+    OUTPUT_STREAM,
+    OUTPUT_RESUMABLE,
+    OUTPUT_LEGACY
+]
+
+# Frames per checkpoint segment in resumable mode
+# (one minute at 25 fps).
+SEGMENT_FRAMES = 1500
+
+# Bytes hashed from the start and the end of a video to
+# identify it without reading the whole file.
+FINGERPRINT_BYTES = 1 << 20
+
+# Source audio codecs that can be copied into MP4 unchanged.
+# Anything else is re-encoded to AAC.
+MP4_AUDIO_CODECS = {
+    "aac",
+    "mp3",
+    "ac3",
+    "eac3",
+    "alac",
+    "opus"
+}
+
+# ============================================================
+# WORKSPACE SETTINGS
+# ============================================================
+
+# Size limit of the work folder (analyses, outputs, resumable
+# jobs). Least recently used entries are deleted beyond it.
+# 0 = unlimited.
+WORKSPACE_QUOTA_MB = int(
+    os.environ.get(
+        "WORK_DIR_QUOTA_MB",
+        "10240"
+    )
+)
+
+# Entries used this recently are never deleted.
+WORKSPACE_GRACE_SECONDS = 15 * 60
+
+# ============================================================
+# JOB QUEUE SETTINGS
+# ============================================================
+
+# Removal jobs that run at the same time. Later jobs wait in
+# line; all of them share the same loaded model.
+JOB_WORKERS = int(
+    os.environ.get(
+        "JOB_WORKERS",
+        "1"
+    )
+)
+
+# How often a waiting request re-reads the state of its job.
+JOB_POLL_SECONDS = 0.5
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+# ============================================================
+# PARALLEL SETTINGS
+# ============================================================
+
+# Worker processes for time-sharded removal.
+# 1 = process the whole video in this process.
+SHARD_WORKERS = 1
+
+# ============================================================
+# REUSE CACHE SETTINGS
+# ============================================================
+
+# Mean absolute difference (0–255) between downscaled grey
+# context crops below which a cached reconstruction is
+# reused instead of running LaMa again. 0 disables reuse.
+REUSE_THRESHOLD = 1.5
+
+# Recent reconstructions kept for comparison.
+REUSE_CACHE_SIZE = 4
+
+# Side length of the downscaled crop used for comparison.
+REUSE_SIGNATURE_SIZE = 32
+
+# ============================================================
+# FLOW PROPAGATION SETTINGS
+# ============================================================
+
+# LaMa runs at least every FLOW_INTERVAL frames; the frames in
+# between are warped from the last keyframe. 0 = off.
+FLOW_INTERVAL = 0
+
+# Largest mean grey error (0–255) on the context ring between
+# the warped keyframe and the frame before LaMa runs again.
+FLOW_MAX_ERROR = 6.0
+
+# Mean grey difference on the ring that counts as a scene cut.
+FLOW_CUT_THRESHOLD = 30.0
+
+# Minimum share of ring points that agree with the motion.
+FLOW_MIN_INLIERS = 0.5
+
+# Flow is measured on crops with at most this longer side.
+FLOW_SIDE = 256
+
+# Pixels around the watermark (at flow size) left out of the
+# ring, and spacing of the ring points used for the fit.
+FLOW_RING_MARGIN = 4
+FLOW_GRID = 4
+FLOW_MIN_POINTS = 24
+
+# ============================================================
+# ADAPTIVE CONTEXT SETTINGS
+# ============================================================
+
+# Passed instead of a padding to choose it automatically.
+CONTEXT_AUTO = "auto"
+
+# Context padding limits (pixels) in adaptive mode.
+CONTEXT_MIN = 32
+CONTEXT_MAX = 500
+
+# Width of the distance bands around the mask.
+CONTEXT_BAND = 16
+
+# The context is enough once one more band changes the
+# texture statistics of the context by less than this.
+CONTEXT_TOLERANCE = 0.05
+
+# Frames sampled to measure the texture.
+CONTEXT_SAMPLES = 8
+
+_END = object()
+
+
+# ============================================================
+# EXPORTED LAMA GRAPH
+#
+# SimpleLama loads the TorchScript model that it downloads
+# and runs it through the default JIT executor. A one-time
+# export (export-lama.py) freezes that model and runs
+# torch.jit.optimize_for_inference on it:
+#
+# - weights become constants, so conv + batch-norm folding
+#   and constant propagation happen once
+# - convolutions are rewritten to prepacked oneDNN (MKLDNN)
+#   kernels for the CPU
+#
+# The artifact is CPU-only and tied to the PyTorch version
+# that produced it; a JSON file next to it records that.
+# Loading it skips the simple_lama_inpainting import and the
+# graph optimisation work of every new process.
+# ============================================================
+
+LAMA_EXPORT_PATH = os.environ.get(
+    "LAMA_EXPORT_PATH",
+    os.path.join(
+        os.path.expanduser("~"),
+        ".cache",
+        "watermark_remover",
+        "big-lama-cpu-optimized.pt"
+    )
+)
+
+
+def _export_metadata_path(path):
+
+    return os.path.splitext(path)[0] + ".json"
+
+
+def configure_threads(
+    intra_op=None,
+    inter_op=None
+):
+
+    # intra-op: threads inside one operator (convolutions).
+    # inter-op: operators of the graph run side by side.
+    if intra_op:
+
+        torch.set_num_threads(
+            int(intra_op)
+        )
+
+    if inter_op:
+
+        try:
+
+            torch.set_num_interop_threads(
+                int(inter_op)
+            )
+
+        except RuntimeError:
+
+            # Only allowed before the first parallel work.
+            print(
+                "Inter-op threads can only be set at startup; "
+                f"keeping {torch.get_num_interop_threads()}."
+            )
+
+    return {
+        "intra_op": torch.get_num_threads(),
+        "inter_op": torch.get_num_interop_threads()
+    }
+
+
+def export_lama(path=LAMA_EXPORT_PATH):
+
+    from simple_lama_inpainting import SimpleLama
+
+    model = SimpleLama(
+        device=torch.device("cpu")
+    ).model.eval()
+
+    frozen = torch.jit.freeze(
+        model
+    )
+
+    optimized = torch.jit.optimize_for_inference(
+        frozen
+    )
+
+    os.makedirs(
+        os.path.dirname(os.path.abspath(path)),
+        exist_ok=True
+    )
+
+    torch.jit.save(
+        optimized,
+        path
+    )
+
+    metadata = {
+        "torch": torch.__version__,
+        "device": "cpu",
+        "source": "simple_lama_inpainting"
+    }
+
+    with open(_export_metadata_path(path), "w") as file:
+
+        json.dump(
+            metadata,
+            file,
+            indent=2
+        )
+
+    return optimized
+
+
+def load_exported_lama(
+    path,
+    device
+):
+
+    if torch.device(device).type != "cpu":
+
+        raise ValueError(
+            "The exported LaMa graph is CPU-only."
+        )
+
+    metadata_path = _export_metadata_path(
+        path
+    )
+
+    if os.path.exists(metadata_path):
+
+        with open(metadata_path) as file:
+            metadata = json.load(file)
+
+        if metadata.get("torch") != torch.__version__:
+
+            raise RuntimeError(
+                f"{path} was exported with PyTorch "
+                f"{metadata.get('torch')}, this is "
+                f"{torch.__version__}. Export it again."
+            )
+
+    model = torch.jit.load(
+        path,
+        map_location="cpu"
+    )
+
+    return model.eval()
+
+
+# ============================================================
+# TENSOR-NATIVE LAMA RUNNER
+#
+# Runs the TorchScript model inside SimpleLama directly on
+# numpy crops, without PIL images or colour conversions:
+#
+# - crops are copied into a preallocated uint8 host buffer
+# - the pad to a multiple of 8 is mirrored in place, so the
+#   result is cropped back instead of resized
+# - BGR → RGB and RGB → BGR are channel flips on the tensor
+# - input, mask and output buffers are kept per crop shape
+#   and reused for every batch
+#
+# Returned arrays are views into the output buffer. They stay
+# valid until the next call with the same crop shape on the
+# same thread; copy them if they must live longer.
+#
+# Buffers are per thread, so several jobs can share one
+# loaded model at the same time.
+# ============================================================
+
+def _ceil_modulo(value, modulo):
+
+    return -(-value // modulo) * modulo
+
+
+def _mirror_index(size, padded):
+
+    # Symmetric padding: ... c b a | a b c ... c b a | ...
+    index = 2 * size - 1 - np.arange(
+        size,
+        padded
+    )
+
+    return np.clip(
+        index,
+        0,
+        size - 1
+    )
+
+
+class LamaRunner:
+
+    def __init__(
+        self,
+        model,
+        device,
+        precision=PRECISION_FP32
+    ):
+
+        self.model = model
+        self.device = torch.device(device)
+        self.precision = precision
+        self._local = threading.local()
+
+    @classmethod
+    def load(
+        cls,
+        device,
+        precision=PRECISION_FP32,
+        model_path=None
+    ):
+
+        device = torch.device(
+            device
+        )
+
+        if precision not in PRECISIONS:
+
+            raise ValueError(
+                f"Unknown precision: {precision}"
+            )
+
+        if precision != PRECISION_FP32 and device.type != "cpu":
+
+            print(
+                f"{precision} is a CPU mode, "
+                f"using {PRECISION_FP32} on {device}."
+            )
+
+            precision = PRECISION_FP32
+
+        # Freezing and optimize_for_inference fold the export's
+        # convolutions, and autocast no longer reaches them: it
+        # would run float32. The scripted SimpleLama model does
+        # honour autocast.
+        if model_path and precision == PRECISION_BF16:
+
+            print(
+                f"{model_path} is a frozen {PRECISION_FP32} graph; "
+                f"using the SimpleLama model for {precision}."
+            )
+
+            model_path = None
+
+        if model_path:
+
+            model = load_exported_lama(
+                model_path,
+                device
+            )
+
+        else:
+
+            from simple_lama_inpainting import SimpleLama
+
+            model = SimpleLama(
+                device=device
+            ).model
+
+        return cls(
+            model,
+            device,
+            precision
+        )
+
+    def _forward(
+        self,
+        image,
+        mask
+    ):
+
+        if self.precision != PRECISION_BF16:
+
+            return self.model(
+                image,
+                mask
+            )
+
+        try:
+
+            with torch.autocast(
+                self.device.type,
+                dtype=torch.bfloat16
+            ):
+
+                result = self.model(
+                    image,
+                    mask
+                )
+
+            return result.float()
+
+        except RuntimeError as error:
+
+            # Old CPUs or kernels without bf16 support.
+            print(
+                "bfloat16 inference failed, "
+                f"using {PRECISION_FP32}: {error}"
+            )
+
+            self.precision = PRECISION_FP32
+
+            return self.model(
+                image,
+                mask
+            )
+
+    def _get_buffers(
+        self,
+        batch,
+        height,
+        width
+    ):
+
+        padded_h = _ceil_modulo(
+            height,
+            LAMA_PAD_MODULO
+        )
+
+        padded_w = _ceil_modulo(
+            width,
+            LAMA_PAD_MODULO
+        )
+
+        key = (
+            height,
+            width
+        )
+
+        if not hasattr(self._local, "buffers"):
+            self._local.buffers = {}
+
+        buffers = self._local.buffers.get(key)
+
+        if buffers is not None and buffers["batch"] >= batch:
+            return buffers
+
+        pin = (
+            self.device.type == "cuda"
+        )
+
+        buffers = {
+            "batch": batch,
+
+            "host_in": torch.empty(
+                (batch, padded_h, padded_w, 3),
+                dtype=torch.uint8,
+                pin_memory=pin
+            ),
+
+            "host_mask": torch.empty(
+                (batch, padded_h, padded_w),
+                dtype=torch.uint8,
+                pin_memory=pin
+            ),
+
+            "host_out": torch.empty(
+                (batch, height, width, 3),
+                dtype=torch.uint8,
+                pin_memory=pin
+            ),
+
+            "image": torch.empty(
+                (batch, 3, padded_h, padded_w),
+                dtype=torch.float32,
+                device=self.device
+            ),
+
+            "mask": torch.empty(
+                (batch, 1, padded_h, padded_w),
+                dtype=torch.float32,
+                device=self.device
+            ),
+
+            # Copy of the shared mask currently loaded.
+            "mask_source": None,
+
+            "rows": _mirror_index(
+                height,
+                padded_h
+            ),
+
+            "cols": _mirror_index(
+                width,
+                padded_w
+            )
+        }
+
+        self._local.buffers[key] = buffers
+
+        return buffers
+
+    def _pad_in_place(
+        self,
+        array,
+        height,
+        width,
+        rows,
+        cols
+    ):
+
+        if len(rows):
+
+            array[height:, :width] = array[
+                rows,
+                :width
+            ]
+
+        if len(cols):
+
+            array[:, width:] = array[
+                :,
+                cols
+            ]
+
+    def inpaint(
+        self,
+        images_bgr,
+        mask
+    ):
+
+        count = len(images_bgr)
+
+        if count == 0:
+            return []
+
+        height, width = images_bgr[0].shape[:2]
+
+        buffers = self._get_buffers(
+            count,
+            height,
+            width
+        )
+
+        rows = buffers["rows"]
+        cols = buffers["cols"]
+
+        # ----------------------------------------------------
+        # Crops → padded uint8 host buffer.
+        # ----------------------------------------------------
+
+        host_in = buffers["host_in"].numpy()
+
+        for index, image_bgr in enumerate(images_bgr):
+
+            if image_bgr.shape[:2] != (height, width):
+
+                raise ValueError(
+                    "All crops in a LaMa batch must have the same size."
+                )
+
+            target = host_in[index]
+
+            target[:height, :width] = image_bgr
+
+            self._pad_in_place(
+                target,
+                height,
+                width,
+                rows,
+                cols
+            )
+
+        # ----------------------------------------------------
+        # Mask: one per crop (tiles), or one for the whole
+        # batch, only reloaded when the mask changes.
+        # ----------------------------------------------------
+
+        host_mask = buffers["host_mask"].numpy()
+
+        if isinstance(mask, (list, tuple)):
+
+            if len(mask) != count:
+
+                raise ValueError(
+                    "Pass one mask per crop, or one for all."
+                )
+
+            for index, crop_mask in enumerate(mask):
+
+                host_mask[index, :height, :width] = crop_mask > 0
+
+                self._pad_in_place(
+                    host_mask[index],
+                    height,
+                    width,
+                    rows,
+                    cols
+                )
+
+            buffers["mask"][:count, 0].copy_(
+                buffers["host_mask"][:count],
+                non_blocking=True
+            )
+
+            buffers["mask_source"] = None
+
+        # Compared by content: callers may pass an equal mask
+        # as a new array, or change one in place.
+        elif (
+            buffers["mask_source"] is None
+            or not np.array_equal(buffers["mask_source"], mask)
+        ):
+
+            host_mask[0, :height, :width] = mask > 0
+
+            self._pad_in_place(
+                host_mask[0],
+                height,
+                width,
+                rows,
+                cols
+            )
+
+            buffers["mask"].copy_(
+                buffers["host_mask"][0].expand_as(
+                    buffers["mask"]
+                ),
+                non_blocking=True
+            )
+
+            buffers["mask_source"] = np.array(
+                mask,
+                copy=True
+            )
+
+        image = buffers["image"][:count]
+
+        # NHWC BGR uint8 → NCHW RGB float in [0, 1].
+        image.copy_(
+            buffers["host_in"][:count].permute(
+                0,
+                3,
+                1,
+                2
+            ).flip(1),
+            non_blocking=True
+        )
+
+        image.div_(255.0)
+
+        # ----------------------------------------------------
+        # Forward pass.
+        # ----------------------------------------------------
+
+        with torch.inference_mode():
+
+            result = self._forward(
+                image,
+                buffers["mask"][:count]
+            )
+
+            # Drop the padding, RGB → BGR, back to uint8.
+            result = result[
+                :,
+                :,
+                :height,
+                :width
+            ].flip(1).mul(255.0).clamp_(
+                0,
+                255
+            ).to(torch.uint8)
+
+            host_out = buffers["host_out"][:count]
+
+            host_out.copy_(
+                result.permute(
+                    0,
+                    2,
+                    3,
+                    1
+                )
+            )
+
+        output = host_out.numpy()
+
+        return [
+            output[index]
+            for index in range(count)
+        ]
+
+
+# ============================================================
+# ENGINE TIERS
+#
+# Not every watermark needs LaMa. Thin text on a smooth
+# background is filled just as well by OpenCV's classical
+# inpainting (Telea fast marching or Navier-Stokes), which
+# costs a fraction of a millisecond per crop on any CPU.
+#
+# recommend_engine() picks the tier from the analysis of
+# Frame 1. The user can always override it.
+#
+# Classical engines have the same batch signature as
+# LamaRunner.inpaint (one mask for all crops, or a list with
+# one per crop), so the rest of the pipeline does not change.
+# ============================================================
+
+ENGINE_AUTO = "Auto (from analysis)"
+ENGINE_LAMA = "AI Content-Aware (LaMa)"
+ENGINE_TELEA = "Fast classical (OpenCV Telea)"
+ENGINE_NS = "Fast classical (OpenCV Navier-Stokes)"
+
+ENGINES = (
+    ENGINE_AUTO,
+    ENGINE_LAMA,
+    ENGINE_TELEA,
+    ENGINE_NS
+)
+
+CLASSICAL_ENGINES = {
+    ENGINE_TELEA: cv2.INPAINT_TELEA,
+    ENGINE_NS: cv2.INPAINT_NS
+}
+
+# Neighbourhood radius used by classical inpainting.
+CLASSICAL_RADIUS = 5
+
+# The classical tier is only recommended when ALL hold:
+#
+# - the mask covers a small part of the frame
+# - the strokes are thin (classical fill smears wide areas)
+# - the watermark box is not a busy graphic
+# - the background around the mask is smooth
+CLASSICAL_MAX_MASK_RATIO = 0.02
+CLASSICAL_MAX_STROKE = 8
+CLASSICAL_MAX_EDGE_DENSITY = 0.10
+CLASSICAL_MAX_BACKGROUND_EDGES = 0.04
+
+# Width of the ring around the mask used to judge the
+# background.
+BACKGROUND_RING = 15
+
+
+def make_classical_inpaint(
+    engine,
+    radius=CLASSICAL_RADIUS
+):
+
+    flag = CLASSICAL_ENGINES[engine]
+
+    def inpaint(images, mask):
+
+        if not isinstance(mask, (list, tuple)):
+            mask = [mask] * len(images)
+
+        return [
+            cv2.inpaint(
+                np.ascontiguousarray(image),
+                crop_mask,
+                radius,
+                flag
+            )
+            for image, crop_mask in zip(images, mask)
+        ]
+
+    return inpaint
+
+
+def stroke_width(mask):
+
+    # Twice the largest distance from a mask pixel to the
+    # nearest non-mask pixel.
+    distance = cv2.distanceTransform(
+        np.pad(
+            (mask > 0).astype(np.uint8),
+            1
+        ),
+        cv2.DIST_L2,
+        3
+    )
+
+    return 2.0 * float(distance.max())
+
+
+def background_edge_density(
+    gray,
+    mask
+):
+
+    kernel = cv2.getStructuringElement(
+        cv2.MORPH_ELLIPSE,
+        (
+            BACKGROUND_RING * 2 + 1,
+            BACKGROUND_RING * 2 + 1
+        )
+    )
+
+    ring = cv2.subtract(
+        cv2.dilate(mask, kernel),
+        mask
+    )
+
+    ring_pixels = cv2.countNonZero(
+        ring
+    )
+
+    if ring_pixels == 0:
+        return 0.0
+
+    edges = cv2.Canny(
+        gray,
+        50,
+        150
+    )
+
+    return cv2.countNonZero(
+        cv2.bitwise_and(edges, ring)
+    ) / ring_pixels
+
+
+def recommend_engine(
+    gray,
+    mask,
+    mask_ratio,
+    edge_density
+):
+
+    stroke = stroke_width(
+        mask
+    )
+
+    background = background_edge_density(
+        gray,
+        mask
+    )
+
+    stats = {
+        "mask_ratio": mask_ratio,
+        "edge_density": edge_density,
+        "stroke_width": stroke,
+        "background_edges": background
+    }
+
+    if (
+        mask_ratio <= CLASSICAL_MAX_MASK_RATIO
+        and stroke <= CLASSICAL_MAX_STROKE
+        and edge_density <= CLASSICAL_MAX_EDGE_DENSITY
+        and background <= CLASSICAL_MAX_BACKGROUND_EDGES
+    ):
+        return ENGINE_TELEA, stats
+
+    return ENGINE_LAMA, stats
+
+
+def resolve_engine(
+    choice,
+    recommended
+):
+
+    if choice == ENGINE_AUTO or not choice:
+        return recommended or ENGINE_LAMA
+
+    return choice
+
+
+# ============================================================
+# TILED INFERENCE
+#
+# LaMa memory and latency grow faster than the crop area. A
+# large overlay or a 4K source can produce context crops
+# thousands of pixels wide.
+#
+# make_tiled_inpaint() wraps any inpaint(images, mask) so that
+# crops larger than the tile size are split into overlapping
+# TILE x TILE tiles:
+#
+# - all tiles have the same size (edge tiles are shifted
+#   inwards), so the (tile, frame) pairs of a batch are
+#   stacked into inpaint calls of up to `batch_size` crops,
+#   each with its own tile mask
+# - tiles without watermark pixels are skipped
+# - tiles are written in raster order and feathered into the
+#   tiles above and to the left across the overlap
+#
+# The model never sees more than `batch_size` tile-sized
+# inputs at once, so inference memory depends on the tile
+# size and the batch size, not on the mask. Smaller crops
+# are passed through unchanged.
+# ============================================================
+
+def _tile_starts(
+    length,
+    tile,
+    overlap
+):
+
+    if length <= tile:
+        return [0]
+
+    stride = max(
+        1,
+        tile - overlap
+    )
+
+    starts = list(
+        range(0, length - tile, stride)
+    )
+
+    starts.append(
+        length - tile
+    )
+
+    return starts
+
+
+def _feather(
+    starts,
+    index,
+    tile
+):
+
+    # 1 inside the tile, rising from 0 across the overlap
+    # with the previous tile on this axis.
+    weights = np.ones(
+        tile,
+        dtype=np.float32
+    )
+
+    if index > 0:
+
+        band = starts[index - 1] + tile - starts[index]
+
+        weights[:band] = (
+            np.arange(1, band + 1, dtype=np.float32)
+            / (band + 1)
+        )
+
+    return weights
+
+
+def make_tiled_inpaint(
+    inpaint,
+    tile_size=TILE_SIZE,
+    overlap=TILE_OVERLAP,
+    batch_size=LAMA_BATCH_SIZE
+):
+
+    tile_size = int(tile_size)
+
+    batch_size = max(
+        1,
+        int(batch_size)
+    )
+
+    if tile_size <= 0:
+        return inpaint
+
+    overlap = min(
+        int(overlap),
+        tile_size // 2
+    )
+
+    def tiled(images, mask):
+
+        height, width = mask.shape[:2]
+
+        if height <= tile_size and width <= tile_size:
+
+            return inpaint(
+                images,
+                mask
+            )
+
+        tile_h = min(tile_size, height)
+        tile_w = min(tile_size, width)
+
+        rows = _tile_starts(height, tile_h, overlap)
+        cols = _tile_starts(width, tile_w, overlap)
+
+        outputs = [
+            np.array(image, copy=True)
+            for image in images
+        ]
+
+        # (y, x, mask, weight) of every tile with watermark
+        # pixels, in raster order.
+        tiles = []
+
+        for row, y in enumerate(rows):
+
+            weight_y = _feather(rows, row, tile_h)
+
+            for col, x in enumerate(cols):
+
+                tile_mask = mask[
+                    y:y + tile_h,
+                    x:x + tile_w
+                ]
+
+                if not tile_mask.any():
+                    continue
+
+                tiles.append(
+                    (
+                        y,
+                        x,
+                        np.ascontiguousarray(tile_mask),
+                        (
+                            weight_y[:, None]
+                            * _feather(cols, col, tile_w)[None, :]
+                        )[:, :, None]
+                    )
+                )
+
+        # Tiles only read the input images, so (tile, frame)
+        # pairs are batched freely, in raster order.
+        pairs = [
+            (tile, output, image)
+            for tile in tiles
+            for output, image in zip(outputs, images)
+        ]
+
+        for start in range(0, len(pairs), batch_size):
+
+            chunk = pairs[start:start + batch_size]
+
+            patches = inpaint(
+                [
+                    image[y:y + tile_h, x:x + tile_w]
+                    for (y, x, _, _), _, image in chunk
+                ],
+                [
+                    tile_mask
+                    for (_, _, tile_mask, _), _, _ in chunk
+                ]
+            )
+
+            # Blended before the next call, which may reuse the
+            # buffers the patches live in.
+            for ((y, x, _, weight), output, _), patch in zip(
+                chunk,
+                patches
+            ):
+
+                target = output[
+                    y:y + tile_h,
+                    x:x + tile_w
+                ]
+
+                target[:] = np.clip(
+                    target * (1.0 - weight)
+                    + patch * weight
+                    + 0.5,
+                    0,
+                    255
+                ).astype(np.uint8)
+
+        return outputs
+
+    return tiled
+
+
+# ============================================================
+# AUDIO
+# ============================================================
+
+def probe_audio_codec(path):
+
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+
+        "-select_streams",
+        "a:0",
+
+        "-show_entries",
+        "stream=codec_name",
+
+        "-of",
+        "default=noprint_wrappers=1:nokey=1",
+
+        path
+    ]
+
+    try:
+
+        result = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+
+    except FileNotFoundError:
+
+        return None
+
+    if result.returncode != 0:
+        return None
+
+    codec = result.stdout.strip()
+
+    return codec or None
+
+
+def audio_codec_args(path):
+
+    codec = probe_audio_codec(path)
+
+    if codec in MP4_AUDIO_CODECS:
+
+        return [
+            "-c:a",
+            "copy"
+        ]
+
+    return [
+        "-c:a",
+        "aac",
+
+        "-b:a",
+        "192k"
+    ]
+
+
+# ============================================================
+# FFMPEG FRAME WRITER
+#
+# Drop-in replacement for cv2.VideoWriter.
+#
+# Raw BGR frames are piped into one long-lived ffmpeg process
+# that encodes x264 and muxes the source audio in the same
+# pass. There is no intermediate mp4v file and no second
+# encode.
+# ============================================================
+
+class FFmpegFrameWriter:
+
+    def __init__(
+        self,
+        output_path,
+        width,
+        height,
+        fps,
+        audio_source=None,
+        preset="medium",
+        crf=18,
+        x264_params=None
+    ):
+
+        self.output_path = output_path
+        self.frame_bytes = width * height * 3
+        self.returncode = None
+
+        command = [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+
+            "-f",
+            "rawvideo",
+
+            "-pix_fmt",
+            "bgr24",
+
+            "-s",
+            f"{width}x{height}",
+
+            "-r",
+            f"{fps}",
+
+            "-i",
+            "-"
+        ]
+
+        if audio_source:
+
+            command += [
+                "-i",
+                audio_source,
+
+                "-map",
+                "0:v:0",
+
+                "-map",
+                "1:a?"
+            ]
+
+            command += audio_codec_args(
+                audio_source
+            )
+
+        command += [
+            "-c:v",
+            "libx264",
+
+            "-preset",
+            preset,
+
+            "-crf",
+            str(crf),
+
+            "-pix_fmt",
+            "yuv420p"
+        ]
+
+        # Time-range pieces copy the source's encoder options
+        # so their SPS/PPS match the stream-copied pieces.
+        if x264_params:
+
+            command += [
+                "-x264-params",
+                x264_params
+            ]
+
+        command += [
+            "-movflags",
+            "+faststart",
+
+            output_path
+        ]
+
+        # stderr goes to a file so a chatty ffmpeg can never
+        # block on a full pipe.
+        self._log = tempfile.TemporaryFile()
+
+        # Raises FileNotFoundError when ffmpeg is missing.
+        self._process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self._log
+        )
+
+    def isOpened(self):
+
+        return (
+            self._process.poll() is None
+        )
+
+    def write(self, frame):
+
+        if frame.nbytes != self.frame_bytes:
+
+            raise ValueError(
+                "Frame size does not match the output video."
+            )
+
+        try:
+
+            self._process.stdin.write(
+                np.ascontiguousarray(
+                    frame
+                ).data
+            )
+
+        except (BrokenPipeError, ValueError):
+
+            # Let ffmpeg exit before reading its log.
+            self.release()
+
+            raise RuntimeError(
+                "FFmpeg stopped accepting frames:\n\n"
+                + self.error_output()
+            )
+
+    def release(self):
+
+        if self.returncode is not None:
+            return self.returncode
+
+        try:
+            self._process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+        self.returncode = self._process.wait()
+
+        return self.returncode
+
+    def error_output(self):
+
+        self._log.seek(0)
+
+        text = self._log.read().decode(
+            "utf-8",
+            "replace"
+        )
+
+        return text[-4000:]
+
+
+# ============================================================
+# JOB INSTRUMENTATION
+#
+# StageTimer records how long every pipeline stage takes:
+#
+# decode     → cap.read()
+# crop       → cutting context crops + reuse cache lookups
+# flow       → optical-flow planning and patch warps
+# inference  → inpaint() calls (LaMa or a stub)
+# composite  → writing reconstructed pixels into frames
+# encode     → writing frames into the video writer
+# mux        → final ffmpeg step (flush, concat or remux)
+#
+# Totals are kept for the whole job. The latest
+# TIMING_WINDOW samples of each stage give the rolling p50
+# and p95 latency. Stages run on different threads, so their
+# totals overlap; the slowest stage limits throughput.
+#
+# ResourceMonitor measures the CPU time and peak memory of
+# the process and of finished child processes (ffmpeg and
+# shard workers).
+# ============================================================
+
+STAGES = (
+    "decode",
+    "crop",
+    "flow",
+    "inference",
+    "composite",
+    "encode",
+    "mux"
+)
+
+# Samples per stage used for the rolling percentiles.
+TIMING_WINDOW = 1000
+
+try:
+    import resource
+except ImportError:
+    # Windows.
+    resource = None
+
+
+class StageTimer:
+
+    def __init__(
+        self,
+        window=TIMING_WINDOW
+    ):
+
+        self._lock = threading.Lock()
+
+        self._window = window
+
+        self._seconds = {}
+
+        self._calls = {}
+
+        self._samples = {}
+
+    def add(
+        self,
+        stage,
+        seconds
+    ):
+
+        with self._lock:
+
+            self._seconds[stage] = (
+                self._seconds.get(stage, 0.0)
+                + seconds
+            )
+
+            self._calls[stage] = (
+                self._calls.get(stage, 0)
+                + 1
+            )
+
+            if stage not in self._samples:
+
+                self._samples[stage] = collections.deque(
+                    maxlen=self._window
+                )
+
+            self._samples[stage].append(
+                seconds
+            )
+
+    def wrap(
+        self,
+        stage,
+        function
+    ):
+
+        def timed(*args, **kwargs):
+
+            started = time.perf_counter()
+
+            try:
+
+                return function(
+                    *args,
+                    **kwargs
+                )
+
+            finally:
+
+                self.add(
+                    stage,
+                    time.perf_counter() - started
+                )
+
+        return timed
+
+    def export(self):
+
+        # Plain data, so worker processes can send it back.
+        with self._lock:
+
+            return {
+                stage: {
+                    "seconds": self._seconds[stage],
+                    "calls": self._calls[stage],
+                    "samples": list(self._samples[stage])
+                }
+                for stage in self._seconds
+            }
+
+    def merge(self, exported):
+
+        with self._lock:
+
+            for stage, data in exported.items():
+
+                self._seconds[stage] = (
+                    self._seconds.get(stage, 0.0)
+                    + data["seconds"]
+                )
+
+                self._calls[stage] = (
+                    self._calls.get(stage, 0)
+                    + data["calls"]
+                )
+
+                if stage not in self._samples:
+
+                    self._samples[stage] = collections.deque(
+                        maxlen=self._window
+                    )
+
+                self._samples[stage].extend(
+                    data["samples"]
+                )
+
+    def percentiles(self, stage):
+
+        with self._lock:
+
+            samples = list(
+                self._samples.get(stage, ())
+            )
+
+        if not samples:
+            return None, None
+
+        p50, p95 = np.percentile(
+            samples,
+            [50, 95]
+        )
+
+        return p50 * 1000.0, p95 * 1000.0
+
+    def report(self):
+
+        report = {}
+
+        for stage in STAGES:
+
+            p50, p95 = self.percentiles(
+                stage
+            )
+
+            with self._lock:
+
+                seconds = self._seconds.get(stage, 0.0)
+                calls = self._calls.get(stage, 0)
+
+            report[stage] = {
+                "seconds": round(seconds, 4),
+                "calls": calls,
+                "p50_ms": None if p50 is None else round(p50, 3),
+                "p95_ms": None if p95 is None else round(p95, 3)
+            }
+
+        return report
+
+
+class TimedCapture:
+
+    def __init__(
+        self,
+        cap,
+        timer
+    ):
+
+        self.cap = cap
+
+        self.read = timer.wrap(
+            "decode",
+            cap.read
+        )
+
+
+def _peak_rss_mb(who):
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(who).ru_maxrss
+
+    # Kilobytes on Linux, bytes on macOS.
+    if os.uname().sysname == "Darwin":
+        return round(peak / (1024 * 1024), 1)
+
+    return round(peak / 1024, 1)
+
+
+class ResourceMonitor:
+
+    def __init__(self):
+
+        self._wall = time.perf_counter()
+
+        self._times = os.times()
+
+    def report(self):
+
+        wall = max(
+            time.perf_counter() - self._wall,
+            1e-9
+        )
+
+        now = os.times()
+
+        own = (
+            (now.user - self._times.user)
+            + (now.system - self._times.system)
+        )
+
+        children = (
+            (now.children_user - self._times.children_user)
+            + (now.children_system - self._times.children_system)
+        )
+
+        cpus = os.cpu_count() or 1
+
+        return {
+            "wall_seconds": round(wall, 3),
+            "cpu_seconds": round(own, 3),
+            "children_cpu_seconds": round(children, 3),
+            # Share of all cores, 100% = every core busy.
+            "cpu_percent": round(
+                own / wall / cpus * 100.0,
+                1
+            ),
+            "children_cpu_percent": round(
+                children / wall / cpus * 100.0,
+                1
+            ),
+            # Peak of the whole process, not only this job.
+            "peak_rss_mb": _peak_rss_mb(
+                resource.RUSAGE_SELF if resource else None
+            ),
+            "children_peak_rss_mb": _peak_rss_mb(
+                resource.RUSAGE_CHILDREN if resource else None
+            )
+        }
+
+
+def build_job_report(
+    summary,
+    timer,
+    monitor,
+    settings=None
+):
+
+    report = {
+        "frames": summary.get("frames", 0),
+        "cache_hits": summary.get("cache_hits", 0),
+        "cache_misses": summary.get("cache_misses", 0),
+        "flow_keyframes": summary.get("flow_keyframes", 0),
+        "flow_propagated": summary.get("flow_propagated", 0),
+        "settings": settings or {},
+        "resources": monitor.report(),
+        "stages": timer.report()
+    }
+
+    report["fps"] = round(
+        report["frames"]
+        / report["resources"]["wall_seconds"],
+        2
+    )
+
+    return report
+
+
+def write_job_report(
+    output_path,
+    report
+):
+
+    report_path = (
+        os.path.splitext(output_path)[0]
+        + ".report.json"
+    )
+
+    with open(report_path, "w") as file:
+
+        json.dump(
+            report,
+            file,
+            indent=2
+        )
+
+    return report_path
+
+
+def format_job_report(report):
+
+    resources = report["resources"]
+
+    def value(number, unit=""):
+
+        if number is None:
+            return "–"
+
+        return f"{number}{unit}"
+
+    lines = [
+        "### 📊 Job Report",
+        "",
+        f"**Frames:** `{report['frames']}` · "
+        f"**Speed:** `{report['fps']} fps` · "
+        f"**Time:** `{resources['wall_seconds']} s`",
+        "",
+        f"**CPU:** `{resources['cpu_percent']}%` app, "
+        f"`{resources['children_cpu_percent']}%` ffmpeg/workers · "
+        f"**Peak RAM:** `{value(resources['peak_rss_mb'], ' MB')}` app, "
+        f"`{value(resources['children_peak_rss_mb'], ' MB')}` ffmpeg/workers",
+        ""
+    ]
+
+    if report["flow_keyframes"]:
+
+        lines += [
+            f"**Flow:** `{report['flow_keyframes']}` LaMa keyframes, "
+            f"`{report['flow_propagated']}` region crops warped",
+            ""
+        ]
+
+    lines += [
+        "| Stage | Total (s) | Calls | p50 (ms) | p95 (ms) |",
+        "|---|---:|---:|---:|---:|"
+    ]
+
+    for stage, data in report["stages"].items():
+
+        lines.append(
+            f"| {stage} "
+            f"| {data['seconds']} "
+            f"| {data['calls']} "
+            f"| {value(data['p50_ms'])} "
+            f"| {value(data['p95_ms'])} |"
+        )
+
+    return "\n".join(lines)
+
+
+# ============================================================
+# STAGED FRAME PIPELINE
+#
+# reader thread  → decoded queue →
+# AI stage       → finished queue →
+# writer thread
+#
+# The AI stage runs on the calling thread, so PyTorch keeps
+# running where the model was loaded. Decoding and encoding
+# overlap with inference instead of waiting for it.
+#
+# The AI stage collects up to `batch_size` consecutive frames
+# and hands them to `process_batch` together. It must return
+# one processed frame per input frame, in the same order.
+# Decoded frames are owned by the pipeline, so `process_batch`
+# may modify them in place.
+#
+# Both queues are FIFO and there is exactly one stage of each
+# kind, so frame order is always preserved.
+# ============================================================
+
+def run_frame_pipeline(
+    cap,
+    process_batch,
+    write_frame,
+    queue_depth=PIPELINE_QUEUE_DEPTH,
+    batch_size=LAMA_BATCH_SIZE,
+    on_progress=None
+):
+
+    batch_size = max(
+        1,
+        int(batch_size)
+    )
+
+    # The decoded queue must be able to hold a full batch.
+    depth = max(
+        batch_size,
+        int(queue_depth)
+    )
+
+    decoded = queue.Queue(
+        maxsize=depth
+    )
+
+    finished = queue.Queue(
+        maxsize=depth
+    )
+
+    stop = threading.Event()
+
+    errors = []
+
+    # --------------------------------------------------------
+    # Queue helpers that give up once any stage has failed.
+    # --------------------------------------------------------
+
+    def put(target, item):
+
+        while not stop.is_set():
+
+            try:
+
+                target.put(
+                    item,
+                    timeout=PIPELINE_POLL_SECONDS
+                )
+
+                return True
+
+            except queue.Full:
+
+                continue
+
+        return False
+
+    def get(source):
+
+        while True:
+
+            try:
+
+                return source.get(
+                    timeout=PIPELINE_POLL_SECONDS
+                )
+
+            except queue.Empty:
+
+                if stop.is_set():
+                    return _END
+
+    # --------------------------------------------------------
+    # Stage 1: decode.
+    # --------------------------------------------------------
+
+    def reader():
+
+        try:
+
+            while not stop.is_set():
+
+                ok, frame = cap.read()
+
+                if not ok:
+                    break
+
+                if not put(decoded, frame):
+                    return
+
+        except Exception as error:
+
+            errors.append(error)
+            stop.set()
+
+        finally:
+
+            put(decoded, _END)
+
+    # --------------------------------------------------------
+    # Stage 3: encode.
+    # --------------------------------------------------------
+
+    def writer():
+
+        try:
+
+            while True:
+
+                frame = get(finished)
+
+                if frame is _END:
+                    break
+
+                write_frame(frame)
+
+        except Exception as error:
+
+            errors.append(error)
+            stop.set()
+
+    read_thread = threading.Thread(
+        target=reader,
+        name="watermark-decode",
+        daemon=True
+    )
+
+    write_thread = threading.Thread(
+        target=writer,
+        name="watermark-encode",
+        daemon=True
+    )
+
+    read_thread.start()
+    write_thread.start()
+
+    processed = 0
+
+    # --------------------------------------------------------
+    # Stage 2: AI reconstruction on this thread.
+    # --------------------------------------------------------
+
+    try:
+
+        done = False
+
+        while not done:
+
+            frames = []
+
+            while len(frames) < batch_size:
+
+                frame = get(decoded)
+
+                if frame is _END:
+
+                    done = True
+
+                    break
+
+                frames.append(
+                    frame
+                )
+
+            if not frames:
+                break
+
+            results = process_batch(
+                frames
+            )
+
+            if len(results) != len(frames):
+
+                raise RuntimeError(
+                    "The AI stage returned the wrong number of frames."
+                )
+
+            for result in results:
+
+                if not put(finished, result):
+
+                    done = True
+
+                    break
+
+                processed += 1
+
+                if on_progress is not None:
+                    on_progress(processed)
+
+    except BaseException:
+
+        stop.set()
+
+        raise
+
+    finally:
+
+        put(finished, _END)
+
+        write_thread.join()
+
+        # Releases the reader if inference stopped early.
+        stop.set()
+
+        read_thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return processed
+
+
+# ============================================================
+# TEMPORAL REUSE CACHE
+#
+# Static backgrounds (talking heads, screencasts, slides)
+# produce almost identical context crops frame after frame.
+#
+# Each crop is reduced to a tiny grey signature. When it is
+# close enough to a recent crop, that crop's reconstruction
+# is reused and LaMa is skipped.
+#
+# The match must hold on average AND in every signature cell,
+# so a small moving detail cannot hide inside the average.
+#
+# Every watermark region keeps its own history.
+# ============================================================
+
+class InpaintReuseCache:
+
+    def __init__(
+        self,
+        threshold=REUSE_THRESHOLD,
+        size=REUSE_CACHE_SIZE
+    ):
+
+        self.threshold = float(threshold)
+        self.size = max(1, int(size))
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+
+        return self.threshold > 0
+
+    def signature(self, crop):
+
+        gray = cv2.cvtColor(
+            crop,
+            cv2.COLOR_BGR2GRAY
+        )
+
+        return cv2.resize(
+            gray,
+            (
+                REUSE_SIGNATURE_SIZE,
+                REUSE_SIGNATURE_SIZE
+            ),
+            interpolation=cv2.INTER_AREA
+        ).astype(np.float32)
+
+    def lookup(self, signature, region=0):
+
+        entries = self.entries.setdefault(
+            region,
+            []
+        )
+
+        for index, (cached, patch) in enumerate(entries):
+
+            difference = np.abs(
+                cached - signature
+            )
+
+            if (
+                float(difference.mean()) <= self.threshold
+                and
+                float(difference.max()) <= self.threshold * 4
+            ):
+
+                # Most recently used first.
+                if index:
+
+                    entries.insert(
+                        0,
+                        entries.pop(index)
+                    )
+
+                self.hits += 1
+
+                return patch
+
+        self.misses += 1
+
+        return None
+
+    def store(self, signature, patch, region=0):
+
+        entries = self.entries.setdefault(
+            region,
+            []
+        )
+
+        # The runner reuses its output buffer, so keep a copy.
+        entries.insert(
+            0,
+            (
+                signature,
+                patch.copy()
+            )
+        )
+
+        del entries[self.size:]
+
+    def stats(self):
+
+        return {
+            "cache_hits": self.hits,
+            "cache_misses": self.misses
+        }
+
+
+def reuse_summary(
+    hits,
+    misses
+):
+
+    lookups = hits + misses
+
+    if lookups == 0:
+        return "disabled"
+
+    rate = (
+        hits
+        /
+        lookups
+    ) * 100
+
+    return (
+        f"{hits} reused / {misses} inferred "
+        f"({rate:.1f}% reuse)"
+    )
+
+
+# ============================================================
+# OPTICAL-FLOW PROPAGATION
+#
+# With a moving camera the reuse cache rarely hits, but
+# neighbouring frames still show the same scene. LaMa then
+# runs on keyframes only; the frames in between get the
+# keyframe's reconstruction warped into place.
+#
+# 1. Dense Farneback flow from the current context crop to
+#    the keyframe crop is measured on a small copy of the
+#    crop, on the context ring only: pixels close to the
+#    watermark are left out, since the watermark stays still
+#    while the scene moves.
+# 2. A RANSAC affine model is fitted to the ring flow. It
+#    extends the motion into the hidden area and keeps the
+#    warp rigid and stable.
+# 3. Confidence = share of RANSAC inliers plus the grey error
+#    between the warped keyframe and the current frame on the
+#    ring. When either check fails, or the scene cuts, or the
+#    keyframe is FLOW_INTERVAL frames old, the frame becomes
+#    a new keyframe.
+#
+# Warps always start from the keyframe itself, so errors do
+# not build up over a chain of frames. Following one
+# reconstruction also keeps the patch steadier than running
+# LaMa on every frame (less flicker).
+#
+# Frames must arrive in order, which the pipeline guarantees.
+# Every watermark region keeps its own keyframe.
+# ============================================================
+
+class FlowPropagator:
+
+    def __init__(
+        self,
+        interval=FLOW_INTERVAL,
+        max_error=FLOW_MAX_ERROR
+    ):
+
+        self.interval = int(interval)
+        self.max_error = float(max_error)
+        self.regions = {}
+        self.keyframes = 0
+        self.propagated = 0
+
+    @property
+    def enabled(self):
+
+        return self.interval > 1
+
+    def _state(self, region, mask):
+
+        state = self.regions.get(
+            region
+        )
+
+        if state is not None:
+            return state
+
+        height, width = mask.shape[:2]
+
+        scale = min(
+            1.0,
+            FLOW_SIDE / max(width, height)
+        )
+
+        size = (
+            max(8, int(round(width * scale))),
+            max(8, int(round(height * scale)))
+        )
+
+        small_mask = cv2.resize(
+            mask,
+            size,
+            interpolation=cv2.INTER_NEAREST
+        )
+
+        # Keep a margin around the watermark out of the ring.
+        margin = cv2.getStructuringElement(
+            cv2.MORPH_ELLIPSE,
+            (
+                FLOW_RING_MARGIN * 2 + 1,
+                FLOW_RING_MARGIN * 2 + 1
+            )
+        )
+
+        ring = cv2.dilate(
+            small_mask,
+            margin
+        ) == 0
+
+        ys, xs = np.nonzero(
+            ring
+        )
+
+        # A sparse grid is plenty for an affine fit.
+        grid = (ys % FLOW_GRID == 0) & (xs % FLOW_GRID == 0)
+
+        # Per axis: rounding (and the 8 px floor) can shrink
+        # width and height by different factors.
+        state = {
+            "scale": (
+                size[0] / width,
+                size[1] / height
+            ),
+            "size": size,
+            "ring": ring,
+            "points": np.stack(
+                [
+                    xs[grid],
+                    ys[grid]
+                ],
+                axis=1
+            ).astype(np.float32),
+            "gray": None,
+            "patch": None,
+            "age": 0
+        }
+
+        self.regions[region] = state
+
+        return state
+
+    def _gray(self, crop, state):
+
+        return cv2.resize(
+            cv2.cvtColor(
+                crop,
+                cv2.COLOR_BGR2GRAY
+            ),
+            state["size"],
+            interpolation=cv2.INTER_AREA
+        )
+
+    def _estimate(self, gray, state):
+
+        # Returns the current → keyframe affine (small
+        # coordinates) or None when it cannot be trusted.
+        key = state["gray"]
+        ring = state["ring"]
+        points = state["points"]
+
+        if len(points) < FLOW_MIN_POINTS:
+            return None
+
+        difference = cv2.absdiff(
+            gray,
+            key
+        )
+
+        # Scene cut: nothing to follow.
+        if float(difference[ring].mean()) > FLOW_CUT_THRESHOLD:
+            return None
+
+        flow = cv2.calcOpticalFlowFarneback(
+            gray,
+            key,
+            None,
+            0.5,
+            3,
+            15,
+            3,
+            5,
+            1.2,
+            0
+        )
+
+        columns = points[:, 0].astype(np.int32)
+        rows = points[:, 1].astype(np.int32)
+
+        matrix, inliers = cv2.estimateAffinePartial2D(
+            points,
+            points + flow[rows, columns],
+            method=cv2.RANSAC,
+            ransacReprojThreshold=1.0
+        )
+
+        if (
+            matrix is None
+            or float(inliers.mean()) < FLOW_MIN_INLIERS
+        ):
+            return None
+
+        warped = cv2.warpAffine(
+            key,
+            matrix,
+            state["size"],
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_REFLECT
+        )
+
+        error = float(
+            cv2.absdiff(
+                warped,
+                gray
+            )[ring].mean()
+        )
+
+        if error > self.max_error:
+            return None
+
+        return matrix
+
+    def plan(self, crops, mask, region=0):
+
+        # One entry per crop: None = run LaMa (new keyframe),
+        # otherwise (source, matrix) where source is the
+        # position of the keyframe in `crops`, or -1 for the
+        # keyframe kept from an earlier batch.
+        state = self._state(
+            region,
+            mask
+        )
+
+        entries = []
+
+        source = -1
+
+        for position, crop in enumerate(crops):
+
+            gray = self._gray(
+                crop,
+                state
+            )
+
+            matrix = None
+
+            if (
+                state["gray"] is not None
+                and state["age"] < self.interval
+            ):
+
+                matrix = self._estimate(
+                    gray,
+                    state
+                )
+
+            if matrix is None:
+
+                state["gray"] = gray
+                state["age"] = 1
+
+                source = position
+
+                self.keyframes += 1
+
+                entries.append(
+                    None
+                )
+
+                continue
+
+            # Back to crop pixels: S^-1 · M · S with
+            # S = diag(scale_x, scale_y).
+            scale_x, scale_y = state["scale"]
+
+            matrix = matrix.copy()
+            matrix[0, 1] *= scale_y / scale_x
+            matrix[1, 0] *= scale_x / scale_y
+            matrix[0, 2] /= scale_x
+            matrix[1, 2] /= scale_y
+
+            state["age"] += 1
+
+            self.propagated += 1
+
+            entries.append(
+                (
+                    source,
+                    matrix
+                )
+            )
+
+        return entries
+
+    def keyframe_patch(self, region=0):
+
+        return self.regions[region]["patch"]
+
+    def remember(self, patch, region=0):
+
+        # The runner reuses its output buffer, so keep a copy.
+        self.regions[region]["patch"] = patch.copy()
+
+    def warp(self, patch, matrix):
+
+        return cv2.warpAffine(
+            patch,
+            matrix,
+            (
+                patch.shape[1],
+                patch.shape[0]
+            ),
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_REFLECT
+        )
+
+    def stats(self):
+
+        return {
+            "flow_keyframes": self.keyframes,
+            "flow_propagated": self.propagated
+        }
+
+
+# ============================================================
+# WATERMARK REGIONS
+#
+# A single bounding box over every mask pixel turns two corner
+# logos into an almost full-frame crop. Instead, every
+# connected part of the mask gets its own padded context box.
+#
+# Boxes that overlap are merged, so every mask pixel belongs
+# to exactly one region and no region's context contains
+# another region's unprocessed watermark.
+# ============================================================
+
+def _boxes_overlap(a, b):
+
+    return (
+        a[0] < b[2]
+        and
+        b[0] < a[2]
+        and
+        a[1] < b[3]
+        and
+        b[1] < a[3]
+    )
+
+
+def _snap_box(
+    box,
+    snap,
+    width,
+    height
+):
+
+    # Grows the box to a multiple of `snap` per side, with
+    # real pixels instead of the padding LaMa would add.
+    x1, y1, x2, y2 = box
+
+    if snap <= 1:
+        return [x1, y1, x2, y2]
+
+    grow = min(width, _ceil_modulo(x2 - x1, snap)) - (x2 - x1)
+    x2 = min(width, x2 + grow)
+    x1 = max(0, x1 - (grow - (x2 - box[2])))
+
+    grow = min(height, _ceil_modulo(y2 - y1, snap)) - (y2 - y1)
+    y2 = min(height, y2 + grow)
+    y1 = max(0, y1 - (grow - (y2 - box[3])))
+
+    return [x1, y1, x2, y2]
+
+
+def plan_regions(
+    mask,
+    padding,
+    snap=1
+):
+
+    height, width = mask.shape[:2]
+
+    padding = max(
+        0,
+        int(padding)
+    )
+
+    binary = np.where(
+        mask > 0,
+        255,
+        0
+    ).astype(np.uint8)
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(
+        binary,
+        8
+    )
+
+    boxes = []
+
+    for label in range(1, count):
+
+        x = int(stats[label, cv2.CC_STAT_LEFT])
+        y = int(stats[label, cv2.CC_STAT_TOP])
+        w = int(stats[label, cv2.CC_STAT_WIDTH])
+        h = int(stats[label, cv2.CC_STAT_HEIGHT])
+
+        boxes.append(
+            _snap_box(
+                [
+                    max(0, x - padding),
+                    max(0, y - padding),
+                    min(width, x + w + padding),
+                    min(height, y + h + padding)
+                ],
+                snap,
+                width,
+                height
+            )
+        )
+
+    # --------------------------------------------------------
+    # Merge overlapping boxes until none overlap.
+    # --------------------------------------------------------
+
+    merged = True
+
+    while merged:
+
+        merged = False
+
+        for i in range(len(boxes)):
+
+            for j in range(i + 1, len(boxes)):
+
+                if _boxes_overlap(boxes[i], boxes[j]):
+
+                    a = boxes[i]
+                    b = boxes.pop(j)
+
+                    boxes[i] = _snap_box(
+                        [
+                            min(a[0], b[0]),
+                            min(a[1], b[1]),
+                            max(a[2], b[2]),
+                            max(a[3], b[3])
+                        ],
+                        snap,
+                        width,
+                        height
+                    )
+
+                    merged = True
+
+                    break
+
+            if merged:
+                break
+
+    # Top-to-bottom, left-to-right for stable output.
+    boxes.sort(
+        key=lambda box: (
+            box[1],
+            box[0]
+        )
+    )
+
+    regions = []
+
+    for x1, y1, x2, y2 in boxes:
+
+        regions.append(
+            {
+                "box": (
+                    x1,
+                    y1,
+                    x2,
+                    y2
+                ),
+                "mask": binary[
+                    y1:y2,
+                    x1:x2
+                ].copy()
+            }
+        )
+
+    return regions
+
+
+def describe_regions(regions):
+
+    return " + ".join(
+        f"{region['box'][2] - region['box'][0]}x"
+        f"{region['box'][3] - region['box'][1]}"
+        for region in regions
+    )
+
+
+# ============================================================
+# ADAPTIVE CONTEXT
+#
+# LaMa cost grows with the area of the context crop, so the
+# padding should be as small as the background allows.
+#
+# On a few sampled frames, the pixels around the mask are
+# grouped into bands of CONTEXT_BAND pixels by their distance
+# to the mask. From the inside out, the bands are added to
+# the context one by one. Once another band barely changes
+# the grey-level spread and the mean gradient of the context,
+# the background has been covered and more context only adds
+# cost. Flat backgrounds settle after a band or two; detailed
+# or structured ones need more.
+#
+# The padding is also never smaller than the thickness of the
+# largest mask part, so wide holes keep enough surroundings.
+# Crops are snapped to multiples of LAMA_PAD_MODULO.
+# ============================================================
+
+def _settled_distance(
+    gray,
+    bands,
+    band_count
+):
+
+    gradient = cv2.magnitude(
+        cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3),
+        cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    )
+
+    values = gray.astype(np.float64).ravel()
+
+    count = np.cumsum(
+        np.bincount(bands, minlength=band_count + 1)[:band_count]
+    )
+
+    total = np.cumsum(
+        np.bincount(bands, values, band_count + 1)[:band_count]
+    )
+
+    squares = np.cumsum(
+        np.bincount(bands, values * values, band_count + 1)[:band_count]
+    )
+
+    edges = np.cumsum(
+        np.bincount(
+            bands,
+            gradient.ravel().astype(np.float64),
+            band_count + 1
+        )[:band_count]
+    )
+
+    count = np.maximum(count, 1)
+
+    mean = total / count
+
+    spread = np.sqrt(
+        np.maximum(squares / count - mean * mean, 0.0)
+    )
+
+    sharpness = edges / count
+
+    # Two quiet bands in a row: the context has settled.
+    quiet = 0
+
+    for band in range(1, band_count):
+
+        change = max(
+            abs(spread[band] - spread[band - 1])
+            / max(spread[band - 1], 1.0),
+            abs(sharpness[band] - sharpness[band - 1])
+            / max(sharpness[band - 1], 1.0)
+        )
+
+        quiet = quiet + 1 if change < CONTEXT_TOLERANCE else 0
+
+        if quiet == 2:
+            return (band - 1) * CONTEXT_BAND
+
+    return band_count * CONTEXT_BAND
+
+
+def choose_context_padding(
+    path,
+    mask,
+    samples=CONTEXT_SAMPLES
+):
+
+    info = probe_video(
+        path
+    )
+
+    mask = fit_mask(
+        mask,
+        info["width"],
+        info["height"]
+    )
+
+    if cv2.countNonZero(mask) == 0:
+
+        raise ValueError(
+            "Watermark mask is empty."
+        )
+
+    # Thickness of the largest mask part.
+    count, _, stats, _ = cv2.connectedComponentsWithStats(
+        mask,
+        8
+    )
+
+    largest = max(
+        range(1, count),
+        key=lambda label: stats[label, cv2.CC_STAT_AREA]
+    )
+
+    thickness = int(
+        min(
+            stats[largest, cv2.CC_STAT_WIDTH],
+            stats[largest, cv2.CC_STAT_HEIGHT]
+        )
+    )
+
+    # Distance to the mask, in bands. Everything beyond
+    # CONTEXT_MAX falls into one overflow bin.
+    distance = cv2.distanceTransform(
+        cv2.bitwise_not(mask),
+        cv2.DIST_L2,
+        3
+    )
+
+    band_count = CONTEXT_MAX // CONTEXT_BAND
+
+    bands = np.minimum(
+        distance // CONTEXT_BAND,
+        band_count
+    ).astype(np.int64).ravel()
+
+    # Mask pixels themselves are not context.
+    bands[mask.ravel() > 0] = band_count
+
+    cap = cv2.VideoCapture(
+        path
+    )
+
+    distances = []
+
+    try:
+
+        for index in _sample_indices(info["frames"], samples):
+
+            cap.set(
+                cv2.CAP_PROP_POS_FRAMES,
+                index
+            )
+
+            ok, frame = cap.read()
+
+            if not ok:
+                continue
+
+            distances.append(
+                _settled_distance(
+                    cv2.cvtColor(
+                        frame,
+                        cv2.COLOR_BGR2GRAY
+                    ),
+                    bands,
+                    band_count
+                )
+            )
+
+    finally:
+
+        cap.release()
+
+    if not distances:
+
+        raise RuntimeError(
+            "Could not read any frame to measure the context."
+        )
+
+    # The busier frames decide.
+    texture = int(
+        np.percentile(distances, 75)
+    )
+
+    padding = int(
+        np.clip(
+            max(texture, thickness),
+            CONTEXT_MIN,
+            CONTEXT_MAX
+        )
+    )
+
+    return {
+        "padding": padding,
+        "texture_padding": texture,
+        "thickness": thickness,
+        "samples": len(distances)
+    }
+
+
+def plan_context_regions(
+    path,
+    mask,
+    context_padding
+):
+
+    # A fixed padding, or CONTEXT_AUTO to measure it.
+    snap = 1
+
+    if context_padding == CONTEXT_AUTO:
+
+        context_padding = choose_context_padding(
+            path,
+            mask
+        )["padding"]
+
+        snap = LAMA_PAD_MODULO
+
+    regions = plan_regions(
+        mask,
+        int(context_padding),
+        snap
+    )
+
+    return regions, int(context_padding)
+
+
+def crop_area(regions):
+
+    return sum(
+        (region["box"][2] - region["box"][0])
+        * (region["box"][3] - region["box"][1])
+        for region in regions
+    )
+
+
+def describe_context(
+    regions,
+    padding,
+    compare_regions=None,
+    compare_padding=None
+):
+
+    # "96px → 320x192 (61k px per frame, 0.31× the cost of 180px)"
+    text = (
+        f"{padding}px → {describe_regions(regions)} "
+        f"({crop_area(regions) / 1000:.0f}k px per frame"
+    )
+
+    if compare_regions:
+
+        text += (
+            f", {crop_area(regions) / max(crop_area(compare_regions), 1):.2f}× "
+            f"the cost of {compare_padding}px"
+        )
+
+    return text + ")"
+
+
+# ============================================================
+# CONTEXT CROP PROCESSING
+#
+# Builds the `process_batch` callable used by the AI stage of
+# the pipeline.
+#
+# `inpaint(images, mask)` reconstructs a list of equally
+# sized crops and returns them in the same order.
+#
+# For every region, the crops of all frames in the batch go
+# through LaMa together. With an enabled InpaintReuseCache,
+# crops that match a recent one skip LaMa entirely.
+#
+# Compositing is allocation-free: the decoded frames belong
+# to the pipeline, so the reconstructed watermark pixels are
+# written straight into them through precomputed flat
+# indices. Crops are passed to LaMa as views, not copies.
+#
+# With a StageTimer, crop preparation, inference and
+# compositing are timed separately.
+# ============================================================
+
+def _composite_plan(
+    region,
+    frame_width
+):
+
+    x1, y1, x2, y2 = region["box"]
+
+    crop_width = x2 - x1
+
+    rows, cols = np.nonzero(
+        region["mask"]
+    )
+
+    # Pixel indices inside the crop and inside the frame.
+    crop_pixels = rows * crop_width + cols
+
+    frame_pixels = (
+        (rows + y1) * frame_width
+        +
+        (cols + x1)
+    )
+
+    # Byte indices for the three BGR channels of every pixel.
+    channels = np.arange(3)
+
+    return {
+        "width": frame_width,
+
+        "crop": (
+            crop_pixels[:, None] * 3
+            +
+            channels
+        ).ravel(),
+
+        "frame": (
+            frame_pixels[:, None] * 3
+            +
+            channels
+        ).ravel(),
+
+        "values": np.empty(
+            len(crop_pixels) * 3,
+            dtype=np.uint8
+        )
+    }
+
+
+def make_batch_processor(
+    inpaint,
+    regions,
+    cache=None,
+    timer=None,
+    flow=None
+):
+
+    if cache is not None and not cache.enabled:
+        cache = None
+
+    if flow is not None and not flow.enabled:
+        flow = None
+
+    if timer is not None:
+
+        inpaint = timer.wrap(
+            "inference",
+            inpaint
+        )
+
+    plans = [None] * len(regions)
+
+    def process_region(
+        frames,
+        index,
+        region
+    ):
+
+        started = time.perf_counter()
+
+        x1, y1, x2, y2 = region["box"]
+
+        context_mask = region["mask"]
+
+        frame_width = frames[0].shape[1]
+
+        plan = plans[index]
+
+        if plan is None or plan["width"] != frame_width:
+
+            plan = _composite_plan(
+                region,
+                frame_width
+            )
+
+            plans[index] = plan
+
+        crops = []
+
+        for frame in frames:
+
+            crop = frame[
+                y1:y2,
+                x1:x2
+            ]
+
+            # Safety.
+            if (
+                crop.shape[:2]
+                != context_mask.shape[:2]
+            ):
+
+                raise RuntimeError(
+                    "Context crop and mask dimensions differ."
+                )
+
+            crops.append(
+                crop
+            )
+
+        # ----------------------------------------------------
+        # Reuse recent reconstructions where possible.
+        # ----------------------------------------------------
+
+        if cache is not None:
+
+            signatures = [
+                cache.signature(crop)
+                for crop in crops
+            ]
+
+            reconstructed = [
+                cache.lookup(
+                    signature,
+                    region=index
+                )
+                for signature in signatures
+            ]
+
+        else:
+
+            signatures = None
+
+            reconstructed = [None] * len(crops)
+
+        missing = [
+            position
+            for position, patch in enumerate(reconstructed)
+            if patch is None
+        ]
+
+        if timer is not None:
+
+            timer.add(
+                "crop",
+                time.perf_counter() - started
+            )
+
+        # ----------------------------------------------------
+        # Flow propagation: only keyframes go to LaMa.
+        # ----------------------------------------------------
+
+        pending = []
+
+        if flow is not None and missing:
+
+            started = time.perf_counter()
+
+            pending = missing
+
+            flow_plan = flow.plan(
+                [
+                    crops[position]
+                    for position in pending
+                ],
+                context_mask,
+                region=index
+            )
+
+            missing = [
+                position
+                for position, entry in zip(pending, flow_plan)
+                if entry is None
+            ]
+
+            if timer is not None:
+
+                timer.add(
+                    "flow",
+                    time.perf_counter() - started
+                )
+
+        # ----------------------------------------------------
+        # AI RECONSTRUCTION (one forward pass per batch)
+        # ----------------------------------------------------
+
+        if missing:
+
+            fresh = inpaint(
+                [
+                    crops[position]
+                    for position in missing
+                ],
+                context_mask
+            )
+
+            for position, patch in zip(missing, fresh):
+
+                reconstructed[position] = patch
+
+                if cache is not None:
+
+                    cache.store(
+                        signatures[position],
+                        patch,
+                        region=index
+                    )
+
+        if pending:
+
+            started = time.perf_counter()
+
+            keyframe = flow.keyframe_patch(
+                region=index
+            )
+
+            for position, entry in zip(pending, flow_plan):
+
+                if entry is None:
+                    continue
+
+                source, matrix = entry
+
+                reconstructed[position] = flow.warp(
+                    (
+                        keyframe
+                        if source < 0
+                        else reconstructed[pending[source]]
+                    ),
+                    matrix
+                )
+
+            # The last keyframe of the batch serves the next.
+            keys = [
+                position
+                for position, entry in zip(pending, flow_plan)
+                if entry is None
+            ]
+
+            if keys:
+
+                flow.remember(
+                    reconstructed[keys[-1]],
+                    region=index
+                )
+
+            if timer is not None:
+
+                timer.add(
+                    "flow",
+                    time.perf_counter() - started
+                )
+
+        # ----------------------------------------------------
+        # Only selected watermark pixels are replaced.
+        # The context pixels remain ORIGINAL.
+        # ----------------------------------------------------
+
+        started = time.perf_counter()
+
+        values = plan["values"]
+
+        for frame, patch in zip(
+            frames,
+            reconstructed
+        ):
+
+            np.take(
+                np.ascontiguousarray(patch).reshape(-1),
+                plan["crop"],
+                out=values
+            )
+
+            np.put(
+                frame.reshape(-1),
+                plan["frame"],
+                values
+            )
+
+        if timer is not None:
+
+            timer.add(
+                "composite",
+                time.perf_counter() - started
+            )
+
+    def process_batch(frames):
+
+        # In-place writes need a flat view of every frame.
+        for position, frame in enumerate(frames):
+
+            if not frame.flags["C_CONTIGUOUS"]:
+
+                frames[position] = np.ascontiguousarray(
+                    frame
+                )
+
+        for index, region in enumerate(regions):
+
+            process_region(
+                frames,
+                index,
+                region
+            )
+
+        return frames
+
+    return process_batch
+
+
+# ============================================================
+# FRAME RANGE READER
+#
+# Wraps cv2.VideoCapture so the pipeline only sees the frames
+# of one time range.
+# ============================================================
+
+class FrameRangeReader:
+
+    def __init__(
+        self,
+        cap,
+        start,
+        count=None
+    ):
+
+        self.cap = cap
+        self.remaining = count
+
+        if start > 0:
+
+            cap.set(
+                cv2.CAP_PROP_POS_FRAMES,
+                start
+            )
+
+    def read(self):
+
+        if self.remaining is not None:
+
+            if self.remaining <= 0:
+                return False, None
+
+            self.remaining -= 1
+
+        return self.cap.read()
+
+
+# ============================================================
+# SEGMENT CONCATENATION
+#
+# Segments are encoded with identical x264 settings, so the
+# concat demuxer joins them without re-encoding. The source
+# audio is muxed in the same step.
+# ============================================================
+
+def concat_segments(
+    segments,
+    output_path,
+    audio_source=None
+):
+
+    list_path = output_path + ".segments.txt"
+
+    with open(list_path, "w", encoding="utf-8") as handle:
+
+        for segment in segments:
+
+            escaped = os.path.abspath(
+                segment
+            ).replace(
+                "'",
+                "'\\''"
+            )
+
+            handle.write(
+                f"file '{escaped}'\n"
+            )
+
+    command = [
+        "ffmpeg",
+        "-y",
+        "-loglevel",
+        "error",
+
+        "-f",
+        "concat",
+
+        "-safe",
+        "0",
+
+        "-i",
+        list_path
+    ]
+
+    if audio_source:
+
+        command += [
+            "-i",
+            audio_source,
+
+            "-map",
+            "0:v:0",
+
+            "-map",
+            "1:a?"
+        ]
+
+        command += audio_codec_args(
+            audio_source
+        )
+
+    command += [
+        "-c:v",
+        "copy",
+
+        "-movflags",
+        "+faststart",
+
+        output_path
+    ]
+
+    try:
+
+        result = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+
+    finally:
+
+        try:
+            os.remove(list_path)
+        except OSError:
+            pass
+
+    if result.returncode != 0:
+
+        raise RuntimeError(
+            "FFmpeg could not join the segments:\n\n"
+            + result.stderr[-4000:]
+        )
+
+
+# ============================================================
+# TIME-SHARDED PARALLEL REMOVAL
+#
+# The video is split into N contiguous frame ranges. Each
+# range runs in its own worker process with its own LaMa
+# instance (or classical engine) and a fixed torch thread
+# count, and is encoded to its own x264 segment. The
+# segments are then joined losslessly and the source audio
+# is muxed back in.
+#
+# Workers use the "spawn" start method: forking a process
+# that already runs PyTorch thread pools can deadlock.
+#
+# With a `cancel_event`, a shared stop flag is checked after
+# every frame inside the workers, so a cancelled job does not
+# finish its running shards first.
+#
+# A spawned child normally re-runs the parent's main script
+# (as __mp_main__) before it starts. For app.py that is the
+# command line, the banner, the job queue and the whole UI in
+# every worker. The workers only need this module, so the
+# main script is hidden from multiprocessing while they are
+# started.
+# ============================================================
+
+_WORKER_INPAINT = None
+
+_WORKER_STOP = None
+
+# Serializes the main-module swap between concurrent jobs.
+_SPAWN_LOCK = threading.Lock()
+
+_MISSING = object()
+
+
+def _start_shard_workers(
+    executor,
+    tasks
+):
+
+    # A ProcessPoolExecutor starts one worker per submit
+    # until it is full, so every worker starts in here.
+    with _SPAWN_LOCK:
+
+        main = sys.modules["__main__"]
+
+        saved_file = getattr(
+            main,
+            "__file__",
+            _MISSING
+        )
+
+        saved_spec = getattr(
+            main,
+            "__spec__",
+            None
+        )
+
+        if saved_file is not _MISSING:
+            del main.__file__
+
+        main.__spec__ = None
+
+        try:
+
+            return {
+                executor.submit(
+                    _run_shard,
+                    task
+                )
+                for task in tasks
+            }
+
+        finally:
+
+            main.__spec__ = saved_spec
+
+            if saved_file is not _MISSING:
+                main.__file__ = saved_file
+
+
+def _init_shard_worker(
+    device,
+    threads,
+    engine=ENGINE_LAMA,
+    precision=PRECISION_FP32,
+    model_path=None,
+    tile_size=TILE_SIZE,
+    stop=None
+):
+
+    global _WORKER_INPAINT, _WORKER_STOP
+
+    _WORKER_STOP = stop
+
+    torch.set_num_threads(
+        threads
+    )
+
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    # Decoding inside a worker should not fight the other
+    # workers for cores.
+    cv2.setNumThreads(1)
+
+    if engine in CLASSICAL_ENGINES:
+
+        _WORKER_INPAINT = make_classical_inpaint(
+            engine
+        )
+
+    else:
+
+        _WORKER_INPAINT = make_tiled_inpaint(
+            LamaRunner.load(
+                device,
+                precision,
+                model_path
+            ).inpaint,
+            tile_size
+        )
+
+
+def _worker_inpaint(
+    images,
+    mask
+):
+
+    return _WORKER_INPAINT(
+        images,
+        mask
+    )
+
+
+def _check_worker_stop(processed):
+
+    if _WORKER_STOP is not None and _WORKER_STOP.is_set():
+
+        raise JobCancelled(
+            "The job was cancelled."
+        )
+
+
+def _run_shard(task):
+
+    cap = cv2.VideoCapture(
+        task["path"]
+    )
+
+    if not cap.isOpened():
+
+        raise RuntimeError(
+            "Could not open video in worker."
+        )
+
+    timer = StageTimer()
+
+    reader = TimedCapture(
+        FrameRangeReader(
+            cap,
+            task["start"],
+            task["count"]
+        ),
+        timer
+    )
+
+    writer = FFmpegFrameWriter(
+        task["segment"],
+        task["width"],
+        task["height"],
+        task["fps"]
+    )
+
+    cache = InpaintReuseCache(
+        task["reuse_threshold"]
+    )
+
+    # Every shard starts with its own keyframe.
+    flow = FlowPropagator(
+        task["flow_interval"]
+    )
+
+    process_batch = make_batch_processor(
+        _worker_inpaint,
+        task["regions"],
+        cache=cache,
+        timer=timer,
+        flow=flow
+    )
+
+    try:
+
+        processed = run_frame_pipeline(
+            reader,
+            process_batch,
+            timer.wrap("encode", writer.write),
+            queue_depth=task["queue_depth"],
+            batch_size=task["batch_size"],
+            on_progress=_check_worker_stop
+        )
+
+    finally:
+
+        cap.release()
+        writer.release()
+
+    if writer.returncode != 0:
+
+        raise RuntimeError(
+            "FFmpeg failed on a segment:\n\n"
+            + writer.error_output()
+        )
+
+    summary = cache.stats()
+
+    summary.update(
+        flow.stats()
+    )
+
+    summary["frames"] = processed
+
+    summary["timings"] = timer.export()
+
+    return summary
+
+
+def shard_ranges(
+    total_frames,
+    workers
+):
+
+    total = max(
+        int(total_frames),
+        1
+    )
+
+    workers = max(
+        1,
+        min(
+            int(workers),
+            total
+        )
+    )
+
+    size = -(-total // workers)
+
+    # Rounding up the shard size can leave fewer shards.
+    workers = -(-total // size)
+
+    ranges = []
+
+    for index in range(workers):
+
+        # The last shard reads until the video really ends,
+        # because CAP_PROP_FRAME_COUNT is only an estimate.
+        if index == workers - 1:
+            count = None
+        else:
+            count = size
+
+        ranges.append(
+            (
+                index * size,
+                count
+            )
+        )
+
+    return ranges
+
+
+def remove_watermark_sharded(
+    path,
+    output_path,
+    regions,
+    width,
+    height,
+    fps,
+    total_frames,
+    workers,
+    device,
+    threads=None,
+    queue_depth=PIPELINE_QUEUE_DEPTH,
+    batch_size=LAMA_BATCH_SIZE,
+    reuse_threshold=REUSE_THRESHOLD,
+    on_progress=None,
+    timer=None,
+    engine=ENGINE_LAMA,
+    precision=PRECISION_FP32,
+    model_path=None,
+    flow_interval=FLOW_INTERVAL,
+    tile_size=TILE_SIZE,
+    cancel_event=None
+):
+
+    ranges = shard_ranges(
+        total_frames,
+        workers
+    )
+
+    if threads is None:
+
+        threads = max(
+            1,
+            (os.cpu_count() or 1) // len(ranges)
+        )
+
+    tasks = []
+
+    for index, (start, count) in enumerate(ranges):
+
+        tasks.append(
+            {
+                "path": path,
+                "start": start,
+                "count": count,
+                "segment": f"{output_path}.part{index:03d}.mp4",
+                "width": width,
+                "height": height,
+                "fps": fps,
+                "regions": regions,
+                "queue_depth": queue_depth,
+                "batch_size": batch_size,
+                "reuse_threshold": reuse_threshold,
+                "flow_interval": flow_interval
+            }
+        )
+
+    segments = [
+        task["segment"]
+        for task in tasks
+    ]
+
+    # Totals across all workers.
+    summary = {
+        "frames": 0,
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "flow_keyframes": 0,
+        "flow_propagated": 0
+    }
+
+    context = multiprocessing.get_context("spawn")
+
+    stop = context.Event()
+
+    executor = ProcessPoolExecutor(
+        max_workers=len(tasks),
+        mp_context=context,
+        initializer=_init_shard_worker,
+        initargs=(
+            str(device),
+            int(threads),
+            engine,
+            precision,
+            model_path,
+            tile_size,
+            stop
+        )
+    )
+
+    try:
+
+        pending = _start_shard_workers(
+            executor,
+            tasks
+        )
+
+        finished = 0
+
+        while pending:
+
+            done, pending = wait(
+                pending,
+                timeout=PIPELINE_POLL_SECONDS,
+                return_when=FIRST_COMPLETED
+            )
+
+            if cancel_event is not None and cancel_event.is_set():
+
+                raise JobCancelled(
+                    "The job was cancelled."
+                )
+
+            for future in done:
+
+                result = future.result()
+
+                timings = result.pop("timings")
+
+                if timer is not None:
+                    timer.merge(timings)
+
+                for key, value in result.items():
+                    summary[key] += value
+
+                finished += 1
+
+                if on_progress is not None:
+
+                    on_progress(
+                        finished,
+                        len(tasks)
+                    )
+
+        executor.shutdown(
+            wait=True
+        )
+
+        join = concat_segments
+
+        if timer is not None:
+
+            join = timer.wrap(
+                "mux",
+                join
+            )
+
+        join(
+            segments,
+            output_path,
+            audio_source=path
+        )
+
+    except BaseException:
+
+        # Running shards stop after their current frame.
+        stop.set()
+
+        executor.shutdown(
+            wait=True,
+            cancel_futures=True
+        )
+
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        raise
+
+    finally:
+
+        for segment in segments:
+
+            if os.path.exists(segment):
+                os.remove(segment)
+
+    return summary
+
+
+# ============================================================
+# JOB FINGERPRINTS
+#
+# A cheap content hash: file size plus the first and last
+# megabyte. Re-uploading the same video gives the same value
+# even when Gradio stores it under a new temporary path.
+# ============================================================
+
+def video_fingerprint(path):
+
+    size = os.path.getsize(
+        path
+    )
+
+    digest = hashlib.sha1(
+        str(size).encode()
+    )
+
+    with open(path, "rb") as handle:
+
+        digest.update(
+            handle.read(FINGERPRINT_BYTES)
+        )
+
+        if size > FINGERPRINT_BYTES * 2:
+
+            handle.seek(
+                -FINGERPRINT_BYTES,
+                os.SEEK_END
+            )
+
+            digest.update(
+                handle.read()
+            )
+
+    return digest.hexdigest()
+
+
+def job_fingerprint(
+    path,
+    mask,
+    settings
+):
+
+    digest = hashlib.sha1(
+        video_fingerprint(path).encode()
+    )
+
+    # No mask: the settings alone describe the job.
+    if mask is not None:
+
+        mask = np.ascontiguousarray(
+            mask
+        )
+
+        digest.update(
+            str(mask.shape).encode()
+        )
+
+        digest.update(
+            mask.tobytes()
+        )
+
+    digest.update(
+        json.dumps(
+            settings,
+            sort_keys=True
+        ).encode()
+    )
+
+    return digest.hexdigest()[:20]
+
+
+# ============================================================
+# RESUMABLE JOB
+#
+# Output is written as fixed-length x264 segments inside
+# WORK_DIR/job_<fingerprint>/. Every finished segment is
+# recorded in manifest.json.
+#
+# If the job dies (OOM, killed container, ffmpeg error), the
+# same video + mask + settings map to the same directory, and
+# the next run continues after the last finished segment.
+#
+# Used as the writer of the frame pipeline: write() and
+# release() behave like cv2.VideoWriter.
+# ============================================================
+
+class ResumableJob:
+
+    def __init__(
+        self,
+        work_dir,
+        key,
+        width,
+        height,
+        fps,
+        segment_frames=SEGMENT_FRAMES
+    ):
+
+        self.directory = os.path.join(
+            work_dir,
+            f"job_{key}"
+        )
+
+        self.manifest_path = os.path.join(
+            self.directory,
+            "manifest.json"
+        )
+
+        self.width = width
+        self.height = height
+        self.fps = fps
+
+        os.makedirs(
+            self.directory,
+            exist_ok=True
+        )
+
+        expected = {
+            "version": 1,
+            "width": width,
+            "height": height,
+            "fps": fps,
+            "segment_frames": int(segment_frames)
+        }
+
+        manifest = self._load()
+
+        if manifest is None or any(
+            manifest.get(name) != value
+            for name, value in expected.items()
+        ):
+
+            manifest = dict(
+                expected,
+                segments=[]
+            )
+
+        # ----------------------------------------------------
+        # Keep only the unbroken run of segments whose files
+        # still exist.
+        # ----------------------------------------------------
+
+        segments = []
+
+        for segment in manifest["segments"]:
+
+            if not os.path.exists(
+                os.path.join(
+                    self.directory,
+                    segment["file"]
+                )
+            ):
+                break
+
+            segments.append(
+                segment
+            )
+
+        manifest["segments"] = segments
+
+        self.manifest = manifest
+
+        self._save()
+
+        self._writer = None
+        self._frames = 0
+
+    # --------------------------------------------------------
+    # Manifest.
+    # --------------------------------------------------------
+
+    def _load(self):
+
+        try:
+
+            with open(self.manifest_path, encoding="utf-8") as handle:
+                return json.load(handle)
+
+        except (OSError, ValueError):
+
+            return None
+
+    def _save(self):
+
+        temporary = self.manifest_path + ".tmp"
+
+        with open(temporary, "w", encoding="utf-8") as handle:
+
+            json.dump(
+                self.manifest,
+                handle,
+                indent=2
+            )
+
+        # Atomic: a crash never leaves a half-written manifest.
+        os.replace(
+            temporary,
+            self.manifest_path
+        )
+
+    @property
+    def start_frame(self):
+
+        return sum(
+            segment["frames"]
+            for segment in self.manifest["segments"]
+        )
+
+    @property
+    def segment_paths(self):
+
+        return [
+            os.path.join(
+                self.directory,
+                segment["file"]
+            )
+            for segment in self.manifest["segments"]
+        ]
+
+    # --------------------------------------------------------
+    # Writer interface.
+    # --------------------------------------------------------
+
+    def isOpened(self):
+
+        return True
+
+    def write(self, frame):
+
+        if self._writer is None:
+
+            index = len(
+                self.manifest["segments"]
+            )
+
+            self._writer = FFmpegFrameWriter(
+                os.path.join(
+                    self.directory,
+                    f"segment_{index:05d}.mp4"
+                ),
+                self.width,
+                self.height,
+                self.fps
+            )
+
+        self._writer.write(
+            frame
+        )
+
+        self._frames += 1
+
+        if self._frames >= self.manifest["segment_frames"]:
+            self._close_segment()
+
+    def _close_segment(self):
+
+        writer = self._writer
+
+        self._writer = None
+
+        if writer.release() != 0:
+
+            raise RuntimeError(
+                "FFmpeg failed on a segment:\n\n"
+                + writer.error_output()
+            )
+
+        self.manifest["segments"].append(
+            {
+                "file": os.path.basename(
+                    writer.output_path
+                ),
+                "frames": self._frames
+            }
+        )
+
+        self._frames = 0
+
+        self._save()
+
+    def release(self):
+
+        # Discards the unfinished segment only. Finished
+        # segments stay on disk for the next run.
+        writer = self._writer
+
+        self._writer = None
+        self._frames = 0
+
+        if writer is not None:
+
+            writer.release()
+
+            if os.path.exists(writer.output_path):
+                os.remove(writer.output_path)
+
+    def finish(self):
+
+        if self._writer is not None and self._frames:
+            self._close_segment()
+
+    # --------------------------------------------------------
+    # Final video.
+    # --------------------------------------------------------
+
+    def complete(
+        self,
+        output_path,
+        audio_source=None
+    ):
+
+        self.finish()
+
+        if not self.manifest["segments"]:
+
+            raise RuntimeError(
+                "No frames were processed."
+            )
+
+        concat_segments(
+            self.segment_paths,
+            output_path,
+            audio_source=audio_source
+        )
+
+        shutil.rmtree(
+            self.directory,
+            ignore_errors=True
+        )
+
+
+# ============================================================
+# WORKSPACE
+#
+# Every analysis, output video and resumable job lives in
+# WORK_DIR. On a shared server that folder must not grow
+# forever, so Workspace keeps it under a size quota:
+#
+# - every top-level entry (file or job folder) is one unit
+# - its last use is the newest modification time inside it;
+#   touch() marks an entry as used again
+# - when the quota is exceeded, the least recently used
+#   entries are deleted first
+# - entries used within WORKSPACE_GRACE_SECONDS are never
+#   deleted, so files of running jobs and results that are
+#   still being downloaded stay put
+#
+# Analyses are content-addressed: analysis_<key>.npz, where
+# the key hashes the video fingerprint, the selection and
+# the analysis settings. Analysing the same input again
+# loads the saved record instead of decoding the video.
+# ============================================================
+
+def _entry_stats(path):
+
+    # (bytes, newest modification time) of a file or folder.
+    info = os.stat(
+        path
+    )
+
+    if not os.path.isdir(path):
+        return info.st_size, info.st_mtime
+
+    size = 0
+    newest = info.st_mtime
+
+    for folder, _, names in os.walk(path):
+
+        for name in names:
+
+            try:
+                info = os.stat(os.path.join(folder, name))
+            except OSError:
+                continue
+
+            size += info.st_size
+            newest = max(newest, info.st_mtime)
+
+    return size, newest
+
+
+class Workspace:
+
+    def __init__(
+        self,
+        root,
+        quota_bytes=WORKSPACE_QUOTA_MB * 1024 * 1024,
+        grace_seconds=WORKSPACE_GRACE_SECONDS
+    ):
+
+        self.root = root
+        self.quota_bytes = int(quota_bytes)
+        self.grace_seconds = float(grace_seconds)
+        self._lock = threading.Lock()
+
+        os.makedirs(
+            root,
+            exist_ok=True
+        )
+
+    def path(self, name):
+
+        return os.path.join(
+            self.root,
+            name
+        )
+
+    def touch(self, path):
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def usage(self):
+
+        total = 0
+
+        for name in os.listdir(self.root):
+
+            try:
+                total += _entry_stats(self.path(name))[0]
+            except OSError:
+                continue
+
+        return total
+
+    def enforce(
+        self,
+        reserve_bytes=0,
+        keep=()
+    ):
+
+        # Deletes least recently used entries until the
+        # workspace plus `reserve_bytes` fits the quota.
+        # Returns the deleted paths.
+        if self.quota_bytes <= 0:
+            return []
+
+        keep = {
+            os.path.abspath(path)
+            for path in keep
+        }
+
+        with self._lock:
+
+            entries = []
+
+            for name in os.listdir(self.root):
+
+                path = self.path(name)
+
+                try:
+                    size, used = _entry_stats(path)
+                except OSError:
+                    continue
+
+                entries.append(
+                    (used, size, path)
+                )
+
+            total = sum(
+                size for _, size, _ in entries
+            )
+
+            removed = []
+
+            now = time.time()
+
+            for used, size, path in sorted(entries):
+
+                if total + reserve_bytes <= self.quota_bytes:
+                    break
+
+                if (
+                    os.path.abspath(path) in keep
+                    or now - used < self.grace_seconds
+                ):
+                    continue
+
+                try:
+
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+
+                except OSError:
+                    continue
+
+                total -= size
+
+                removed.append(
+                    path
+                )
+
+        return removed
+
+    # --------------------------------------------------------
+    # Content-addressed analysis records.
+    # --------------------------------------------------------
+
+    def analysis_path(self, key):
+
+        return self.path(
+            f"analysis_{key}.npz"
+        )
+
+    def find_analysis(self, key):
+
+        path = self.analysis_path(
+            key
+        )
+
+        if not os.path.exists(path):
+            return None
+
+        self.touch(
+            path
+        )
+
+        return path
+
+    def save_analysis(
+        self,
+        key,
+        **arrays
+    ):
+
+        path = self.analysis_path(
+            key
+        )
+
+        # Written under a temporary name, so a concurrent
+        # reader never sees half a file.
+        partial = path + f".{os.getpid()}.{threading.get_ident()}.npz"
+
+        np.savez_compressed(
+            partial,
+            **arrays
+        )
+
+        os.replace(
+            partial,
+            path
+        )
+
+        self.enforce(
+            keep=(path,)
+        )
+
+        return path
+
+
+# ============================================================
+# JOB QUEUE
+#
+# One app instance serves a whole team. Running every removal
+# inside its request handler either serialises the jobs with
+# no feedback or lets them fight over cores and memory.
+#
+# JobQueue runs at most `workers` jobs at a time on its own
+# threads; the rest wait in FIFO order. The job function is
+# called with `job=` and reports through it:
+#
+# - job.report(fraction, message) publishes progress and
+#   raises JobCancelled once the job has been cancelled, so
+#   calling it from the frame loop's progress callback stops
+#   the loop within one frame
+# - a cancelled job that is still waiting never starts
+#
+# Requests poll their Job (state, progress, message, position
+# in line) and pick up the result or the error at the end.
+# Workers are threads of one process, so every job uses the
+# same loaded model.
+# ============================================================
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+
+    def __init__(
+        self,
+        function=None,
+        args=(),
+        kwargs=None
+    ):
+
+        self.id = uuid.uuid4().hex
+        self.state = JOB_QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+
+        self._call = (
+            function,
+            args,
+            kwargs or {}
+        )
+
+        self._done = threading.Event()
+
+    @property
+    def cancelled(self):
+
+        return self.cancel_event.is_set()
+
+    @property
+    def finished(self):
+
+        return self._done.is_set()
+
+    def cancel(self):
+
+        self.cancel_event.set()
+
+    def report(
+        self,
+        fraction=None,
+        message=None
+    ):
+
+        if self.cancelled:
+
+            raise JobCancelled(
+                "The job was cancelled."
+            )
+
+        if fraction is not None:
+
+            self.progress = min(
+                1.0,
+                max(0.0, float(fraction))
+            )
+
+        if message is not None:
+            self.message = message
+
+    def wait(self, timeout=None):
+
+        return self._done.wait(
+            timeout
+        )
+
+    def _finish(
+        self,
+        state,
+        result=None,
+        error=None
+    ):
+
+        self.state = state
+        self.result = result
+        self.error = error
+
+        self._done.set()
+
+
+class JobQueue:
+
+    def __init__(
+        self,
+        workers=JOB_WORKERS
+    ):
+
+        self.workers = max(
+            1,
+            int(workers)
+        )
+
+        self._waiting = collections.deque()
+        self._jobs = {}
+        self._running = 0
+        self._condition = threading.Condition()
+
+        for index in range(self.workers):
+
+            threading.Thread(
+                target=self._work,
+                name=f"watermark-job-{index}",
+                daemon=True
+            ).start()
+
+    def submit(
+        self,
+        function,
+        *args,
+        **kwargs
+    ):
+
+        job = Job(
+            function,
+            args,
+            kwargs
+        )
+
+        with self._condition:
+
+            self._jobs[job.id] = job
+
+            self._waiting.append(
+                job
+            )
+
+            self._condition.notify()
+
+        return job
+
+    def get(self, job_id):
+
+        with self._condition:
+
+            return self._jobs.get(
+                job_id
+            )
+
+    def position(self, job):
+
+        # 1 = next in line, 0 = not waiting.
+        with self._condition:
+
+            try:
+                return self._waiting.index(job) + 1
+            except ValueError:
+                return 0
+
+    def counts(self):
+
+        # (running, waiting)
+        with self._condition:
+
+            return (
+                self._running,
+                len(self._waiting)
+            )
+
+    def cancel(self, job_id):
+
+        with self._condition:
+
+            job = self._jobs.get(
+                job_id
+            )
+
+            if job is None:
+                return False
+
+            job.cancel()
+
+            if job not in self._waiting:
+                return True
+
+            # Never started: finished right away.
+            self._waiting.remove(
+                job
+            )
+
+            del self._jobs[job.id]
+
+        job._finish(
+            JOB_CANCELLED,
+            error=JobCancelled(
+                "The job was cancelled."
+            )
+        )
+
+        return True
+
+    def _work(self):
+
+        while True:
+
+            with self._condition:
+
+                while not self._waiting:
+                    self._condition.wait()
+
+                job = self._waiting.popleft()
+
+                job.state = JOB_RUNNING
+
+                self._running += 1
+
+            function, args, kwargs = job._call
+
+            try:
+
+                result = function(
+                    *args,
+                    job=job,
+                    **kwargs
+                )
+
+            except JobCancelled as error:
+
+                outcome = (JOB_CANCELLED, None, error)
+
+            except Exception as error:
+
+                outcome = (JOB_FAILED, None, error)
+
+            else:
+
+                outcome = (JOB_DONE, result, None)
+
+            with self._condition:
+
+                self._running -= 1
+
+                self._jobs.pop(
+                    job.id,
+                    None
+                )
+
+            job._finish(
+                *outcome
+            )
+
+
+# ============================================================
+# AUTOMATIC WATERMARK DETECTION
+#
+# A static watermark stays put while the video behind it
+# changes. Sampling frames across the whole video shows it:
+#
+# - its edges appear in (almost) every sampled frame
+# - opaque parts barely change brightness over time
+#
+# Frames are reached by seeking, so only DETECT_SAMPLES
+# frames (plus the GOP run-up of each seek) are decoded,
+# whatever the length of the video. Per-pixel mean and
+# variance (Welford) and the edge count are updated in one
+# streaming pass at reduced resolution; no frame is kept.
+#
+# The result is a rough mask meant for the normal refine /
+# analysis step, not a pixel-exact selection.
+# ============================================================
+
+# Frames sampled across the video.
+DETECT_SAMPLES = 48
+
+# Frames are analysed at most this wide.
+DETECT_MAX_WIDTH = 640
+
+# Share of samples in which an edge must appear.
+DETECT_EDGE_PERSISTENCE = 0.7
+
+# With a lower persistence, the pixel must also be stable
+# (temporal standard deviation in grey levels).
+DETECT_WEAK_PERSISTENCE = 0.4
+DETECT_MAX_STD = 8.0
+
+# Below this median temporal deviation the whole video is
+# nearly static, and static content cannot be told apart
+# from a watermark.
+DETECT_MIN_MOTION = 4.0
+
+# Candidate parts larger than this share of the frame are
+# scenery, not watermarks.
+DETECT_MAX_AREA = 0.15
+
+
+def _sample_indices(
+    total_frames,
+    samples
+):
+
+    if total_frames <= samples:
+        return list(range(max(total_frames, 0)))
+
+    # Skip the very first and last frames (fades, intros).
+    step = total_frames / (samples + 1)
+
+    return [
+        int(step * (index + 1))
+        for index in range(samples)
+    ]
+
+
+def detect_static_mask(
+    path,
+    samples=DETECT_SAMPLES
+):
+
+    cap = cv2.VideoCapture(
+        path
+    )
+
+    if not cap.isOpened():
+
+        raise RuntimeError(
+            f"Could not open video: {path}"
+        )
+
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    scale = min(
+        1.0,
+        DETECT_MAX_WIDTH / max(width, 1)
+    )
+
+    size = (
+        max(1, int(round(width * scale))),
+        max(1, int(round(height * scale)))
+    )
+
+    count = 0
+    mean = None
+    m2 = None
+    edge_hits = None
+
+    try:
+
+        for index in _sample_indices(total, samples):
+
+            cap.set(
+                cv2.CAP_PROP_POS_FRAMES,
+                index
+            )
+
+            ok, frame = cap.read()
+
+            if not ok:
+                continue
+
+            gray = cv2.cvtColor(
+                cv2.resize(
+                    frame,
+                    size,
+                    interpolation=cv2.INTER_AREA
+                ),
+                cv2.COLOR_BGR2GRAY
+            )
+
+            if mean is None:
+
+                mean = np.zeros(gray.shape, np.float32)
+                m2 = np.zeros(gray.shape, np.float32)
+                edge_hits = np.zeros(gray.shape, np.uint16)
+
+            # Welford's running mean and variance.
+            count += 1
+
+            value = gray.astype(np.float32)
+
+            delta = value - mean
+
+            mean += delta / count
+
+            m2 += delta * (value - mean)
+
+            edge_hits += cv2.Canny(
+                gray,
+                50,
+                150
+            ) > 0
+
+    finally:
+
+        cap.release()
+
+    if count < 3:
+
+        raise ValueError(
+            "Not enough frames could be read to detect a watermark."
+        )
+
+    std = np.sqrt(
+        m2 / (count - 1)
+    )
+
+    if float(np.median(std)) < DETECT_MIN_MOTION:
+
+        raise ValueError(
+            "The video is almost static, so a watermark cannot "
+            "be told apart from the scene. Paint it instead."
+        )
+
+    persistence = edge_hits / float(count)
+
+    candidate = (
+        (persistence >= DETECT_EDGE_PERSISTENCE)
+        | (
+            (persistence >= DETECT_WEAK_PERSISTENCE)
+            & (std <= DETECT_MAX_STD)
+        )
+    ).astype(np.uint8) * 255
+
+    # --------------------------------------------------------
+    # Join the strokes of letters into solid parts.
+    # --------------------------------------------------------
+
+    join = max(
+        3,
+        int(size[0] * 0.012) | 1
+    )
+
+    candidate = cv2.morphologyEx(
+        candidate,
+        cv2.MORPH_CLOSE,
+        cv2.getStructuringElement(
+            cv2.MORPH_ELLIPSE,
+            (join, join)
+        )
+    )
+
+    labels, label_map, stats, _ = cv2.connectedComponentsWithStats(
+        candidate,
+        8
+    )
+
+    area_limit = DETECT_MAX_AREA * size[0] * size[1]
+
+    keep = np.zeros(
+        labels,
+        dtype=bool
+    )
+
+    for label in range(1, labels):
+
+        x, y, w, h, area = stats[label]
+
+        # Lines across the frame are letterbox or scene
+        # borders, not watermarks.
+        spans = (
+            w > size[0] * 0.6
+            or h > size[1] * 0.6
+        )
+
+        if (
+            area >= 12
+            and area <= area_limit
+            and not spans
+        ):
+            keep[label] = True
+
+    mask = np.where(
+        keep[label_map],
+        255,
+        0
+    ).astype(np.uint8)
+
+    if cv2.countNonZero(mask) == 0:
+
+        raise ValueError(
+            "No static watermark was found."
+        )
+
+    mask = cv2.resize(
+        mask,
+        (
+            width,
+            height
+        ),
+        interpolation=cv2.INTER_NEAREST
+    )
+
+    return {
+        "mask": mask,
+        "samples": count,
+        "parts": int(keep.sum()),
+        "coverage": cv2.countNonZero(mask) / float(width * height)
+    }
+
+
+# ============================================================
+# TIME-RANGE PROCESSING
+#
+# Watermarks often appear in only part of a video, such as
+# the outro. With active time ranges, only those spans are
+# decoded, inpainted and encoded; everything else is copied
+# bit for bit.
+#
+# 1. ffprobe lists every video packet with its timestamp.
+#    Cuts are only made at "clean" keyframes: no earlier
+#    packet is shown after it and no later packet before it,
+#    so open GOPs and B-frame reordering never cross a cut.
+# 2. Every range is widened to the clean keyframes around
+#    it, and the video becomes a list of "copy" and
+#    "process" pieces.
+# 3. One stream-copy pass with the segment muxer splits the
+#    source at exactly those keyframes, so every packet ends
+#    up in exactly one MP4 piece (nothing dropped or doubled).
+# 4. "process" pieces are decoded from their own file,
+#    cleaned, and encoded with the x264 options of the
+#    source (read from its x264 SEI). The SPS/PPS of every
+#    encoded piece must match the source's, or the pieces
+#    could not share one avcC.
+# 5. The pieces are joined with the concat demuxer and the
+#    source audio is muxed back over the whole video.
+#
+# Needs an x264-encoded H.264 yuv420p source with a constant
+# frame rate (checked on the packet timestamps). All of this
+# is checked, including a one-frame trial encode, before any
+# frame is inpainted; a source that fails raises
+# RangesUnsupported with the reason. Frames outside the
+# ranges are never inpainted.
+# ============================================================
+
+
+class RangesUnsupported(Exception):
+
+    # The video cannot be processed in time ranges. Raised
+    # before any frame is inpainted.
+    pass
+
+
+# Seconds between samples when ranges are detected.
+RANGE_SAMPLE_STEP = 2.0
+
+# Upper bound on samples for very long videos.
+RANGE_MAX_SAMPLES = 400
+
+# A sample shows the watermark when the mask area has this
+# many times the edge density of the ring around it.
+RANGE_EDGE_RATIO = 1.5
+RANGE_MIN_EDGE_DENSITY = 0.02
+
+
+def _parse_timestamp(text):
+
+    # "75", "1:15", "0:01:15.5"
+    seconds = 0.0
+
+    for part in text.strip().split(":"):
+        seconds = seconds * 60 + float(part)
+
+    return seconds
+
+
+def parse_time_ranges(text):
+
+    # "0:10-0:25, 19:50-" → [(10, 25), (1190, None)]
+    ranges = []
+
+    for item in text.replace(";", ",").split(","):
+
+        item = item.strip()
+
+        if not item:
+            continue
+
+        if "-" not in item:
+
+            raise ValueError(
+                f"Time range '{item}' must look like START-END."
+            )
+
+        start, end = item.split("-", 1)
+
+        start = _parse_timestamp(start) if start.strip() else 0.0
+
+        end = _parse_timestamp(end) if end.strip() else None
+
+        if end is not None and end <= start:
+
+            raise ValueError(
+                f"Time range '{item}' ends before it starts."
+            )
+
+        ranges.append(
+            (start, end)
+        )
+
+    return ranges
+
+
+def probe_video_stream(path):
+
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+
+        "-select_streams",
+        "v:0",
+
+        "-show_entries",
+        "stream=codec_name,pix_fmt,r_frame_rate,sample_aspect_ratio,"
+        "color_range,color_primaries,color_transfer,color_space,"
+        "chroma_location",
+
+        "-of",
+        "json",
+
+        path
+    ]
+
+    result = subprocess.run(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+
+    if result.returncode != 0:
+
+        raise RuntimeError(
+            "ffprobe failed:\n\n"
+            + result.stderr[-4000:]
+        )
+
+    data = json.loads(
+        result.stdout
+    )
+
+    stream = (data.get("streams") or [{}])[0]
+
+    return {
+        "codec": stream.get("codec_name"),
+        "pix_fmt": stream.get("pix_fmt"),
+        # Exact rational rate, e.g. "30000/1001".
+        "frame_rate": stream.get("r_frame_rate") or "0/1",
+        "sample_aspect_ratio": stream.get("sample_aspect_ratio"),
+        "color_range": stream.get("color_range"),
+        "color_primaries": stream.get("color_primaries"),
+        "color_transfer": stream.get("color_transfer"),
+        "color_space": stream.get("color_space"),
+        "chroma_location": stream.get("chroma_location")
+    }
+
+
+def probe_packets(path):
+
+    # (pts in seconds, keyframe) of every video packet, in
+    # decode order. Reads packet headers only.
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+
+        "-select_streams",
+        "v:0",
+
+        "-show_entries",
+        "packet=pts_time,flags",
+
+        "-of",
+        "csv=p=0",
+
+        path
+    ]
+
+    result = subprocess.run(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+
+    if result.returncode != 0:
+
+        raise RuntimeError(
+            "ffprobe failed:\n\n"
+            + result.stderr[-4000:]
+        )
+
+    packets = []
+
+    for line in result.stdout.splitlines():
+
+        fields = line.split(",")
+
+        if len(fields) < 2:
+            continue
+
+        if fields[0] in ("", "N/A"):
+
+            raise RangesUnsupported(
+                "The video has packets without timestamps."
+            )
+
+        packets.append(
+            (
+                float(fields[0]),
+                "K" in fields[1]
+            )
+        )
+
+    if not packets:
+
+        raise RangesUnsupported(
+            "The video has no video packets."
+        )
+
+    return packets
+
+
+def clean_keyframes(packets):
+
+    # Keyframes that split the video cleanly: every packet
+    # before it (decode order) is also shown before it, and
+    # every packet after it is shown after it. Open-GOP
+    # keyframes with leading B-frames fail this test.
+    count = len(packets)
+
+    latest = [float("-inf")] * (count + 1)
+
+    for index, (pts, _) in enumerate(packets):
+        latest[index + 1] = max(latest[index], pts)
+
+    earliest = [float("inf")] * (count + 1)
+
+    for index in range(count - 1, -1, -1):
+        earliest[index] = min(earliest[index + 1], packets[index][0])
+
+    return [
+        pts
+        for index, (pts, keyframe) in enumerate(packets)
+        if keyframe
+        and latest[index] < pts
+        and earliest[index] >= pts
+    ]
+
+
+def check_constant_frame_rate(
+    packets,
+    frame_rate
+):
+
+    # Raises RangesUnsupported unless the packet timestamps
+    # follow the nominal frame rate.
+    numerator, _, denominator = frame_rate.partition("/")
+
+    rate = float(numerator) / float(denominator or 1)
+
+    if rate <= 0:
+
+        raise RangesUnsupported(
+            "The video has no frame rate."
+        )
+
+    step = 1.0 / rate
+
+    times = sorted(
+        pts
+        for pts, _ in packets
+    )
+
+    for earlier, later in zip(times, times[1:]):
+
+        if abs(later - earlier - step) > step * 0.25:
+
+            raise RangesUnsupported(
+                "Time ranges need a constant frame rate "
+                f"(a frame lasts {later - earlier:.4f} s at "
+                f"{earlier:.3f} s instead of {step:.4f} s)."
+            )
+
+    return step
+
+
+# x264 options (as written in its SEI) → x264-params names.
+# Together they decide the SPS/PPS the encoder writes.
+X264_OPTION_NAMES = {
+    "cabac": "cabac",
+    "ref": "ref",
+    "me": "me",
+    "subme": "subme",
+    "psy": "psy",
+    "mixed_ref": "mixed-refs",
+    "me_range": "merange",
+    "chroma_me": "chroma-me",
+    "trellis": "trellis",
+    "8x8dct": "8x8dct",
+    "fast_pskip": "fast-pskip",
+    "interlaced": "interlaced",
+    "constrained_intra": "constrained-intra",
+    "bframes": "bframes",
+    "b_pyramid": "b-pyramid",
+    "b_adapt": "b-adapt",
+    "b_bias": "b-bias",
+    "direct": "direct",
+    "weightb": "weightb",
+    "open_gop": "open-gop",
+    "weightp": "weightp",
+    "keyint": "keyint",
+    "keyint_min": "min-keyint",
+    "scenecut": "scenecut",
+    "rc_lookahead": "rc-lookahead",
+    "mbtree": "mbtree",
+    "qcomp": "qcomp",
+    "qpmin": "qpmin",
+    "qpmax": "qpmax",
+    "qpstep": "qpstep",
+    "ip_ratio": "ipratio"
+}
+
+
+# ffprobe chroma_location → x264 chromaloc.
+X264_CHROMA_LOCATIONS = {
+    "left": 0,
+    "center": 1,
+    "topleft": 2,
+    "top": 3,
+    "bottomleft": 4,
+    "bottom": 5
+}
+
+
+def x264_source_params(
+    path,
+    stream
+):
+
+    # x264 writes its settings into an SEI of the first
+    # frame. Returns them (plus the VUI flags from `stream`,
+    # see probe_video_stream) as an -x264-params value, or
+    # None when the source was not encoded by x264.
+    with open(path, "rb") as handle:
+        head = handle.read(8 * 1024 * 1024)
+
+    match = re.search(
+        rb"x264 - core \d+.*? - options: ([ -~]+)",
+        head
+    )
+
+    if match is None:
+        return None
+
+    options = dict(
+        item.split("=", 1)
+        for item in match.group(1).decode("ascii").split()
+        if "=" in item
+    )
+
+    params = []
+
+    for key, value in options.items():
+
+        if key in X264_OPTION_NAMES:
+
+            params.append(
+                f"{X264_OPTION_NAMES[key]}={value}"
+            )
+
+        elif key == "deblock":
+
+            enabled, alpha, beta = value.split(":")
+
+            if enabled == "0":
+                params.append("no-deblock=1")
+            else:
+                params.append(f"deblock={alpha},{beta}")
+
+        elif key == "psy_rd":
+
+            params.append(
+                "psy-rd=" + value.replace(":", ",")
+            )
+
+        elif key == "deadzone":
+
+            inter, intra = value.split(",")
+
+            params += [
+                f"deadzone-inter={inter}",
+                f"deadzone-intra={intra}"
+            ]
+
+        elif key == "aq":
+
+            mode, strength = value.split(":")
+
+            params += [
+                f"aq-mode={mode}",
+                f"aq-strength={strength}"
+            ]
+
+        elif key in ("crf", "qp") and options.get("rc") == key:
+
+            params.append(
+                f"{key}={value}"
+            )
+
+    # The SPS also signals aspect ratio and colour, which
+    # x264 only knows when told.
+    sar = stream.get("sample_aspect_ratio")
+
+    # "1/1", as ":" separates the params.
+    if sar and sar not in ("0:1", "N/A"):
+        params.append("sar=" + sar.replace(":", "/"))
+
+    if stream.get("color_range") == "pc":
+        params.append("fullrange=on")
+
+    for key, name in (
+        ("color_primaries", "colorprim"),
+        ("color_transfer", "transfer"),
+        ("color_space", "colormatrix")
+    ):
+
+        value = stream.get(key)
+
+        if value and value != "unknown":
+            params.append(f"{name}={value}")
+
+    if stream.get("chroma_location") in X264_CHROMA_LOCATIONS:
+
+        params.append(
+            "chromaloc="
+            + str(X264_CHROMA_LOCATIONS[stream["chroma_location"]])
+        )
+
+    return ":".join(params)
+
+
+def _extradata_hash(path):
+
+    # Hash of the avcC (SPS/PPS) of an MP4 piece.
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+
+            "-show_data_hash",
+            "md5",
+
+            "-select_streams",
+            "v:0",
+
+            "-show_entries",
+            "stream=extradata_hash",
+
+            "-of",
+            "csv=p=0",
+
+            path
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+
+    if result.returncode != 0:
+
+        raise RuntimeError(
+            "ffprobe failed:\n\n"
+            + result.stderr[-4000:]
+        )
+
+    return result.stdout.strip()
+
+
+def align_ranges(
+    ranges,
+    keyframes,
+    duration
+):
+
+    spans = []
+
+    for start, end in ranges:
+
+        if end is None or end > duration:
+            end = duration
+
+        start = max(0.0, start)
+
+        if start >= end:
+            continue
+
+        before = [
+            time_ for time_ in keyframes
+            if time_ <= start
+        ]
+
+        after = [
+            time_ for time_ in keyframes
+            if time_ >= end
+        ]
+
+        spans.append(
+            (
+                before[-1] if before else 0.0,
+                after[0] if after else duration
+            )
+        )
+
+    # Merge spans that touch or overlap.
+    merged = []
+
+    for start, end in sorted(spans):
+
+        if merged and start <= merged[-1][1]:
+
+            merged[-1] = (
+                merged[-1][0],
+                max(merged[-1][1], end)
+            )
+
+        else:
+
+            merged.append(
+                (start, end)
+            )
+
+    return merged
+
+
+def plan_pieces(
+    spans,
+    duration
+):
+
+    pieces = []
+
+    position = 0.0
+
+    for start, end in spans:
+
+        if start > position:
+
+            pieces.append(
+                ("copy", position, start)
+            )
+
+        pieces.append(
+            ("process", start, end)
+        )
+
+        position = end
+
+    if position < duration:
+
+        pieces.append(
+            ("copy", position, duration)
+        )
+
+    return pieces
+
+
+def detect_active_ranges(
+    path,
+    mask
+):
+
+    # Samples the video every RANGE_SAMPLE_STEP seconds (by
+    # seeking) and keeps the times at which the mask area is
+    # clearly busier than its surroundings.
+    info = probe_video(
+        path
+    )
+
+    mask = fit_mask(
+        mask,
+        info["width"],
+        info["height"]
+    )
+
+    ring = cv2.subtract(
+        cv2.dilate(
+            mask,
+            cv2.getStructuringElement(
+                cv2.MORPH_ELLIPSE,
+                (
+                    BACKGROUND_RING * 2 + 1,
+                    BACKGROUND_RING * 2 + 1
+                )
+            )
+        ),
+        mask
+    )
+
+    inside = mask > 0
+    around = ring > 0
+
+    if not inside.any() or not around.any():
+        return []
+
+    duration = info["frames"] / info["fps"]
+
+    step = max(
+        RANGE_SAMPLE_STEP,
+        duration / RANGE_MAX_SAMPLES
+    )
+
+    cap = cv2.VideoCapture(
+        path
+    )
+
+    present = []
+
+    try:
+
+        time_ = 0.0
+
+        while time_ < duration:
+
+            cap.set(
+                cv2.CAP_PROP_POS_FRAMES,
+                int(time_ * info["fps"])
+            )
+
+            ok, frame = cap.read()
+
+            if ok:
+
+                edges = cv2.Canny(
+                    cv2.cvtColor(
+                        frame,
+                        cv2.COLOR_BGR2GRAY
+                    ),
+                    50,
+                    150
+                ) > 0
+
+                density = float(edges[inside].mean())
+                background = float(edges[around].mean())
+
+                present.append(
+                    (
+                        time_,
+                        density >= RANGE_MIN_EDGE_DENSITY
+                        and density >= background * RANGE_EDGE_RATIO
+                    )
+                )
+
+            time_ += step
+
+    finally:
+
+        cap.release()
+
+    # Every positive sample covers the time up to its
+    # neighbours; keyframe alignment widens it further.
+    ranges = []
+
+    for time_, visible in present:
+
+        if not visible:
+            continue
+
+        start = max(0.0, time_ - step)
+        end = min(duration, time_ + step)
+
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+
+    return ranges
+
+
+def _split_pieces(
+    path,
+    cut_times,
+    pattern
+):
+
+    # One stream-copy pass. The segment muxer only splits on
+    # keyframes, before the first one at or after each time,
+    # so every packet lands in exactly one piece. Timestamps
+    # are kept (-copyts) so the times match ffprobe's.
+    command = [
+        "ffmpeg",
+        "-y",
+        "-loglevel",
+        "error",
+
+        "-copyts",
+
+        "-i",
+        path,
+
+        "-map",
+        "0:v:0",
+
+        "-c",
+        "copy",
+
+        "-f",
+        "segment",
+
+        "-segment_format",
+        "mp4"
+    ]
+
+    if cut_times:
+
+        command += [
+            "-segment_times",
+            ",".join(
+                f"{time_:.6f}"
+                for time_ in cut_times
+            )
+        ]
+
+    else:
+
+        # The muxer would otherwise cut every 2 seconds.
+        command += [
+            "-segment_time",
+            "1000000000"
+        ]
+
+    command += [
+        pattern
+    ]
+
+    result = subprocess.run(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+
+    if result.returncode != 0:
+
+        raise RuntimeError(
+            "FFmpeg could not split the video:\n\n"
+            + result.stderr[-4000:]
+        )
+
+    return [
+        pattern % index
+        for index in range(len(cut_times) + 1)
+    ]
+
+
+def _check_encoder_match(
+    part,
+    trial_path,
+    width,
+    height,
+    frame_rate,
+    x264_params
+):
+
+    # Encodes the first frame of a piece with the source's
+    # settings. The SPS/PPS only depend on the settings, the
+    # frame size and the rate, so one frame tells whether the
+    # processed pieces will fit the source's avcC.
+    cap = cv2.VideoCapture(
+        part
+    )
+
+    ok, frame = cap.read()
+
+    cap.release()
+
+    if not ok:
+
+        raise RangesUnsupported(
+            "The first piece to process cannot be decoded."
+        )
+
+    writer = FFmpegFrameWriter(
+        trial_path,
+        width,
+        height,
+        frame_rate,
+        x264_params=x264_params
+    )
+
+    try:
+
+        writer.write(
+            frame
+        )
+
+    finally:
+
+        writer.release()
+
+    try:
+
+        if writer.returncode != 0:
+
+            raise RangesUnsupported(
+                "The source's x264 settings cannot be "
+                "reproduced:\n\n"
+                + writer.error_output()
+            )
+
+        if _extradata_hash(trial_path) != _extradata_hash(part):
+
+            raise RangesUnsupported(
+                "Re-encoded frames would not match the "
+                "source's H.264 parameter sets."
+            )
+
+    finally:
+
+        if os.path.exists(trial_path):
+            os.remove(trial_path)
+
+
+def remove_watermark_ranges(
+    path,
+    output_path,
+    ranges,
+    process_batch,
+    width,
+    height,
+    queue_depth=PIPELINE_QUEUE_DEPTH,
+    batch_size=LAMA_BATCH_SIZE,
+    on_progress=None,
+    timer=None
+):
+
+    stream = probe_video_stream(
+        path
+    )
+
+    if stream["codec"] != "h264" or stream["pix_fmt"] != "yuv420p":
+
+        raise RangesUnsupported(
+            "Time ranges need an H.264 yuv420p source for stream "
+            f"copy (this is {stream['codec']} {stream['pix_fmt']})."
+        )
+
+    x264_params = x264_source_params(
+        path,
+        stream
+    )
+
+    if x264_params is None:
+
+        raise RangesUnsupported(
+            "Time ranges need an x264-encoded source so the "
+            "processed pieces can match its encoder settings."
+        )
+
+    packets = probe_packets(
+        path
+    )
+
+    step = check_constant_frame_rate(
+        packets,
+        stream["frame_rate"]
+    )
+
+    # Times relative to the first frame, as the ranges are.
+    origin = min(
+        pts
+        for pts, _ in packets
+    )
+
+    duration = max(
+        pts
+        for pts, _ in packets
+    ) - origin + step
+
+    keyframes = [
+        time_ - origin
+        for time_ in clean_keyframes(packets)
+    ]
+
+    spans = align_ranges(
+        ranges,
+        keyframes,
+        duration
+    )
+
+    if not spans:
+
+        raise RangesUnsupported(
+            "The time ranges are outside the video."
+        )
+
+    pieces = plan_pieces(
+        spans,
+        duration
+    )
+
+    # Every cut is a clean keyframe; half a frame earlier
+    # keeps the comparison safe from rounding.
+    cut_times = [
+        origin + start - step / 2
+        for _, start, _ in pieces[1:]
+    ]
+
+    # Packets each piece must receive.
+    expected = [
+        sum(
+            1
+            for pts, _ in packets
+            if start - step / 2 <= pts - origin < end - step / 2
+        )
+        for _, start, end in pieces
+    ]
+
+    parts = []
+    segments = []
+
+    summary = {
+        "frames": 0,
+        "copied_seconds": 0.0,
+        "processed_seconds": 0.0,
+        "spans": spans
+    }
+
+    try:
+
+        split = _split_pieces
+
+        if timer is not None:
+
+            split = timer.wrap(
+                "mux",
+                split
+            )
+
+        parts = split(
+            path,
+            cut_times,
+            f"{output_path}.part%03d.mp4"
+        )
+
+        # ----------------------------------------------------
+        # Validate everything before the first frame is
+        # inpainted.
+        # ----------------------------------------------------
+
+        counts = []
+
+        for index, (kind, start, end) in enumerate(pieces):
+
+            part = parts[index]
+
+            count = (
+                len(probe_packets(part))
+                if os.path.exists(part)
+                else 0
+            )
+
+            if count != expected[index]:
+
+                raise RangesUnsupported(
+                    f"Splitting at {start:.3f} s gave {count} "
+                    f"frames instead of {expected[index]}."
+                )
+
+            counts.append(
+                count
+            )
+
+        first = next(
+            index
+            for index, (kind, _, _) in enumerate(pieces)
+            if kind == "process"
+        )
+
+        _check_encoder_match(
+            parts[first],
+            f"{output_path}.trial.mp4",
+            width,
+            height,
+            stream["frame_rate"],
+            x264_params
+        )
+
+        # ----------------------------------------------------
+        # Process.
+        # ----------------------------------------------------
+
+        for index, (kind, start, end) in enumerate(pieces):
+
+            part = parts[index]
+
+            count = counts[index]
+
+            if kind == "copy":
+
+                segments.append(
+                    part
+                )
+
+                summary["copied_seconds"] += end - start
+
+                continue
+
+            segment = f"{output_path}.piece{index:03d}.mp4"
+
+            segments.append(
+                segment
+            )
+
+            # The piece is decoded from its own file: no seeking
+            # and no frame-index maths.
+            cap = cv2.VideoCapture(
+                part
+            )
+
+            reader = cap
+
+            if timer is not None:
+
+                reader = TimedCapture(
+                    reader,
+                    timer
+                )
+
+            writer = FFmpegFrameWriter(
+                segment,
+                width,
+                height,
+                stream["frame_rate"],
+                x264_params=x264_params
+            )
+
+            write_frame = writer.write
+
+            if timer is not None:
+
+                write_frame = timer.wrap(
+                    "encode",
+                    write_frame
+                )
+
+            done = summary["frames"]
+
+            def progress(processed):
+
+                if on_progress is not None:
+                    on_progress(done + processed)
+
+            try:
+
+                processed = run_frame_pipeline(
+                    reader,
+                    process_batch,
+                    write_frame,
+                    queue_depth=queue_depth,
+                    batch_size=batch_size,
+                    on_progress=progress
+                )
+
+            finally:
+
+                cap.release()
+                writer.release()
+
+            if writer.returncode != 0:
+
+                raise RuntimeError(
+                    "FFmpeg failed on a processed piece:\n\n"
+                    + writer.error_output()
+                )
+
+            if processed != count:
+
+                raise RuntimeError(
+                    f"Decoded {processed} of {count} frames of the "
+                    f"piece at {start:.3f} s."
+                )
+
+            # One avcC covers the joined video, so the encoded
+            # piece must carry the same SPS/PPS as the source.
+            if _extradata_hash(segment) != _extradata_hash(part):
+
+                raise RuntimeError(
+                    "The re-encoded piece does not match the "
+                    "source's H.264 parameter sets."
+                )
+
+            summary["frames"] += processed
+            summary["processed_seconds"] += end - start
+
+        join = concat_segments
+
+        if timer is not None:
+
+            join = timer.wrap(
+                "mux",
+                join
+            )
+
+        join(
+            segments,
+            output_path,
+            audio_source=path
+        )
+
+    except BaseException:
+
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        raise
+
+    finally:
+
+        for piece in set(parts + segments):
+
+            if os.path.exists(piece):
+                os.remove(piece)
+
+    return summary
+
+
+# ============================================================
+# SINGLE VIDEO JOB (HEADLESS)
+#
+# The complete streamed removal for one file, without any UI:
+# fit the mask to the video, plan the regions, run the frame
+# pipeline and encode with the source audio.
+#
+# `on_progress(processed, total)` is called from the AI stage.
+# With a StageTimer, the time of every stage is recorded.
+# With `ranges`, only those time ranges are processed
+# (RangesUnsupported when the video cannot be split).
+# `context_padding` may be CONTEXT_AUTO (adaptive context).
+# ============================================================
+
+def probe_video(path):
+
+    cap = cv2.VideoCapture(
+        path
+    )
+
+    if not cap.isOpened():
+
+        raise RuntimeError(
+            f"Could not open video: {path}"
+        )
+
+    fps = cap.get(
+        cv2.CAP_PROP_FPS
+    )
+
+    info = {
+        "width": int(
+            cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        ),
+        "height": int(
+            cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        ),
+        "fps": fps if fps and fps > 0 else 30.0,
+        "frames": int(
+            cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        )
+    }
+
+    cap.release()
+
+    return info
+
+
+def fit_mask(
+    mask,
+    width,
+    height
+):
+
+    mask = np.asarray(
+        mask
+    )
+
+    if mask.ndim == 3:
+        mask = mask[:, :, 0]
+
+    if mask.shape[1] != width or mask.shape[0] != height:
+
+        mask = cv2.resize(
+            mask,
+            (
+                width,
+                height
+            ),
+            interpolation=cv2.INTER_NEAREST
+        )
+
+    return np.where(
+        mask > 10,
+        255,
+        0
+    ).astype(np.uint8)
+
+
+def process_video(
+    path,
+    output_path,
+    mask,
+    inpaint,
+    context_padding=180,
+    queue_depth=PIPELINE_QUEUE_DEPTH,
+    batch_size=LAMA_BATCH_SIZE,
+    reuse_threshold=REUSE_THRESHOLD,
+    on_progress=None,
+    timer=None,
+    ranges=None,
+    flow_interval=FLOW_INTERVAL
+):
+
+    info = probe_video(
+        path
+    )
+
+    mask = fit_mask(
+        mask,
+        info["width"],
+        info["height"]
+    )
+
+    regions, context_padding = plan_context_regions(
+        path,
+        mask,
+        context_padding
+    )
+
+    if not regions:
+
+        raise ValueError(
+            "Watermark mask is empty."
+        )
+
+    cache = InpaintReuseCache(
+        reuse_threshold
+    )
+
+    flow = FlowPropagator(
+        flow_interval
+    )
+
+    process_batch = make_batch_processor(
+        inpaint,
+        regions,
+        cache=cache,
+        timer=timer,
+        flow=flow
+    )
+
+    def progress(processed):
+
+        if on_progress is not None:
+
+            on_progress(
+                processed,
+                info["frames"]
+            )
+
+    # Only the watermarked time ranges are processed; the
+    # rest of the video is stream-copied.
+    if ranges:
+
+        summary = remove_watermark_ranges(
+            path,
+            output_path,
+            ranges,
+            process_batch,
+            info["width"],
+            info["height"],
+            queue_depth=queue_depth,
+            batch_size=batch_size,
+            on_progress=progress,
+            timer=timer
+        )
+
+        summary.update(
+            cache.stats()
+        )
+
+        summary.update(
+            flow.stats()
+        )
+
+        summary["regions"] = describe_regions(regions)
+        summary["context"] = context_padding
+
+        return summary
+
+    cap = cv2.VideoCapture(
+        path
+    )
+
+    writer = FFmpegFrameWriter(
+        output_path,
+        info["width"],
+        info["height"],
+        info["fps"],
+        audio_source=path
+    )
+
+    reader = cap
+
+    write_frame = writer.write
+
+    release_writer = writer.release
+
+    if timer is not None:
+
+        reader = TimedCapture(
+            cap,
+            timer
+        )
+
+        write_frame = timer.wrap(
+            "encode",
+            write_frame
+        )
+
+        release_writer = timer.wrap(
+            "mux",
+            release_writer
+        )
+
+    try:
+
+        processed = run_frame_pipeline(
+            reader,
+            process_batch,
+            write_frame,
+            queue_depth=queue_depth,
+            batch_size=batch_size,
+            on_progress=progress
+        )
+
+    except BaseException:
+
+        cap.release()
+        writer.release()
+
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        raise
+
+    cap.release()
+
+    if release_writer() != 0:
+
+        raise RuntimeError(
+            "FFmpeg failed:\n\n"
+            + writer.error_output()
+        )
+
+    if processed == 0:
+
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        raise RuntimeError(
+            "No frames were processed."
+        )
+
+    summary = cache.stats()
+
+    summary.update(
+        flow.stats()
+    )
+
+    summary["frames"] = processed
+    summary["regions"] = describe_regions(regions)
+    summary["context"] = context_padding
+
+    return summary
+
+
+# ============================================================
+# PREVIEW
+#
+# Cleans a few evenly spaced frames with the real settings
+# (mask, context, engine) so a bad mask shows up in seconds
+# instead of after the full run.
+#
+# The measured cost per frame also gives an estimate for the
+# whole job: decode + AI + x264 encode. The first AI batch
+# includes model warm-up and is left out of the estimate when
+# there are more batches. Stages overlap in the real run and
+# the reuse cache is off here, so the estimate is an upper
+# bound.
+# ============================================================
+
+PREVIEW_FRAMES = 6
+
+
+def _preview_encode_seconds(
+    frames,
+    fps
+):
+
+    # x264 with the settings of the real output. FFmpeg start-up
+    # is included, so a short sample errs on the high side.
+    if shutil.which("ffmpeg") is None:
+        return None
+
+    height, width = frames[0].shape[:2]
+
+    handle, path = tempfile.mkstemp(
+        suffix=".mp4"
+    )
+
+    os.close(handle)
+
+    try:
+
+        started = time.perf_counter()
+
+        writer = FFmpegFrameWriter(
+            path,
+            width,
+            height,
+            fps
+        )
+
+        for frame in frames:
+            writer.write(frame)
+
+        if writer.release() != 0:
+            return None
+
+        return (
+            time.perf_counter() - started
+        ) / len(frames)
+
+    finally:
+
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def render_preview(
+    path,
+    mask,
+    inpaint,
+    context_padding=180,
+    count=PREVIEW_FRAMES,
+    batch_size=LAMA_BATCH_SIZE
+):
+
+    info = probe_video(
+        path
+    )
+
+    mask = fit_mask(
+        mask,
+        info["width"],
+        info["height"]
+    )
+
+    regions, context_padding = plan_context_regions(
+        path,
+        mask,
+        context_padding
+    )
+
+    if not regions:
+
+        raise ValueError(
+            "Watermark mask is empty."
+        )
+
+    process_batch = make_batch_processor(
+        inpaint,
+        regions
+    )
+
+    cap = cv2.VideoCapture(
+        path
+    )
+
+    samples = []
+
+    decode = []
+
+    try:
+
+        for index in _sample_indices(info["frames"], count):
+
+            cap.set(
+                cv2.CAP_PROP_POS_FRAMES,
+                index
+            )
+
+            ok, frame = cap.read()
+
+            if not ok:
+                continue
+
+            samples.append(
+                (index, frame)
+            )
+
+            # The seek decodes from the last keyframe; the next
+            # frame costs what the sequential full run pays.
+            started = time.perf_counter()
+
+            if cap.read()[0]:
+
+                decode.append(
+                    time.perf_counter() - started
+                )
+
+    finally:
+
+        cap.release()
+
+    if not samples:
+
+        raise RuntimeError(
+            "Could not read any frame for the preview."
+        )
+
+    batch_size = max(
+        1,
+        int(batch_size)
+    )
+
+    frames = [
+        frame.copy()
+        for _, frame in samples
+    ]
+
+    timings = []
+
+    for start in range(0, len(frames), batch_size):
+
+        batch = frames[start:start + batch_size]
+
+        started = time.perf_counter()
+
+        process_batch(
+            batch
+        )
+
+        timings.append(
+            (len(batch), time.perf_counter() - started)
+        )
+
+    if len(timings) > 1:
+        timings = timings[1:]
+
+    inpaint_seconds = (
+        sum(seconds for _, seconds in timings)
+        / sum(size for size, _ in timings)
+    )
+
+    decode_seconds = (
+        sum(decode) / len(decode)
+        if decode
+        else 0.0
+    )
+
+    encode_seconds = _preview_encode_seconds(
+        frames,
+        info["fps"]
+    )
+
+    per_frame = (
+        decode_seconds
+        + inpaint_seconds
+        + (encode_seconds or 0.0)
+    )
+
+    return {
+        "frames": [
+            {
+                "frame": index,
+                "time": index / info["fps"],
+                "before": before,
+                "after": after
+            }
+            for (index, before), after in zip(samples, frames)
+        ],
+        "decode_seconds": decode_seconds,
+        "inpaint_seconds": inpaint_seconds,
+        "encode_seconds": encode_seconds,
+        "seconds_per_frame": per_frame,
+        "estimate_seconds": per_frame * info["frames"],
+        "total_frames": info["frames"],
+        "regions": describe_regions(regions),
+        "context": context_padding,
+        "box": (
+            min(region["box"][0] for region in regions),
+            min(region["box"][1] for region in regions),
+            max(region["box"][2] for region in regions),
+            max(region["box"][3] for region in regions)
+        )
+    }
+
+
+def preview_image(
+    sample,
+    box
+):
+
+    # Before | after of the area around the watermark, RGB.
+    x1, y1, x2, y2 = box
+
+    before = sample["before"][y1:y2, x1:x2]
+    after = sample["after"][y1:y2, x1:x2]
+
+    divider = np.full(
+        (before.shape[0], 4, 3),
+        255,
+        dtype=np.uint8
+    )
+
+    return cv2.cvtColor(
+        np.hstack(
+            [
+                before,
+                divider,
+                after
+            ]
+        ),
+        cv2.COLOR_BGR2RGB
+    )
+
+
+def _clock(seconds):
+
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+    return f"{minutes}:{seconds:02d}"
+
+
+def format_preview(preview):
+
+    if preview["encode_seconds"] is None:
+        encode = "encode not measured (no FFmpeg)"
+    else:
+        encode = f"encode {preview['encode_seconds'] * 1000:.0f} ms"
+
+    return "\n".join(
+        [
+            "### 👁️ Preview",
+            "",
+            f"**Frames:** "
+            + ", ".join(
+                f"`{_clock(sample['time'])}`"
+                for sample in preview["frames"]
+            )
+            + f" · **AI regions:** `{preview['regions']}`"
+            + f" · **Context:** `{preview['context']}px`",
+            "",
+            f"**Cost:** `{preview['seconds_per_frame'] * 1000:.0f} ms/frame` "
+            f"(decode {preview['decode_seconds'] * 1000:.0f} ms · "
+            f"AI {preview['inpaint_seconds'] * 1000:.0f} ms · "
+            f"{encode}) · "
+            f"**Estimated full run:** "
+            f"`~{_clock(preview['estimate_seconds'])}` "
+            f"for {preview['total_frames']} frames",
+            "",
+            "Static Background Reuse and Time Ranges can make the "
+            "real run shorter."
+        ]
+    )
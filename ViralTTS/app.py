@@ -7,7 +7,7 @@ USAGE:
     python app.py list English
     python app.py list Hindi
     python app.py list Spanish
-    python app.py <voice-selector> script.txt [output.wav|output.mp3] [--style STYLE]
+    python app.py <voice-selector> script.txt [output.wav|output.mp3] [--style STYLE] [--parallel N]
 
 EXAMPLES:
     python app.py brian-multilingual script.txt voiceover.mp3 --style narrative
@@ -516,6 +516,12 @@ STYLES = {
 DEFAULT_VOICE = "brian-multilingual"
 SAMPLE_RATE = 48000
 MAX_CHARS = 4800
+# Passages synthesized at the same time. Each one is an independent network
+# round trip, so long scripts are dominated by latency when run one by one.
+DEFAULT_PARALLEL = 4
+# Minimum gap between the start of two TTS requests, to stay polite to the
+# free Edge endpoint even when several passages are in flight.
+REQUEST_SPACING = 0.08
 
 
 def voice_base_settings(voice: dict) -> tuple[str, str]:
@@ -769,9 +775,8 @@ def master_audio(source: Path, destination: Path, style: str) -> None:
 
 async def build_voiceover(
     chunks: list[str], voice_id: str, rate: str, pitch: str,
-    workdir: Path, style: str
+    workdir: Path, style: str, parallel: int = DEFAULT_PARALLEL
 ) -> Path:
-    parts: list[Path] = []
     pause_lengths = {
         "natural": 480,
         "narrative": 620,
@@ -783,7 +788,15 @@ async def build_voiceover(
     pause = workdir / "style_pause.wav"
     make_silence(pause_lengths[style], pause)
 
-    for index, chunk in enumerate(chunks, start=1):
+    # Passages run concurrently, at most `parallel` at a time. Each one keeps
+    # its own retry ladder inside synthesize_chunk() and its own file names,
+    # so the parts are put back together in script order afterwards.
+    slots = asyncio.Semaphore(parallel)
+    pacing = asyncio.Lock()
+    finished = 0
+
+    async def render(index: int, chunk: str) -> Path:
+        nonlocal finished
         encoded = workdir / f"speech_{index:04d}.mp3"
         wav = workdir / f"speech_{index:04d}.wav"
 
@@ -791,19 +804,42 @@ async def build_voiceover(
         # cycling between sentences causes audible voice resets and artifacts.
         chunk_rate = rate
         chunk_pitch = pitch
-        await synthesize_chunk(
-            chunk, voice_id, chunk_rate, chunk_pitch, encoded
-        )
-        convert_to_wav(encoded, wav)
-        parts.append(wav)
-        if index < len(chunks):
-            parts.append(pause)
+        async with slots:
+            async with pacing:
+                await asyncio.sleep(REQUEST_SPACING)
+            await synthesize_chunk(
+                chunk, voice_id, chunk_rate, chunk_pitch, encoded
+            )
+        # FFmpeg runs in a thread so the other requests keep going.
+        await asyncio.to_thread(convert_to_wav, encoded, wav)
+        finished += 1
         print(
             f"  Segment {index}/{len(chunks)} "
-            f"(rate {chunk_rate}, pitch {chunk_pitch})",
+            f"(rate {chunk_rate}, pitch {chunk_pitch}) "
+            f"[{finished}/{len(chunks)} done]",
             file=sys.stderr,
         )
-        await asyncio.sleep(0.08)
+        return wav
+
+    tasks = [
+        asyncio.create_task(render(index, chunk))
+        for index, chunk in enumerate(chunks, start=1)
+    ]
+    try:
+        speech = await asyncio.gather(*tasks)
+    except BaseException:
+        # One passage failed for good: stop the others instead of letting
+        # them keep requesting speech that will never be used.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    parts: list[Path] = []
+    for index, wav in enumerate(speech, start=1):
+        parts.append(wav)
+        if index < len(speech):
+            parts.append(pause)
 
     joined = workdir / "joined.wav"
     concat_audio(parts, joined)
@@ -890,12 +926,23 @@ def list_voices(query: str | None = None) -> None:
     print("  python app.py brian-hindi hinglish.txt hinglish.mp3 --style natural\n")
 
 
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="ViralTTS neural voiceover generator")
     parser.add_argument("voice", nargs="?", help="Voice name, or 'list'")
     parser.add_argument("script", nargs="?", help="UTF-8 text file")
     parser.add_argument("output", nargs="?", default="voiceover.wav", help="Output WAV or MP3")
     parser.add_argument("--style", choices=STYLES, default="narrative", help="Delivery style")
+    parser.add_argument(
+        "--parallel", type=positive_int, default=DEFAULT_PARALLEL,
+        help=f"Passages synthesized at the same time (default: {DEFAULT_PARALLEL})",
+    )
     return parser.parse_args()
 
 
@@ -954,14 +1001,18 @@ def main() -> None:
         f"style: {args.style}; rate: {rate}; pitch: {pitch}",
         file=sys.stderr,
     )
-    print(f"Passages: {len(chunks)}", file=sys.stderr)
+    print(
+        f"Passages: {len(chunks)} (up to {args.parallel} at a time)",
+        file=sys.stderr,
+    )
 
     try:
         with tempfile.TemporaryDirectory(prefix="viraltts_") as temp_dir:
             workdir = Path(temp_dir)
             joined = asyncio.run(
                 build_voiceover(
-                    chunks, voice_id, rate, pitch, workdir, args.style
+                    chunks, voice_id, rate, pitch, workdir, args.style,
+                    args.parallel,
                 )
             )
             print("Mastering clean 48 kHz audio...", file=sys.stderr)